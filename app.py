@@ -16,6 +16,7 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 # Import our custom modules
 from rank import Ranker
+from categories import CategoryRankings, available_groups, load_group_ranker
 
 # Page configuration
 st.set_page_config(
@@ -68,12 +69,35 @@ if 'rankings_df' not in st.session_state:
     st.session_state.rankings_df = None
 if 'selected_runner' not in st.session_state:
     st.session_state.selected_runner = None
+if 'rankings_signature' not in st.session_state:
+    st.session_state.rankings_signature = None
+if 'profile_report' not in st.session_state:
+    st.session_state.profile_report = None
+
+RANKING_FILE = "data/csv/ranking.csv"
+# Files read when loading existing rankings: the shared ranker is rebuilt when one of them changes
+RANKING_CACHE_FILES = [RANKING_FILE] + [os.path.join('./cache', file) for file in 
+                       ['identities.npz', 'processed_races.json', 'race_history.npz', 'race_history.log', 'rating_state.ckpt', 'rating_timeline.npz',
+                        'review_queue.json', 'review_state.ckpt']]
+
+def rankings_signature(paths=RANKING_CACHE_FILES):
+    """
+    Modification time and size of each file read when loading existing rankings
+    """
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append((path, None, None))
+    return tuple(signature)
 
 def load_existing_rankings():
     """
     Load existing rankings from data/csv/ranking.csv if it exists
     """
-    ranking_file = "data/csv/ranking.csv"
+    ranking_file = RANKING_FILE
     if os.path.exists(ranking_file):
         try:
             df = pd.read_csv(ranking_file)
@@ -85,12 +109,41 @@ def load_existing_rankings():
             return None, None
     return None, None
 
-# Load existing rankings on app start
-if st.session_state.rankings_df is None:
-    existing_rankings, existing_ranker = load_existing_rankings()
+@st.cache_resource(max_entries=1, show_spinner="Loading rankings...")
+def load_shared_rankings(signature, _rankings_df=None, _ranker=None):
+    """
+    Rankings and ranker shared by every session, loaded once per version of the cache files (signature).
+    They are read-only: sessions must not modify them.
+
+    Args:
+        signature (tuple): rankings_signature() of the files the rankings were loaded from
+        _rankings_df (pd.DataFrame, optional): rankings just calculated, used instead of reading them again. Defaults to None.
+        _ranker (Ranker, optional): ranker which calculated _rankings_df. Defaults to None.
+    """
+    if _ranker is not None:
+        return _rankings_df, _ranker
+    return load_existing_rankings()
+
+@st.cache_resource(max_entries=16, show_spinner="Loading category rankings...")
+def load_category_rankings(group, signature):
+    """
+    Rankings and ranker of one category, shared by every session and loaded once per version of its files (signature)
+    """
+    return load_group_ranker(group)
+
+def category_signature(group):
+    cache_dir, _, ranking_file = CategoryRankings({group: []}).group_paths(group)
+    return rankings_signature([ranking_file] + [os.path.join(cache_dir, file) for file in 
+                              ['processed_races.json', 'race_history.npz', 'race_history.log', 'rating_state.ckpt', 'rating_timeline.npz']])
+
+# Load existing rankings on app start, and again when they were updated (e.g. by another session)
+current_signature = rankings_signature()
+if st.session_state.rankings_signature != current_signature:
+    existing_rankings, existing_ranker = load_shared_rankings(current_signature)
     if existing_rankings is not None:
         st.session_state.rankings_df = existing_rankings
         st.session_state.ranker = existing_ranker
+        st.session_state.rankings_signature = current_signature
         # Show success message in sidebar
         st.sidebar.success("✅ Loaded existing rankings from data/csv/ranking.csv")
 
@@ -148,15 +201,22 @@ def main():
         # Ranking section
         st.subheader("🏆 Calculate Rankings")
         previous_rank_file = 'data/csv/ranking.csv' if os.path.exists('data/csv/ranking.csv') else None
+        by_category = st.checkbox("Per-category rankings", value=False, help="Also compute one ranking per age category, in parallel")
+        profile = st.checkbox("Profile ranking", value=False, help="Record the time spent in each stage of the ranking")
         
         if st.button("Calculate Rankings", type="primary"):
             with st.spinner("Calculating rankings..."):
                 #try:
                     # Initialize ranker
-                    ranker = Ranker(previous_rank=previous_rank_file)
-                    
-                    # Process all races
-                    ranker.rank(folder="data/csv")
+                    if by_category:
+                        # Overall ranking, and the ranking of each category in worker processes
+                        ranker, _ = CategoryRankings().rank("data/csv", previous_rank=previous_rank_file, profile=profile, review='defer')
+                    else:
+                        # Similar names are not asked about here: they go to the review queue below
+                        ranker = Ranker(previous_rank=previous_rank_file, profile=profile, review='defer')
+                        
+                        # Process all races
+                        ranker.rank(folder="data/csv")
                     
                     # Get filtered rankings with minimum races requirement
                     min_races = st.session_state.get('min_races', 3)
@@ -168,16 +228,71 @@ def main():
                     rankings_df = rankings_df[['rank', 'name', 'rating', 'sigma', 'races_participated']]
                     
                     # Save rankings
-                    ranker.save_rankings(folder="data/csv", fname="ranking", ext="csv")
+                    saved_rankings_df = ranker.save_rankings(folder="data/csv", fname="ranking", ext="csv")
+                    ranker.publish_web_files()
+                    st.session_state.profile_report = ranker.profiler.report() if profile else None
+                    
+                    # Share the new ranker with every session, instead of loading it again from the files just written
+                    signature = rankings_signature()
+                    load_shared_rankings(signature, _rankings_df=saved_rankings_df, _ranker=ranker)
                     
                     # Store in session state
                     st.session_state.ranker = ranker
                     st.session_state.rankings_df = rankings_df
+                    st.session_state.rankings_signature = signature
                     
                     st.success("✅ Rankings calculated successfully!")
                 #except Exception as e:
                 #    st.error(f"❌ Error calculating rankings: {str(e)}")
-        
+
+        # Timings and counters of the last profiled ranking
+        if st.session_state.profile_report:
+            with st.expander("⏱️ Ranking profile"):
+                profile_df = pd.DataFrame.from_dict(st.session_state.profile_report, orient='index')
+                profile_df.index.name = 'stage'
+                st.dataframe(profile_df, use_container_width=True)
+
+        # Similar names deferred by the last ranking, decided in one batch
+        pending_reviews = st.session_state.ranker.pending_reviews() if st.session_state.ranker is not None else []
+        if pending_reviews:
+            with st.expander(f"🔍 Name reviews ({len(pending_reviews)} pending)"):
+                st.caption("Are these names the same runner? Undecided pairs keep their provisional decision.")
+                choices = ['Undecided', 'Same runner', 'Different runners']
+                with st.form("name_reviews"):
+                    decisions = {}
+                    for entry in pending_reviews:
+                        choice = st.radio(f"{entry['name']} / {entry['candidate']}", choices, horizontal=True,
+                                          key=f"review_{'|'.join(entry['pair'])}",
+                                          help=f"Similarity {entry['score']:.2f}, provisionally {entry['provisional']}, in {', '.join(entry['races'])}")
+                        if choice != 'Undecided':
+                            decisions[tuple(entry['pair'])] = choice == 'Same runner'
+                    apply = st.form_submit_button("Apply decisions")
+                if apply and decisions:
+                    try:
+                        with st.spinner("Applying decisions..."):
+                            # The shared ranker is read-only: decisions are applied to a new one
+                            ranker = Ranker(previous_rank=RANKING_FILE, review='defer')
+                            n_replayed = ranker.apply_reviews(decisions, folder="data/csv")
+                            
+                            min_races = st.session_state.get('min_races', 3)
+                            rankings_df = pd.DataFrame(ranker.get_rankings(min_races=min_races), columns=['name', 'rating', 'sigma', 'races_participated'])
+                            rankings_df['rank'] = range(1, len(rankings_df) + 1)
+                            rankings_df = rankings_df[['rank', 'name', 'rating', 'sigma', 'races_participated']]
+                            saved_rankings_df = ranker.save_rankings(folder="data/csv", fname="ranking", ext="csv")
+                            ranker.publish_web_files()
+                            
+                            signature = rankings_signature()
+                            load_shared_rankings(signature, _rankings_df=saved_rankings_df, _ranker=ranker)
+                            st.session_state.ranker = ranker
+                            st.session_state.rankings_df = rankings_df
+                            st.session_state.rankings_signature = signature
+                    except (KeyError, ValueError, FileNotFoundError) as e:
+                        # No decision of the batch was applied
+                        st.error(f"❌ Decisions not applied: {str(e)}")
+                    else:
+                        st.success(f"✅ {len(decisions)} decisions applied, {n_replayed} races replayed")
+                        st.rerun()
+
         # Add recalculate button for existing rankings
         if st.session_state.ranker is not None:
             if st.button("Update details"):
@@ -205,11 +320,18 @@ def main():
         st.subheader("📊 Display Options")
         min_races = st.number_input("Minimum Races Required", value=3, min_value=1, max_value=10, help="Only show runners who participated in at least this many races")
         st.session_state['min_races'] = min_races # Store min_races in session state
+        category = st.selectbox("Category", ['All'] + available_groups(), help="Rankings of every runner, or of one age category")
+        
+        # Rankings and ranker displayed: overall ones, or the shared ones of the selected category
+        if category == 'All':
+            rankings_df, ranker = st.session_state.rankings_df, st.session_state.ranker
+        else:
+            rankings_df, ranker = load_category_rankings(category, category_signature(category))
         
-        if st.session_state.rankings_df is not None:
-            st.metric("Total Runners", len(st.session_state.rankings_df))
-            if st.session_state.ranker:
-                st.metric("Total Races", len(st.session_state.ranker.race_history))
+        if rankings_df is not None:
+            st.metric("Total Runners", len(rankings_df))
+            if ranker:
+                st.metric("Total Races", len(ranker.race_history))
         
         # Cache management
         if st.session_state.ranker is not None:
@@ -218,29 +340,32 @@ def main():
             
             # Check if any cache files exist
             cache_files_exist = (
-                os.path.exists(os.path.join(st.session_state.ranker.cache_dir, 'name_mappings.json')) or 
-                os.path.exists(os.path.join(st.session_state.ranker.cache_dir, 'different_names.json')) or
+                os.path.exists(os.path.join(st.session_state.ranker.cache_dir, 'identities.npz')) or
                 os.path.exists(os.path.join(st.session_state.ranker.cache_dir, 'processed_races.json')) or
-                os.path.exists(os.path.join(st.session_state.ranker.cache_dir, 'race_history.json'))
+                os.path.exists(os.path.join(st.session_state.ranker.cache_dir, 'race_history.npz'))
             )
             
             if cache_files_exist:
                                 
                 if st.button("🗑️ Clear All Caches", type="secondary"):
-                    st.session_state.ranker.clear_cache()
+                    # The ranker of the session may be shared with other sessions (load_shared_rankings), which must not
+                    # see it change: the files are removed by a new ranker, and every session loads the rankings again
+                    Ranker(cache_dir=st.session_state.ranker.cache_dir).clear_cache()
+                    load_shared_rankings.clear()
+                    st.session_state.rankings_signature = None
                     st.success("✅ All caches cleared!")
                     st.rerun()
             else:
                 st.info("No caches found")
     
     # Main content area
-    st.header("Current Ranking")
+    st.header("Current Ranking" if category == 'All' else f"Current Ranking - {category}")
     
-    if st.session_state.rankings_df is not None:
+    if rankings_df is not None:
         # Apply minimum races filter to displayed rankings
         current_min_races = st.session_state.get('min_races', 3)
-        filtered_rankings = st.session_state.rankings_df[
-            st.session_state.rankings_df['races_participated'] >= current_min_races
+        filtered_rankings = rankings_df[
+            rankings_df['races_participated'] >= current_min_races
         ].copy()
         
         # Display rankings table
@@ -284,11 +409,11 @@ def main():
     # Runner Details section below rankings
     st.header("📈 Cyclist Details")
     
-    if st.session_state.rankings_df is not None:
+    if rankings_df is not None:
         # Apply minimum races filter to displayed rankings
         current_min_races = st.session_state.get('min_races', 3)
-        filtered_rankings = st.session_state.rankings_df[
-            st.session_state.rankings_df['races_participated'] >= current_min_races
+        filtered_rankings = rankings_df[
+            rankings_df['races_participated'] >= current_min_races
         ].copy()
         
         # Runner selection
@@ -307,9 +432,9 @@ def main():
             index=default_index
         )
         
-        if selected_runner and st.session_state.ranker:
+        if selected_runner and ranker:
             # Get runner statistics
-            stats = st.session_state.ranker.get_player_stats(selected_runner)
+            stats = ranker.get_player_stats(selected_runner)
             
             if stats:
                 # Display runner stats
@@ -333,44 +458,46 @@ def main():
                     st.metric("Races Participated", stats['races_participated'])
                 
                 # Rating history visualization
-                if st.session_state.ranker.race_history:
+                if ranker.race_history:
                     
                     # Create rating history data
                     rating_history = []
-                    for i, race in enumerate(st.session_state.ranker.race_history):
-                        race_data = race['race_data']
-                        if selected_runner in race_data['name'].values:
-                            runner_place = race_data[race_data['name'] == selected_runner]['place'].iloc[0]
-                            race_name = race.get('race_name', f'Race {i+1}')
-                            # Clean up race name for display (remove .csv extension and format date)
-                            if race_name.endswith('.csv'):
-                                race_name = race_name[:-4]  # Remove .csv extension
-                            # Try to format the date part if it exists
-                            if race_name[-2] == '_' and race_name[-1].isdigit():
-                                race_name = race_name[:-2]
+                    used_race_names = set()
+                    for race in ranker.get_player_history(selected_runner):
+                        race_name = race['race_name']
+                        # Clean up race name for display (remove .csv extension and format date)
+                        if race_name.endswith('.csv'):
+                            race_name = race_name[:-4]  # Remove .csv extension
+                        # Try to format the date part if it exists
+                        if race_name[-2] == '_' and race_name[-1].isdigit():
+                            race_name = race_name[:-2]
 
-                            idx = 1
-                            tmp_race_name = race_name
-                            while tmp_race_name in [h['race_name'] for h in rating_history]:
-                                tmp_race_name = f"{race_name}_{idx}"
-                                idx += 1
-                            race_name = tmp_race_name
-                            
-                            rating_history.append({
-                                'race': i + 1,
-                                'race_name': race_name,
-                                'place': runner_place,
-                                'total_runners': len(race_data)
-                            })
+                        idx = 1
+                        tmp_race_name = race_name
+                        while tmp_race_name in used_race_names:
+                            tmp_race_name = f"{race_name}_{idx}"
+                            idx += 1
+                        race_name = tmp_race_name
+                        used_race_names.add(race_name)
+                        
+                        rating_history.append({
+                            'race': race['race'] + 1,
+                            'race_name': race_name,
+                            'place': race['place'],
+                            'total_runners': race['total_runners'],
+                            'rating': race['rating']
+                        })
                     
                     if rating_history:
                         history_df = pd.DataFrame(rating_history)
                         
                         st.markdown(f"### Result History")
     
-                        # Create subplot for place history
+                        # Create subplot for place history, with the rating after each race on a second axis
+                        has_rating = history_df['rating'].notna().any()
                         fig = make_subplots(
                             rows=1, cols=1,
+                            specs=[[{"secondary_y": True}]]
                         )
                         
                         # Race performance over time
@@ -386,20 +513,36 @@ def main():
                             row=1, col=1
                         )
                         
+                        # Rating over time
+                        if has_rating:
+                            fig.add_trace(
+                                go.Scatter(
+                                    x=history_df['race_name'],
+                                    y=history_df['rating'],
+                                    mode='lines+markers',
+                                    name='Rating',
+                                    line=dict(color='#ff7f0e', width=2),
+                                    marker=dict(size=6)
+                                ),
+                                row=1, col=1, secondary_y=True
+                            )
+                        
                         fig.update_layout(
                             height=400,
-                            showlegend=False,
+                            showlegend=bool(has_rating),
                         )
                         
                         fig.update_xaxes(title_text="Race", tickangle=-45)
-                        fig.update_yaxes(title_text="Place")
+                        fig.update_yaxes(title_text="Place", secondary_y=False)
+                        if has_rating:
+                            fig.update_yaxes(title_text="Rating", secondary_y=True)
                         
                         st.plotly_chart(fig, use_container_width=True)
                     else:
                         st.info("No race history available for this runner.")
             else:
                 st.error("Could not retrieve statistics for this runner.")
-        elif selected_runner and not st.session_state.ranker:
+        elif selected_runner and not ranker:
             # Show basic info when ranker is not available
             st.markdown(f"### {selected_runner}")
             st.info("📊 Detailed statistics not available (rankings loaded from file). Calculate new rankings to see detailed runner statistics and performance history.")
@@ -0,0 +1,376 @@
+#%%
+import os
+import io
+import sys
+import json
+import time
+import random
+import datetime
+import platform
+import tempfile
+import subprocess
+import contextlib
+import numpy as np
+import pandas as pd
+import rank
+from rank import Ranker
+
+#%%
+
+# Preset scales: number of runners, number of races and mean field size
+SCALES = {
+    'small': {'n_runners': 1000, 'n_races': 50, 'field_size': 60},
+    'medium': {'n_runners': 10000, 'n_races': 500, 'field_size': 80},
+    'large': {'n_runners': 100000, 'n_races': 5000, 'field_size': 80},
+}
+
+LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+SYLLABLES = ['ba', 'be', 'bi', 'bo', 'ca', 'ce', 'co', 'da', 'de', 'di', 'fa', 'fe', 'ga', 'go', 'la', 'le', 'li', 'lo', 'ma', 'me',
+             'mi', 'mo', 'na', 'ne', 'ni', 'no', 'pa', 'pe', 'ra', 're', 'ri', 'ro', 'sa', 'se', 'ta', 'te', 'ti', 'to', 'va', 'vi',
+             'an', 'en', 'in', 'on', 'ar', 'er', 'or', 'ul', 'el', 'al', 'ou', 'ch', 'tr', 'gu', 'qu']
+
+
+class BenchmarkRanker(Ranker):
+    def __init__(self, *args, same_rate=0.5, seed=0, **kwargs):
+        """
+        Ranker answering the similar name questions itself, so that benchmarks run without prompts
+
+        Args:
+            same_rate (float, optional): probability to answer that two names are the same person. Defaults to 0.5.
+            seed (int, optional): random seed of the answers. Defaults to 0.
+        """
+        self.same_rate = same_rate
+        self.answers = random.Random(seed)
+        super().__init__(*args, **kwargs)
+
+
+    def ask(self, n1, n2):
+        return self.answers.random() < self.same_rate
+
+
+
+#-----------------------------------------------------#
+
+
+
+def random_name(rng):
+    last_name = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).upper()
+    first_name = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))).capitalize()
+    return f'{last_name} {first_name}'
+
+
+def add_typo(name, rng):
+    """
+    Returns name with one character replaced, removed or duplicated
+    """
+    i = rng.randrange(len(name))
+    kind = rng.randrange(3)
+    if kind == 0:
+        letter = rng.choice(LETTERS)
+        return name[:i] + (letter.upper() if name[i].isupper() else letter) + name[i+1:]
+    elif kind == 1 and len(name) > 4:
+        return name[:i] + name[i+1:]
+    return name[:i] + name[i] + name[i:]
+
+
+def generate_season(n_runners, n_races, field_size=80, typo_rate=0.02, abandon_rate=0.05, seed=0):
+    """
+    Generates a synthetic season of races in the format of the parsed csv files
+
+    Args:
+        n_runners (int): number of distinct runners
+        n_races (int): number of races
+        field_size (int, optional): mean number of runners per race. Defaults to 80.
+        typo_rate (float, optional): probability for a result to have a typo in the runner's name. Defaults to 0.02.
+        abandon_rate (float, optional): probability for a runner to abandon ("Ab."). Defaults to 0.05.
+        seed (int, optional): random seed. Defaults to 0.
+
+    Returns:
+        list of tuple: (file name, pd.DataFrame with place, name and club columns) of each race, in date order
+    """
+    rng = random.Random(seed)
+    names = set()
+    while len(names) < n_runners:
+        names.add(random_name(rng))
+    names = sorted(names)
+    rng.shuffle(names)
+    clubs = [f'{random_name(rng).split()[0]} CYCLISME' for _ in range(max(1, n_runners // 20))]
+    runner_clubs = [rng.choice(clubs) for _ in range(n_runners)]
+
+    start = datetime.date(2024, 1, 1)
+    races = []
+    for race_idx in range(n_races):
+        size = min(n_runners, max(2, rng.randint(field_size // 2, field_size * 3 // 2)))
+        runners = rng.sample(range(n_runners), size)
+        n_abandons = sum(rng.random() < abandon_rate for _ in range(size))
+        n_finished = size - n_abandons
+        race_names = [add_typo(names[i], rng) if rng.random() < typo_rate else names[i] for i in runners]
+        df = pd.DataFrame({
+            'place': [str(place) for place in range(1, n_finished + 1)] + ['Ab.'] * n_abandons,
+            'name': race_names,
+            'club': [runner_clubs[i] for i in runners],
+        })
+        date = start + datetime.timedelta(days=race_idx // 3)
+        races.append((f'{date:%Y-%m-%d}_race{race_idx:05d}_0.csv', df))
+    return races
+
+
+def write_season(races, folder):
+    """
+    Writes the races of generate_season as csv files in folder
+    """
+    os.makedirs(folder, exist_ok=True)
+    for file_name, df in races:
+        df.to_csv(os.path.join(folder, file_name), index=False)
+
+
+@contextlib.contextmanager
+def working_directory(path):
+    """
+    Runs the block in path, since the rankings also write to docs/cache relatively to the working directory
+    """
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def timed(function, repeat=1, quiet=True):
+    """
+    Calls function repeat times
+
+    Returns:
+        tuple: result of the last call, list of durations in seconds
+    """
+    durations = []
+    result = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext():
+            start = time.perf_counter()
+            result = function()
+            durations.append(time.perf_counter() - start)
+    return result, durations
+
+
+def summary(durations, **extra):
+    """
+    Statistics of a list of durations in seconds
+    """
+    out = {
+        'calls': len(durations),
+        'total_s': round(sum(durations), 6),
+        'mean_ms': round(sum(durations) / len(durations) * 1000, 4) if durations else None,
+        'min_ms': round(min(durations) * 1000, 4) if durations else None,
+        'max_ms': round(max(durations) * 1000, 4) if durations else None,
+    }
+    out.update(extra)
+    return out
+
+
+def file_size(path):
+    if os.path.isdir(path):
+        return sum(file_size(os.path.join(path, f)) for f in os.listdir(path))
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def benchmark_scale(n_runners, n_races, field_size=80, typo_rate=0.02, abandon_rate=0.05, n_queries=200, repeat=3, seed=0):
+    """
+    Times the ranking pipeline on one synthetic season, in a temporary folder
+
+    Args:
+        n_runners (int): number of distinct runners
+        n_races (int): number of races
+        field_size (int, optional): mean number of runners per race. Defaults to 80.
+        typo_rate (float, optional): probability for a result to have a typo in the runner's name. Defaults to 0.02.
+        abandon_rate (float, optional): probability for a runner to abandon. Defaults to 0.05.
+        n_queries (int, optional): number of find_similar_name and get_player_stats calls. Defaults to 200.
+        repeat (int, optional): number of repetitions of get_rankings and of the cache save/load calls. Defaults to 3.
+        seed (int, optional): random seed. Defaults to 0.
+
+    Returns:
+        dict: size of the season and timings of each operation
+    """
+    races = generate_season(n_runners, n_races, field_size, typo_rate, abandon_rate, seed)
+    rng = random.Random(seed + 1)
+    timings = {}
+
+    with tempfile.TemporaryDirectory() as tmp, working_directory(tmp):
+        write_season(races, 'data/csv')
+        rank.normalize_name.cache_clear()
+
+        # Full ranking: csv reading, name resolution, rating updates and cache writes
+        ranker, durations = timed(lambda: BenchmarkRanker(cache_dir='cache', seed=seed))
+        timings['init'] = summary(durations)
+        _, durations = timed(lambda: ranker.rank('data/csv'))
+        timings['rank'] = summary(durations)
+
+        # Rating updates alone, on a fresh ranker
+        rank.normalize_name.cache_clear()
+        with contextlib.redirect_stdout(io.StringIO()):
+            fresh = BenchmarkRanker(cache_dir='cache_process_race', seed=seed)
+        durations = []
+        for file_name, df in races:
+            date = fresh.date_to_int(datetime.datetime.strptime(file_name[:10], '%Y-%m-%d').date())
+            durations += timed(lambda: fresh.process_race(df, date=date, race_name=file_name))[1]
+        timings['process_race'] = summary(durations, rows=sum(len(df) for _, df in races))
+
+        # Name resolution of known names, and of names with typos
+        known = list(ranker.players)
+        exact = [rng.choice(known) for _ in range(n_queries // 2)]
+        typos = [add_typo(rng.choice(known), rng) for _ in range(n_queries - len(exact))]
+        durations = []
+        for name in exact + typos:
+            durations += timed(lambda: ranker.find_similar_name(name))[1]
+        timings['find_similar_name'] = summary(durations, known_runners=len(known))
+
+        _, durations = timed(ranker.get_rankings, repeat)
+        timings['get_rankings'] = summary(durations)
+
+        durations = []
+        for name in [rng.choice(known) for _ in range(n_queries)]:
+            durations += timed(lambda: ranker.get_player_stats(name))[1]
+        timings['get_player_stats'] = summary(durations)
+
+        # Cache save/load pairs
+        pairs = {
+            'identities': (ranker.save_identities, ranker.load_identities, 'cache/identities.npz'),
+            'processed_races': (lambda: ranker.save_processed_races(ranker.processed_races), ranker.load_processed_races,
+                                'cache/processed_races.json'),
+            # Saves after the first one only append new races: time the full write of a compaction instead
+            'race_history': (ranker.compact_race_history, ranker.load_race_history, 'cache/race_history.npz'),
+            'rating_timeline': (lambda: ranker.save_rating_timeline(ranker.timeline), ranker.load_rating_timeline,
+                                'cache/rating_timeline.npz'),
+            'rating_state': (ranker.save_rating_state, ranker.load_rating_state, 'cache/rating_state.ckpt'),
+            'runner_shards': (ranker.save_runner_shards, None, 'docs/cache/runners'),
+        }
+        for cache_name, (save, load, path) in pairs.items():
+            _, durations = timed(save, repeat)
+            timings[f'save_{cache_name}'] = summary(durations, bytes=file_size(path))
+            if load is not None:
+                _, durations = timed(load, repeat)
+                timings[f'load_{cache_name}'] = summary(durations)
+
+    return {
+        'n_runners': n_runners,
+        'n_races': n_races,
+        'rows': sum(len(df) for _, df in races),
+        'players': len(ranker.players),
+        'timings': timings,
+    }
+
+
+def environment():
+    """
+    Description of the machine and code version, stored with the results
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except Exception:
+        commit = None
+    return {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+    }
+
+
+def benchmark(scales=('small', 'medium'), typo_rate=0.02, abandon_rate=0.05, n_queries=200, repeat=3, seed=0, output=None):
+    """
+    Runs the benchmark at several scales and prints a summary
+
+    Args:
+        scales (tuple of str, optional): names of the scales in SCALES. Defaults to ('small', 'medium').
+        typo_rate (float, optional): probability for a result to have a typo in the runner's name. Defaults to 0.02.
+        abandon_rate (float, optional): probability for a runner to abandon. Defaults to 0.05.
+        n_queries (int, optional): number of name lookups and runner stats per scale. Defaults to 200.
+        repeat (int, optional): number of repetitions of get_rankings and of the cache save/load calls. Defaults to 3.
+        seed (int, optional): random seed. Defaults to 0.
+        output (str, optional): path of the JSON results. Defaults to None (not saved).
+
+    Returns:
+        dict: environment, parameters and results per scale
+    """
+    report = {
+        'environment': environment(),
+        'parameters': {'typo_rate': typo_rate, 'abandon_rate': abandon_rate, 'n_queries': n_queries, 'repeat': repeat, 'seed': seed},
+        'scales': {},
+    }
+    for scale in scales:
+        config = SCALES[scale]
+        print(f"Benchmarking {scale}: {config['n_runners']} runners, {config['n_races']} races")
+        result = benchmark_scale(config['n_runners'], config['n_races'], config['field_size'], typo_rate, abandon_rate,
+                                 n_queries, repeat, seed)
+        report['scales'][scale] = result
+
+        print(f"{'Operation':<26} {'Calls':<7} {'Mean (ms)':<12} {'Total (s)':<10}")
+        for operation, timing in result['timings'].items():
+            print(f"{operation:<26} {timing['calls']:<7} {timing['mean_ms']:<12.3f} {timing['total_s']:<10.3f}")
+        print()
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Benchmark results saved to: {output}")
+    return report
+
+
+def compare(baseline, current):
+    """
+    Prints the mean time of each operation of current relative to baseline, as saved by benchmark
+
+    Args:
+        baseline (str): path of the reference JSON results
+        current (str): path of the new JSON results
+    """
+    with open(baseline, 'r', encoding='utf-8') as f:
+        before = json.load(f)
+    with open(current, 'r', encoding='utf-8') as f:
+        after = json.load(f)
+
+    print(f"{'Scale':<8} {'Operation':<26} {'Before (ms)':<12} {'After (ms)':<12} {'Ratio':<6}")
+    for scale, result in after['scales'].items():
+        if scale not in before['scales']:
+            continue
+        for operation, timing in result['timings'].items():
+            previous = before['scales'][scale]['timings'].get(operation)
+            if not previous or not previous['mean_ms']:
+                continue
+            ratio = timing['mean_ms'] / previous['mean_ms']
+            print(f"{scale:<8} {operation:<26} {previous['mean_ms']:<12.3f} {timing['mean_ms']:<12.3f} {ratio:<6.2f}")
+
+
+# %%
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark the ranking pipeline on synthetic seasons')
+    parser.add_argument('--scales', type=str, nargs='+', default=['small', 'medium'], choices=list(SCALES),
+                       help='Scales to benchmark (large: 100k runners and 5k races)')
+    parser.add_argument('--typo_rate', type=float, default=0.02,
+                       help='Probability for a result to have a typo in the runner name')
+    parser.add_argument('--abandon_rate', type=float, default=0.05,
+                       help='Probability for a runner to abandon')
+    parser.add_argument('--n_queries', type=int, default=200,
+                       help='Number of name lookups and runner stats per scale')
+    parser.add_argument('--repeat', type=int, default=3,
+                       help='Number of repetitions of get_rankings and of the cache save/load calls')
+    parser.add_argument('--seed', type=int, default=0,
+                       help='Random seed of the synthetic seasons')
+    parser.add_argument('--output', type=str, default='benchmark.json',
+                       help='Output JSON file for the results')
+    parser.add_argument('--compare', type=str, default=None,
+                       help='Previous JSON results to compare the new results with')
+
+    args = parser.parse_args()
+
+    benchmark(args.scales, args.typo_rate, args.abandon_rate, args.n_queries, args.repeat, args.seed, args.output)
+    if args.compare:
+        compare(args.compare, args.output)
+# %%
@@ -0,0 +1,340 @@
+#%%
+import os
+import json
+import queue
+import multiprocessing
+import pandas as pd
+from rank import Ranker
+from persistence import atomic_write
+
+#%%
+
+# Age categories kept by the parser (see FileParser.clean_dataframe)
+CATEGORIES = ['E', 'S', 'V', 'SV', 'A', 'SA', 'F/E', 'F/S', 'F/V', 'F/SV', 'F/A', 'F/SA']
+
+# One ranking per category by default. Group names are used in file names.
+DEFAULT_GROUPS = {category.replace('/', '-'): [category] for category in CATEGORIES}
+
+# Seconds between two checks that the worker processes are still running, while the main process waits for them
+POLL_SECONDS = 1.0
+
+
+def parse_groups(specs):
+    """
+    Parses groups of categories given as 'name=CAT1,CAT2' strings
+
+    Args:
+        specs (list of str): e.g. ['men=E,S,V,SV,A,SA', 'women=F/E,F/S,F/V,F/SV,F/A,F/SA']
+
+    Raises:
+        ValueError: if a spec has no '=' or no category
+
+    Returns:
+        dict: group name -> list of categories
+    """
+    groups = {}
+    for spec in specs:
+        name, _, categories = spec.partition('=')
+        categories = [category.strip().replace(' ', '') for category in categories.split(',') if category.strip()]
+        if not name.strip() or not categories:
+            raise ValueError(f'Invalid group of categories: "{spec}" (expected name=CAT1,CAT2)')
+        groups[name.strip().replace('/', '-')] = categories
+    return groups
+
+
+def category_standings(df, categories):
+    """
+    Standings of the runners of some categories in one race, the finishers being ranked among themselves
+
+    Args:
+        df (pd.DataFrame): standings of the race with place, name, club and category columns
+        categories (list of str): categories to keep
+
+    Returns:
+        pd.DataFrame: place, name and club of the runners of the categories, in the order of the race
+    """
+    df = df[df['category'].isin(categories)]
+    places = pd.to_numeric(df['place'], errors='coerce')
+    finished = places.notna()
+    new_places = places.rank(method='min')
+    place = [str(int(new_place)) if is_finished else old_place
+             for old_place, new_place, is_finished in zip(df['place'].tolist(), new_places.tolist(), finished.tolist())]
+    return pd.DataFrame({'place': place, 'name': df['name'].tolist(), 'club': df['club'].tolist()})
+
+
+def rank_groups(group_paths, use_previous, options, races, results):
+    """
+    Worker process: rates the races of some groups of categories, then saves their caches and rankings
+
+    Args:
+        group_paths (dict): group name -> (cache folder, docs folder, ranking file) of the groups of the worker
+        use_previous (bool): continue from the previous ranking of each group
+        options (dict): method_params, contest_params and weighting of the overall ranking (see Ranker)
+        races (multiprocessing.Queue): (group, standings, date, race name, weight) items, then ('done', processed files),
+                                       or ('abort', None) if the main process failed
+        results (multiprocessing.Queue): receives (group, number of runners, number of races, error message) per group
+    """
+    rankers = {}
+    error = None
+    try:
+        for group, (cache_dir, docs_dir, ranking_file) in group_paths.items():
+            previous_rank = ranking_file if use_previous and os.path.exists(ranking_file) else None
+            # Names were resolved by the main process
+            rankers[group] = Ranker(previous_rank=previous_rank, cache_dir=cache_dir, docs_dir=docs_dir, resolve_names=False, **options)
+    except Exception as e:
+        error = str(e)
+
+    # The queue is always emptied, so that the main process is never blocked by a failed worker
+    while True:
+        group, *item = races.get()
+        if group in ('done', 'abort'):
+            break
+        if error is None:
+            try:
+                df, date, race_name, weight = item
+                rankers[group].process_race(df, weight=weight, date=date, race_name=race_name)
+            except Exception as e:
+                error = str(e)
+    if group == 'abort':
+        error = error or 'ranking interrupted'
+    if error is not None:
+        for group in group_paths:
+            results.put((group, None, None, error))
+        return
+    processed_files, = item
+
+    for group, ranker in rankers.items():
+        try:
+            cache_dir, docs_dir, ranking_file = group_paths[group]
+            ranker.save_caches(processed_files)
+            fname = os.path.splitext(os.path.basename(ranking_file))[0]
+            ranker.save_rankings(folder=os.path.dirname(ranking_file), fname=fname)
+            ranker.save_rankings(folder=docs_dir, fname='ranking')
+            results.put((group, len(ranker.players), len(ranker.race_history), None))
+        except Exception as e:
+            results.put((group, None, None, str(e)))
+
+
+class CategoryRankings:
+    def __init__(self, groups=None, cache_dir='./cache', docs_dir='docs/cache', ranking_folder='data/csv/categories', workers=None):
+        """
+        Rankings per category (or group of categories), computed from the same pass over the race files.
+
+        The main process reads the races, resolves the runner names and computes the overall ranking.
+        The standings of each group are sent to worker processes, each group having its own EloMMR instance,
+        caches (cache_dir/categories/<group>), web files (docs_dir/categories/<group>) and ranking file
+        (ranking_folder/ranking_<group>.csv).
+
+        Args:
+            groups (dict, optional): group name -> list of categories. Defaults to None (DEFAULT_GROUPS).
+            cache_dir (str, optional): Folder of the cache files. Defaults to './cache'.
+            docs_dir (str, optional): Folder of the files read by the web interface. Defaults to 'docs/cache'.
+            ranking_folder (str, optional): Folder of the ranking files of the groups. Defaults to 'data/csv/categories'.
+            workers (int, optional): Number of worker processes. Defaults to None (one per group, at most one per core).
+        """
+        self.groups = groups or DEFAULT_GROUPS
+        self.cache_dir = cache_dir
+        self.docs_dir = docs_dir
+        self.ranking_folder = ranking_folder
+        self.workers = workers or min(len(self.groups), os.cpu_count() or 1)
+
+
+    def group_paths(self, group):
+        """
+        Returns:
+            tuple: cache folder, docs folder and ranking file of a group
+        """
+        return (os.path.join(self.cache_dir, 'categories', group), os.path.join(self.docs_dir, 'categories', group),
+                os.path.join(self.ranking_folder, f'ranking_{group}.csv'))
+
+
+    def is_up_to_date(self, processed_races, identities_revision=0):
+        """
+        Checks that the caches of every group cover the same races as the overall ranking, with the runner names 
+        resolved by the same identities (see IdentityStore.revision), so that they can be continued
+        """
+        for group in self.groups:
+            cache_dir, _, ranking_file = self.group_paths(group)
+            cache_path = os.path.join(cache_dir, 'processed_races.json')
+            revision_path = os.path.join(cache_dir, 'identities_revision.json')
+            if not (os.path.exists(ranking_file) and os.path.exists(cache_path) and os.path.exists(revision_path)):
+                return False
+            try:
+                with open(cache_path, 'r', encoding='utf-8') as f:
+                    if set(json.load(f)) != set(processed_races):
+                        return False
+                with open(revision_path, 'r', encoding='utf-8') as f:
+                    if json.load(f) != identities_revision:
+                        return False
+            except Exception:
+                return False
+        return True
+
+
+    def save_revisions(self, summary, identities_revision):
+        """
+        Save the revision of the identities the names of each group were resolved with. 
+        Groups whose ranking failed have none, so that they are computed again next time.
+        """
+        for group, (_, _, error) in summary.items():
+            revision_path = os.path.join(self.group_paths(group)[0], 'identities_revision.json')
+            try:
+                if error is None:
+                    atomic_write(revision_path, json.dumps(identities_revision))
+                elif os.path.exists(revision_path):
+                    os.remove(revision_path)
+            except Exception as e:
+                print(f"Error saving identities revision of category {group}: {e}")
+
+
+    def rank(self, folder, previous_rank=None, ext='csv', jobs=4, profile=False, review='ask', provisional='different',
+             method_params=None, contest_params=None, weighting='uniform'):
+        """
+        Computes the overall ranking and the ranking of each group. 
+        The groups are rated with the settings of the overall ranking, each race with its weight in the overall ranking.
+
+        Args:
+            folder (str): Path to where are stored the csv files with standings for each race
+            previous_rank (str, optional): Path to the previous overall ranking. Defaults to None (full recompute).
+            ext (str, optional): extension file to read. Defaults to 'csv'.
+            jobs (int, optional): Number of race files read at once. Defaults to 4.
+            profile (bool, optional): Record the stages of the overall ranking. Defaults to False.
+            review (str, optional): 'ask' or 'defer' the questions on similar names (see Ranker). Defaults to 'ask'.
+            provisional (str, optional): decision applied to deferred pairs until they are reviewed. Defaults to 'different'.
+            method_params (dict, optional): parameters of openelo.EloMMR. Defaults to None (default parameters).
+            contest_params (dict, optional): parameters of openelo.ContestRatingParams other than the weight of the race. 
+                                             Defaults to None (default parameters).
+            weighting (str, optional): weighting scheme of the races (see rank.race_weights). Defaults to 'uniform'.
+
+        Returns:
+            Ranker: ranker of the overall ranking
+            dict: group name -> (number of runners, number of races, error message or None)
+        """
+        rating_options = dict(method_params=method_params, contest_params=contest_params, weighting=weighting)
+        options = dict(cache_dir=self.cache_dir, docs_dir=self.docs_dir, profile=profile, review=review, provisional=provisional, 
+                       **rating_options)
+        ranker = Ranker(previous_rank=previous_rank, **options)
+        use_previous = previous_rank is not None and self.is_up_to_date(ranker.processed_races, ranker.identities.revision)
+        # Some new races can only be processed in a full run (see Ranker.restart_reason)
+        use_previous = use_previous and ranker.restart_reason(ranker.get_catalogue(folder, ext)) is None
+        if previous_rank is not None and not use_previous:
+            # The groups must see every race: start again from scratch
+            print("Category rankings cannot be continued from the processed races, computing every race again")
+            ranker = Ranker(**options)
+
+        # Groups are spread over the workers
+        worker_groups = [{} for _ in range(self.workers)]
+        owner = {}
+        for group_idx, group in enumerate(self.groups):
+            worker_groups[group_idx % self.workers][group] = self.group_paths(group)
+            owner[group] = group_idx % self.workers
+        # Bounded queues: the main process waits for the workers instead of holding every race in memory
+        queues = [multiprocessing.Queue(maxsize=256) for _ in worker_groups]
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=rank_groups, args=(paths, use_previous, rating_options, queue, results))
+                     for paths, queue in zip(worker_groups, queues)]
+        for process in processes:
+            process.start()
+        # Workers which exited before the end (e.g. killed when out of memory): they neither empty their queue
+        # nor send the results of their groups
+        exited = set()
+
+        def check_exited(worker_idx):
+            if worker_idx not in exited and not processes[worker_idx].is_alive():
+                exited.add(worker_idx)
+                # The races left in its queue are never read: they must not block the exit of this process
+                queues[worker_idx].cancel_join_thread()
+            return worker_idx in exited
+
+        def send(worker_idx, item):
+            while not check_exited(worker_idx):
+                try:
+                    queues[worker_idx].put(item, timeout=POLL_SECONDS)
+                    return
+                except queue.Full:
+                    pass
+
+        def on_race(entry, df, weight):
+            date = ranker.date_to_int(entry['date']) if entry['date'] else None
+            for group, categories in self.groups.items():
+                standings = category_standings(df, categories)
+                if len(standings) > 1:
+                    send(owner[group], (group, standings, date, entry['file'], weight))
+
+        try:
+            ranker.rank(folder, ext, jobs, on_race=on_race)
+        except BaseException:
+            # The groups must not save a partial ranking
+            for worker_idx in range(len(processes)):
+                send(worker_idx, ('abort', None))
+            for process in processes:
+                process.join()
+            raise
+        for worker_idx in range(len(processes)):
+            send(worker_idx, ('done', list(ranker.processed_races)))
+
+        summary = {}
+        while len(summary) < len(self.groups):
+            try:
+                group, n_runners, n_races, error = results.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                # The results sent by a worker just before it exited are read during one more poll interval,
+                # then its groups without results are reported as failed
+                for group in self.groups:
+                    worker_idx = owner[group]
+                    if group not in summary and worker_idx in exited:
+                        error = f"worker process exited with code {processes[worker_idx].exitcode}"
+                        summary[group] = (None, None, error)
+                        print(f"Error ranking category {group}: {error}")
+                for worker_idx in range(len(processes)):
+                    check_exited(worker_idx)
+                continue
+            summary[group] = (n_runners, n_races, error)
+            if error:
+                print(f"Error ranking category {group}: {error}")
+        for process in processes:
+            process.join()
+
+        self.save_revisions(summary, ranker.identities.revision)
+        self.save_index()
+        return ranker, summary
+
+
+    def save_index(self):
+        """
+        Save the list of groups and of their categories for the web interface
+        """
+        try:
+            os.makedirs(os.path.join(self.docs_dir, 'categories'), exist_ok=True)
+            with open(os.path.join(self.docs_dir, 'categories', 'index.json'), 'w', encoding='utf-8') as f:
+                json.dump(self.groups, f)
+        except Exception as e:
+            print(f"Error saving categories index: {e}")
+
+
+def available_groups(ranking_folder='data/csv/categories'):
+    """
+    Names of the groups with a ranking file in ranking_folder
+    """
+    if not os.path.isdir(ranking_folder):
+        return []
+    return sorted(file[len('ranking_'):-len('.csv')] for file in os.listdir(ranking_folder)
+                  if file.startswith('ranking_') and file.endswith('.csv'))
+
+
+def load_group_ranker(group, cache_dir='./cache', docs_dir='docs/cache', ranking_folder='data/csv/categories', **options):
+    """
+    Loads the ranking file and the ranker of one group, as saved by CategoryRankings.rank
+
+    Args:
+        options: method_params, contest_params and weighting the ranking was computed with (see CategoryRankings.rank)
+
+    Returns:
+        pd.DataFrame: ranking of the group (None if there is none)
+        Ranker: ranker of the group (None if there is no ranking)
+    """
+    cache_dir, docs_dir, ranking_file = CategoryRankings({group: []}, cache_dir, docs_dir, ranking_folder).group_paths(group)
+    if not os.path.exists(ranking_file):
+        return None, None
+    ranker = Ranker(previous_rank=ranking_file, cache_dir=cache_dir, docs_dir=docs_dir, resolve_names=False, **options)
+    return pd.read_csv(ranking_file), ranker
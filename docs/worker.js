@@ -0,0 +1,275 @@
+// Parsing and indexing of the ranking data, off the main thread, and local cache of the parsed data.
+// Run as a Web Worker by index.html; also loaded as a plain script, so that the page can call
+// handleRequest directly in browsers without workers.
+
+const MIN_RACES = 3; // Runners with fewer races are not listed
+
+// Parsed files are kept in IndexedDB, keyed by their name in cache/, with their published path (see manifest.json).
+// A published path holds the hash of the file content: a record is up to date while the manifest gives the same path.
+const DB_NAME = 'cx-ranking';
+const DB_STORE = 'files';
+let databaseOpening = null;
+
+let raceHistory = null; // {races: [race names], runners: Map of runner name -> [[race index, place, total runners], ...]}
+
+function normalizeName(name) {
+    // Lower case without accents, as typed in the search box
+    return name.normalize('NFD').replace(/[\u0300-\u036f]/g, '').toLowerCase();
+}
+
+function parseCSVLine(line) {
+    // Fields may be quoted (names with commas), quotes being doubled inside
+    const values = [];
+    let value = '';
+    let quoted = false;
+    for (let i = 0; i < line.length; i++) {
+        const c = line[i];
+        if (quoted) {
+            if (c === '"' && line[i + 1] === '"') {
+                value += '"';
+                i++;
+            } else if (c === '"') {
+                quoted = false;
+            } else {
+                value += c;
+            }
+        } else if (c === '"') {
+            quoted = true;
+        } else if (c === ',') {
+            values.push(value.trim());
+            value = '';
+        } else {
+            value += c;
+        }
+    }
+    values.push(value.trim());
+    return values;
+}
+
+function buildRankings(csvText) {
+    // Columns of the listed runners in ranking order, and the search index:
+    // every word of every name, sorted, with the position of its runner
+    const lines = csvText.trim().split(/\r?\n/);
+    const headers = parseCSVLine(lines[0]);
+    const column = name => headers.indexOf(name);
+    const [rankCol, nameCol, ratingCol, sigmaCol, racesCol] =
+        ['rank', 'name', 'rating', 'sigma', 'races_participated'].map(column);
+
+    const names = [];
+    const ranks = [];
+    const ratings = [];
+    const sigmas = [];
+    const races = [];
+    for (let i = 1; i < lines.length; i++) {
+        if (!lines[i]) continue;
+        const values = parseCSVLine(lines[i]);
+        const nRaces = parseInt(values[racesCol]);
+        if (!(nRaces >= MIN_RACES)) continue;
+        names.push(values[nameCol]);
+        ranks.push(parseInt(values[rankCol]));
+        ratings.push(parseFloat(values[ratingCol]));
+        sigmas.push(parseFloat(values[sigmaCol]));
+        races.push(nRaces);
+    }
+
+    const tokens = [];
+    const searchNames = names.map((name, position) => {
+        const words = normalizeName(name).split(/[\s\-']+/).filter(word => word);
+        for (const word of words) {
+            tokens.push([word, position]);
+        }
+        return words;
+    });
+    tokens.sort((a, b) => (a[0] < b[0] ? -1 : a[0] > b[0] ? 1 : a[1] - b[1]));
+
+    return {
+        count: names.length,
+        names: names,
+        ranks: Int32Array.from(ranks),
+        ratings: Float64Array.from(ratings),
+        sigmas: Float64Array.from(sigmas),
+        races: Int32Array.from(races),
+        searchKeys: tokens.map(token => token[0]),
+        searchPositions: Int32Array.from(tokens.map(token => token[1])),
+        searchNames: searchNames, // normalized words of each name
+        positions: new Map(names.map((name, position) => [name, position]))
+    };
+}
+
+function parseRaceHistoryLines(text) {
+    // One race per line, appended as races are processed. A race may be written again
+    // with the same index, and the last line may be incomplete if it was being written.
+    const races = [];
+    for (const line of text.split('\n')) {
+        if (!line.trim()) continue;
+        try {
+            const race = JSON.parse(line);
+            races[race.race_idx] = race;
+        } catch (error) {
+            console.warn('Ignoring incomplete race history line');
+        }
+    }
+    return races.filter(race => race);
+}
+
+function indexRaceHistory(races) {
+    // Results of each runner, so that the history of a runner is a single lookup
+    const runners = new Map();
+    races.forEach((race, raceIndex) => {
+        const totalRunners = race.race_data.length;
+        for (const result of race.race_data) {
+            let place = parseInt(result.place);
+            if (isNaN(place)) {
+                place = totalRunners; // DNF/DNS
+            }
+            if (!runners.has(result.name)) runners.set(result.name, []);
+            runners.get(result.name).push([raceIndex, place, totalRunners]);
+        }
+    });
+    return { races: races.map(race => race.race_name), runners: runners };
+}
+
+async function fetchRaceHistory(urls) {
+    // JSONL race history, or the JSON array written by previous versions
+    for (const url of urls) {
+        const response = await fetch(url);
+        if (!response.ok) continue;
+        const text = await response.text();
+        const races = url.endsWith('.jsonl') ? parseRaceHistoryLines(text) : JSON.parse(text);
+        raceHistory = indexRaceHistory(races);
+        return { races: races.length };
+    }
+    throw new Error('Race history not available');
+}
+
+function runnerHistory(name) {
+    if (!raceHistory) return [];
+    return (raceHistory.runners.get(name) || []).map(([raceIndex, place, totalRunners]) => ({
+        race: raceIndex + 1,
+        raceName: raceHistory.races[raceIndex].replace('.csv', ''),
+        place: place,
+        totalRunners: totalRunners
+    }));
+}
+
+function openDatabase() {
+    // Resolves to null if IndexedDB is not available (e.g. some private browsing modes): nothing is cached then
+    if (!databaseOpening) {
+        databaseOpening = new Promise(resolve => {
+            if (typeof indexedDB === 'undefined') {
+                resolve(null);
+                return;
+            }
+            const request = indexedDB.open(DB_NAME, 1);
+            request.onupgradeneeded = () => request.result.createObjectStore(DB_STORE, { keyPath: 'name' });
+            request.onsuccess = () => resolve(request.result);
+            request.onerror = () => {
+                console.warn('Local cache not available:', request.error);
+                resolve(null);
+            };
+        });
+    }
+    return databaseOpening;
+}
+
+async function readRecord(name) {
+    const database = await openDatabase();
+    if (!database) return null;
+    return new Promise(resolve => {
+        const request = database.transaction(DB_STORE).objectStore(DB_STORE).get(name);
+        request.onsuccess = () => resolve(request.result || null);
+        request.onerror = () => resolve(null);
+    });
+}
+
+async function writeRecord(record) {
+    // A failed write (e.g. storage quota) only means the file is downloaded again next time
+    const database = await openDatabase();
+    if (!database) return;
+    return new Promise(resolve => {
+        const transaction = database.transaction(DB_STORE, 'readwrite');
+        transaction.objectStore(DB_STORE).put(record);
+        transaction.oncomplete = () => resolve();
+        transaction.onerror = transaction.onabort = () => {
+            console.warn(`Could not cache ${record.name}:`, transaction.error);
+            resolve();
+        };
+    });
+}
+
+async function pruneRecords(files) {
+    // Removes the records of files which are no longer published under the same path
+    const database = await openDatabase();
+    if (!database) return 0;
+    return new Promise(resolve => {
+        let removed = 0;
+        const transaction = database.transaction(DB_STORE, 'readwrite');
+        transaction.objectStore(DB_STORE).openCursor().onsuccess = event => {
+            const cursor = event.target.result;
+            if (!cursor) return;
+            const record = cursor.value;
+            if (record.path !== undefined && (!files[record.name] || files[record.name].path !== record.path)) {
+                cursor.delete();
+                removed++;
+            }
+            cursor.continue();
+        };
+        transaction.oncomplete = () => resolve(removed);
+        transaction.onerror = transaction.onabort = () => resolve(removed);
+    });
+}
+
+async function loadFile(request) {
+    // Parsed content of a file: from the local cache if it holds the same published path, downloaded otherwise.
+    // Files which are not published (no path) are always downloaded, as their content may change under the same name.
+    if (request.path) {
+        const record = await readRecord(request.name);
+        if (record && record.path === request.path) {
+            return record.data;
+        }
+    }
+    const response = await fetch(request.url);
+    if (!response.ok) {
+        throw new Error(`Failed to load ${request.name}: ${response.status} ${response.statusText}`);
+    }
+    const data = request.format === 'rankings' ? buildRankings(await response.text()) : await response.json();
+    if (request.path) {
+        await writeRecord({ name: request.name, path: request.path, data: data });
+    }
+    return data;
+}
+
+async function handleRequest(request) {
+    switch (request.type) {
+        case 'load':
+            return loadFile(request);
+        case 'cached': {
+            const record = await readRecord(request.name);
+            return record ? record.data : null;
+        }
+        case 'store':
+            return writeRecord({ name: request.name, data: request.data });
+        case 'prune':
+            return pruneRecords(request.files);
+        case 'raceHistory':
+            return fetchRaceHistory(request.urls);
+        case 'runnerHistory':
+            return runnerHistory(request.name);
+        default:
+            throw new Error(`Unknown request ${request.type}`);
+    }
+}
+
+if (typeof importScripts === 'function') {
+    // Worker scope: answer the requests of the page, transferring the typed arrays instead of copying them
+    self.onmessage = async event => {
+        const { id, request } = event.data;
+        try {
+            const result = await handleRequest(request);
+            const transfer = Object.values(result && typeof result === 'object' ? result : {}).filter(value => ArrayBuffer.isView(value)).map(value => value.buffer);
+            self.postMessage({ id, result }, transfer);
+        } catch (error) {
+            self.postMessage({ id, error: error.message });
+        }
+    };
+}
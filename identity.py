@@ -0,0 +1,256 @@
+#%%
+import io
+from array import array
+import numpy as np
+
+#%%
+
+class IdentityStore:
+    def __init__(self):
+        """
+        Identity of the runners: integer runner ids, their canonical (display) name, their aliases
+        and the pairs of names known to be different people ("cannot-link" constraints).
+
+        Runners form a union-find forest: merging two runners links the root of one to the root of the other,
+        so that the ids and aliases of both resolve to the same runner without rewriting them.
+        Aliases are normalized names (see rank.normalize_name).
+        """
+        self.parent = array('i')   # runner id -> parent id (itself for a root)
+        self.size = array('i')     # root id -> number of ids of its tree
+        self.names = []            # runner id -> canonical name (meaningful for roots)
+        self.ids = {}              # canonical name -> root id
+        self.alias_ids = {}        # alias -> runner id
+        self.aliases = {}          # root id -> list of aliases
+        self.different = {}        # alias -> set of aliases of different people
+        # Number of times the runners of already processed races changed (reviewed pairs replayed), so that
+        # rankings computed from the same races with older identities (e.g. per category) can tell they are stale
+        self.revision = 0
+        # Version of rank.normalize_name the aliases were computed with (0 for the stores of previous versions)
+        self.normalization = 0
+
+
+    def __len__(self):
+        """
+        Number of runners (merged runners count once)
+        """
+        return len(self.ids)
+
+
+    def add_runner(self, name, normalized_name=None):
+        """
+        Adds a runner with a canonical name, and its normalized name as first alias
+
+        Returns:
+            int: id of the new runner
+        """
+        runner_id = len(self.parent)
+        self.parent.append(runner_id)
+        self.size.append(1)
+        self.names.append(name)
+        self.ids[name] = runner_id
+        self.aliases[runner_id] = []
+        if normalized_name is not None:
+            self.add_alias(normalized_name, runner_id)
+        return runner_id
+
+
+    def find(self, runner_id):
+        """
+        Root id of a runner, halving the path to it
+        """
+        parent = self.parent
+        while parent[runner_id] != runner_id:
+            parent[runner_id] = parent[parent[runner_id]]
+            runner_id = parent[runner_id]
+        return runner_id
+
+
+    def lookup(self, normalized_name):
+        """
+        Returns:
+            int: root id of the runner with this alias, None if the alias is unknown
+        """
+        runner_id = self.alias_ids.get(normalized_name)
+        return None if runner_id is None else self.find(runner_id)
+
+
+    def id_of(self, name):
+        """
+        Returns:
+            int: id of the runner with this canonical name, None if there is none
+        """
+        return self.ids.get(name)
+
+
+    def name_of(self, runner_id):
+        """
+        Returns:
+            str: canonical name of a runner
+        """
+        return self.names[self.find(runner_id)]
+
+
+    def runner_names(self):
+        """
+        Returns:
+            list of str: canonical name of each runner, in the order the runners were added
+        """
+        return [name for runner_id, name in enumerate(self.names) if self.parent[runner_id] == runner_id]
+
+
+    def add_alias(self, normalized_name, runner_id):
+        """
+        Makes normalized_name an alias of a runner, instead of the runner it was an alias of (if any)
+        """
+        root = self.find(runner_id)
+        previous = self.alias_ids.get(normalized_name)
+        if previous is not None:
+            previous = self.find(previous)
+            if previous == root:
+                return
+            self.aliases[previous].remove(normalized_name)
+        self.alias_ids[normalized_name] = root
+        self.aliases[root].append(normalized_name)
+
+
+    def union(self, runner_id, other_id):
+        """
+        Merges two runners, the merged runner keeping the canonical name of runner_id
+
+        Raises:
+            ValueError: if an alias of one runner is known to be a different person from an alias of the other
+
+        Returns:
+            int: root id of the merged runner
+        """
+        root, other = self.find(runner_id), self.find(other_id)
+        if root == other:
+            return root
+        name = self.names[root]
+        # The smaller tree goes under the larger one, its aliases and constraints are checked and moved
+        if self.size[root] < self.size[other]:
+            root, other = other, root
+        for alias in self.aliases[other]:
+            for different_alias in self.different.get(alias, ()):
+                if self.lookup(different_alias) == root:
+                    raise ValueError(f'"{alias}" and "{different_alias}" are different people')
+        self.parent[other] = root
+        self.size[root] += self.size[other]
+        self.aliases[root].extend(self.aliases.pop(other))
+        del self.ids[self.names[other]]
+        del self.ids[self.names[root]]
+        self.names[root] = name
+        self.ids[name] = root
+        return root
+
+
+    def add_cannot_link(self, normalized_name, other_name):
+        """
+        Records that two names are different people
+        """
+        self.different.setdefault(normalized_name, set()).add(other_name)
+        self.different.setdefault(other_name, set()).add(normalized_name)
+
+
+    def cannot_link(self, normalized_name, other_name):
+        """
+        Returns:
+            bool: True if the two names are known to be different people
+        """
+        return other_name in self.different.get(normalized_name, ())
+
+
+    def cannot_link_pairs(self):
+        """
+        Returns:
+            list of tuple: each pair of names known to be different people, sorted
+        """
+        return sorted({tuple(sorted([name, other])) for name, others in self.different.items() for other in others})
+
+
+    def add_folded_aliases(self, aliases):
+        """
+        Adds new forms of existing aliases, e.g. when the normalization of the names changes. 
+        The previous forms are kept, and so are the names of different people, which are also recorded for the new forms.
+        A new form which is already the alias of another runner is not added.
+
+        Args:
+            aliases (dict): alias -> new form of the alias
+
+        Returns:
+            int: number of aliases added
+        """
+        n_added = 0
+        for alias, new_alias in aliases.items():
+            runner_id = self.lookup(alias)
+            if runner_id is not None and self.lookup(new_alias) is None:
+                self.add_alias(new_alias, runner_id)
+                n_added += 1
+        for normalized_name, other_name in self.cannot_link_pairs():
+            for name in {normalized_name, aliases.get(normalized_name, normalized_name)}:
+                for other in {other_name, aliases.get(other_name, other_name)}:
+                    self.add_cannot_link(name, other)
+        return n_added
+
+
+    @classmethod
+    def from_mappings(cls, name_mapping, different_names):
+        """
+        Builds the store from the name caches of previous versions
+
+        Args:
+            name_mapping (dict): normalized name -> canonical name
+            different_names (iterable): pairs of normalized names of different people
+        """
+        store = cls()
+        for normalized_name, name in name_mapping.items():
+            runner_id = store.id_of(name)
+            if runner_id is None:
+                runner_id = store.add_runner(name)
+            store.add_alias(normalized_name, runner_id)
+        for normalized_name, other_name in different_names:
+            store.add_cannot_link(normalized_name, other_name)
+        return store
+
+
+    def to_bytes(self):
+        """
+        Serializes the store as an uncompressed npz archive
+        """
+        buffer = io.BytesIO()
+        pairs = self.cannot_link_pairs()
+        np.savez(buffer, parent=np.frombuffer(self.parent, dtype=np.int32), size=np.frombuffer(self.size, dtype=np.int32),
+                 names=np.array(self.names, dtype=str), aliases=np.array(list(self.alias_ids), dtype=str),
+                 alias_ids=np.array(list(self.alias_ids.values()), dtype=np.int32),
+                 different=np.array(pairs, dtype=str).reshape(len(pairs), 2), revision=np.int64(self.revision),
+                 normalization=np.int64(self.normalization))
+        return buffer.getvalue()
+
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a store written by to_bytes, in a single read of the file
+        """
+        with open(path, 'rb') as f:
+            content = f.read()
+        store = cls()
+        with np.load(io.BytesIO(content), allow_pickle=False) as data:
+            store.parent = array('i', data['parent'].astype(np.int32).tobytes())
+            store.size = array('i', data['size'].astype(np.int32).tobytes())
+            store.names = data['names'].tolist()
+            aliases, alias_ids, different = data['aliases'].tolist(), data['alias_ids'].tolist(), data['different'].tolist()
+            # Stores written by previous versions have no revision
+            store.revision = int(data['revision']) if 'revision' in data.files else 0
+            store.normalization = int(data['normalization']) if 'normalization' in data.files else 0
+        for runner_id, name in enumerate(store.names):
+            if store.parent[runner_id] == runner_id:
+                store.ids[name] = runner_id
+                store.aliases[runner_id] = []
+        for alias, runner_id in zip(aliases, alias_ids):
+            root = store.find(runner_id)
+            store.alias_ids[alias] = root
+            store.aliases[root].append(alias)
+        for normalized_name, other_name in different:
+            store.add_cannot_link(normalized_name, other_name)
+        return store
@@ -0,0 +1,254 @@
+#%%
+import math
+from collections import Counter
+
+#%%
+
+class NameIndex:
+    def __init__(self, q_values=(2, 3)):
+        """
+        Q-gram inverted index over the normalized names of known runners.
+
+        Every q-gram occurrence is indexed as a (q-gram, k) token, k being its occurrence count in the name,
+        so that the multiset intersection of two names becomes a plain set intersection of tokens.
+        Candidates are generated with a prefix filter on the rarest tokens of the query and are guaranteed to
+        contain every known name whose SequenceMatcher ratio with the query can reach the threshold.
+
+        Args:
+            q_values (tuple of int, optional): q-gram sizes to index. The cheapest one is picked for each lookup. Defaults to (2, 3).
+        """
+        self.q_values = q_values
+        self.names = []        # ordinal -> display name
+        self.normalized = []   # ordinal -> normalized name
+        self.ordinals = {}     # display name -> ordinal
+        self.lengths = {}      # length of normalized name -> list of ordinals
+        self.tokens = {q: [] for q in q_values}    # q -> ordinal -> set of (q-gram, k) tokens
+        self.postings = {q: {} for q in q_values}  # q -> (q-gram, k) token -> list of ordinals
+
+
+    def __len__(self):
+        return len(self.names)
+
+
+    def __contains__(self, name):
+        return name in self.ordinals
+
+
+    @staticmethod
+    def get_tokens(normalized_name, q):
+        """
+        Split a normalized name into its (q-gram, occurrence) tokens
+
+        Args:
+            normalized_name (str): normalized name
+            q (int): size of the q-grams
+
+        Returns:
+            list of tuple: one (q-gram, k) token per q-gram occurrence
+        """
+        seen = Counter()
+        tokens = []
+        for i in range(len(normalized_name) - q + 1):
+            gram = normalized_name[i:i+q]
+            seen[gram] += 1
+            tokens.append((gram, seen[gram]))
+        return tokens
+
+
+    @staticmethod
+    def length_window(length, threshold):
+        """
+        Range of name lengths that can reach threshold against a name of the given length,
+        since ratio = 2*M/(la+lb) <= 2*min(la, lb)/(la+lb)
+        """
+        eps = 1e-9
+        low = math.ceil(length * threshold / (2 - threshold) - eps)
+        high = math.floor(length * (2 - threshold) / threshold + eps) if threshold > 0 else float('inf')
+        return max(low, 0), high
+
+
+    @staticmethod
+    def min_shared(la, lb, threshold, q):
+        """
+        Lower bound on the number of q-gram tokens shared by two names of lengths la and lb whose ratio is >= threshold.
+
+        With M matched characters split in n matching blocks, at least M - (q-1)*n q-grams are shared,
+        and n <= (la - M) + (lb - M) + 1 since consecutive blocks are separated by at least one unmatched character.
+        With M >= threshold*(la+lb)/2, it gives shared >= ((2q-1)*threshold/2 - (q-1))*(la+lb) - (q-1).
+        """
+        return math.ceil(((2*q - 1) * threshold / 2 - (q - 1)) * (la + lb) - (q - 1) - 1e-9)
+
+
+    def add(self, name, normalized_name):
+        """
+        Add a runner to the index. Names already indexed are ignored.
+
+        Args:
+            name (str): display name of the runner (key in Ranker.players)
+            normalized_name (str): normalized form of the name
+        """
+        if name in self.ordinals:
+            return
+        ordinal = len(self.names)
+        self.names.append(name)
+        self.normalized.append(normalized_name)
+        self.ordinals[name] = ordinal
+        self.lengths.setdefault(len(normalized_name), []).append(ordinal)
+        for q in self.q_values:
+            tokens = self.get_tokens(normalized_name, q)
+            self.tokens[q].append(set(tokens))
+            postings = self.postings[q]
+            for token in tokens:
+                postings.setdefault(token, []).append(ordinal)
+
+
+    def plan(self, normalized_name, threshold, q):
+        """
+        Lookup plan for one q-gram size: the length buckets to scan entirely, and the prefix tokens to probe
+
+        Returns:
+            tuple: (list of lengths to scan, list of prefix tokens, first length covered by the prefix, estimated cost)
+        """
+        la = len(normalized_name)
+        low, high = self.length_window(la, threshold)
+        postings = self.postings[q]
+
+        scanned = []
+        prefix_low = None
+        cost = 0
+        for lb in self.lengths:
+            if lb < low or lb > high:
+                continue
+            if self.min_shared(la, lb, threshold, q) <= 0:
+                scanned.append(lb)
+                cost += len(self.lengths[lb])
+            elif prefix_low is None or lb < prefix_low:
+                prefix_low = lb
+
+        prefix = []
+        if prefix_low is not None:
+            query_tokens = self.get_tokens(normalized_name, q)
+            required = self.min_shared(la, prefix_low, threshold, q)
+            if len(query_tokens) >= required:
+                # A candidate sharing >= required tokens must share one of the (n - required + 1) rarest ones
+                query_tokens.sort(key=lambda token: len(postings.get(token, ())))
+                prefix = query_tokens[:len(query_tokens) - required + 1]
+                cost += sum(len(postings.get(token, ())) for token in prefix)
+
+        return scanned, prefix, prefix_low, cost
+
+
+    def candidates(self, normalized_name, threshold):
+        """
+        Find the known runners that may be similar to normalized_name
+
+        Args:
+            normalized_name (str): normalized name to look for
+            threshold (float): minimum SequenceMatcher ratio of interest
+
+        Returns:
+            list of tuple: (display name, normalized name) of the candidates, in insertion order
+        """
+        la = len(normalized_name)
+        _, high = self.length_window(la, threshold)
+        plans = {q: self.plan(normalized_name, threshold, q) for q in self.q_values}
+        q = min(plans, key=lambda q: plans[q][3])
+        scanned, prefix, prefix_low, _ = plans[q]
+
+        selected = set()
+        for lb in scanned:
+            selected.update(self.lengths[lb])
+
+        if prefix:
+            postings = self.postings[q]
+            for token in prefix:
+                for ordinal in postings.get(token, ()):
+                    lb = len(self.normalized[ordinal])
+                    if prefix_low <= lb <= high:
+                        selected.add(ordinal)
+
+        # Every q-gram bound must hold, whichever q generated the candidate
+        query_sets = {q: set(self.get_tokens(normalized_name, q)) for q in self.q_values}
+        kept = []
+        for ordinal in sorted(selected):
+            lb = len(self.normalized[ordinal])
+            if all(len(query_sets[q] & self.tokens[q][ordinal]) >= self.min_shared(la, lb, threshold, q) for q in self.q_values):
+                kept.append(ordinal)
+
+        return [(self.names[ordinal], self.normalized[ordinal]) for ordinal in kept]
+
+
+
+#-----------------------------------------------------#
+
+
+
+def benchmark(sizes=(1000, 5000, 10000, 50000, 100000), n_queries=200, threshold=0.85, seed=0):
+    """
+    Compares indexed candidate lookup against a full scan on synthetic runner names
+
+    Args:
+        sizes (tuple of int, optional): numbers of known runners to benchmark. Defaults to (1000, 5000, 10000, 50000, 100000).
+        n_queries (int, optional): number of lookups per size. Defaults to 200.
+        threshold (float, optional): similarity threshold. Defaults to 0.85.
+        seed (int, optional): random seed. Defaults to 0.
+    """
+    import random
+    import time
+    from difflib import SequenceMatcher
+
+    rng = random.Random(seed)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+
+    def random_word(n_min, n_max):
+        return ''.join(rng.choice(letters) for _ in range(rng.randint(n_min, n_max)))
+
+    def typo(name):
+        i = rng.randrange(len(name))
+        return name[:i] + rng.choice(letters) + name[i+1:]
+
+    names = list({f'{random_word(4, 10)} {random_word(3, 8)}' for _ in range(max(sizes) * 11 // 10)})[:max(sizes)]
+
+    print(f"{'Runners':<10} {'Index (ms)':<12} {'Scan (ms)':<12} {'Candidates':<12} {'Exact':<6}")
+    for size in sizes:
+        index = NameIndex()
+        for name in names[:size]:
+            index.add(name, name)
+        queries = [typo(rng.choice(names[:size])) for _ in range(n_queries)]
+
+        start = time.perf_counter()
+        n_candidates = 0
+        indexed = []
+        for query in queries:
+            candidates = index.candidates(query, threshold)
+            n_candidates += len(candidates)
+            indexed.append([n for n, norm in candidates if SequenceMatcher(None, query, norm).ratio() >= threshold])
+        index_time = (time.perf_counter() - start) / n_queries * 1000
+
+        # The full scan is costly: only run it on a subset of the queries
+        n_scan = max(1, n_queries // 20)
+        start = time.perf_counter()
+        scanned = []
+        for query in queries[:n_scan]:
+            scanned.append([n for n in names[:size] if SequenceMatcher(None, query, n).ratio() >= threshold])
+        scan_time = (time.perf_counter() - start) / n_scan * 1000
+
+        exact = indexed[:n_scan] == scanned
+        print(f"{size:<10} {index_time:<12.3f} {scan_time:<12.3f} {n_candidates / n_queries:<12.1f} {str(exact):<6}")
+
+
+# %%
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark the runner name index against a full scan')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000, 10000, 50000, 100000],
+                       help='Numbers of known runners to benchmark')
+    parser.add_argument('--n_queries', type=int, default=200,
+                       help='Number of lookups per size')
+
+    args = parser.parse_args()
+
+    benchmark(args.sizes, args.n_queries)
+# %%
@@ -1,20 +1,64 @@
 #%%
 import os
-import shutil
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import camelot
 import pandas as pd
+from persistence import atomic_write
 pd.options.mode.chained_assignment = None
 
 print('parse_files.py imports: Done')
 #%%
 
 class FileParser:
-    def __init__(self, read_folder, write_folder = 'data/csv'):
+    def __init__(self, read_folder, write_folder = 'data/csv', manifest_file = 'parse_manifest.json'):
         self.read_folder = read_folder
-        self.files = os.listdir(read_folder)
+        self.files = sorted(os.listdir(read_folder))
         self.write_folder = write_folder
-        shutil.rmtree(write_folder) 
-        os.makedirs(write_folder)
+        os.makedirs(write_folder, exist_ok=True)
+        # pdf file -> {'hash': content hash, 'outputs': csv files written from it}
+        self.manifest_path = os.path.join(write_folder, manifest_file)
+        self.manifest = self.load_manifest()
+
+    def load_manifest(self):
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                print(f'Error loading parse manifest: {e}')
+        return {}
+
+    def save_manifest(self):
+        atomic_write(self.manifest_path, json.dumps(dict(sorted(self.manifest.items())), indent=2, ensure_ascii=False))
+
+    def file_hash(self, file):
+        """
+        SHA-256 of the content of a file of read_folder
+        """
+        digest = hashlib.sha256()
+        with open(os.path.join(self.read_folder, file), 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def output_prefix(self, file):
+        """
+        Start of the names of the csv files written from a file (see write_file)
+        """
+        return f'{os.path.splitext(file)[0]}_'
+
+    def remove_outputs(self, file, outputs):
+        """
+        Removes csv files written from file, except the ones the manifest records for another file 
+        (previous versions named the csv files after the pdf name up to its first dot, so two files could share them)
+        """
+        others = {csv_name for other, entry in self.manifest.items() if other != file for csv_name in entry['outputs']}
+        for csv_name in outputs:
+            csv_path = os.path.join(self.write_folder, csv_name)
+            if csv_name not in others and os.path.exists(csv_path):
+                os.remove(csv_path)
 
     def clean_dataframe(self, df):
         indices = []
@@ -54,12 +98,84 @@ class FileParser:
                     results[-1] = pd.concat([results[-1], df])
         return results
 
-    def parse_files(self):
+    def write_file(self, file):
+        """
+        Parses one pdf file of read_folder and writes one csv per race in write_folder, named <file>_<idx>.csv
+        where <file> is the name of the pdf file without its extension only (e.g. 2023.01.05_race_0.csv), 
+        so that files parsed at the same time never write the same csv file
+
+        Returns:
+            list of str: names of the written csv files
+        """
+        results = self.parse_file(os.path.join(self.read_folder, file))
+        written = []
+        for idx, result in enumerate(results):
+            csv_name = f'{os.path.splitext(file)[0]}_{idx}.csv'
+            result.to_csv(os.path.join(self.write_folder, csv_name), index=False, header=['place', 'name', 'club', 'category'])
+            written.append(csv_name)
+        return written
+
+    def parse_files(self, jobs=1, force=False):
+        """
+        Parses the files of read_folder which are new or changed since the last run, according to the manifest.
+        Outputs of deleted files are removed, outputs of unchanged files are left untouched.
+        A file which fails is reported and does not stop the others.
+
+        Args:
+            jobs (int, optional): number of worker processes. 1 parses in the current process, 
+                                  None or 0 uses every core. Defaults to 1.
+            force (bool, optional): parse every file, even unchanged ones. Defaults to False.
+
+        Returns:
+            dict: file name -> error message, for the files which could not be parsed
+        """
+        for file in sorted(set(self.manifest) - set(self.files)):
+            print(f'Removing outputs of deleted file {file}')
+            self.remove_outputs(file, self.manifest.pop(file)['outputs'])
+
+        hashes = {file: self.file_hash(file) for file in self.files}
+        # Outputs recorded for several files were overwritten by one of them
+        owners = {}
+        for file, entry in self.manifest.items():
+            for csv_name in entry['outputs']:
+                owners.setdefault(csv_name, []).append(file)
+        to_parse = []
         for file in self.files:
-            results = self.parse_file(os.path.join(self.read_folder, file))
-            for idx, result in enumerate(results):
-                result.to_csv(os.path.join(self.write_folder, f'{file.split(".")[0]}_{idx}.csv'), index=False, header=['place', 'name', 'club', 'category'])
-        return None
+            entry = self.manifest.get(file)
+            up_to_date = (entry is not None and entry['hash'] == hashes[file]
+                          and all(csv_name.startswith(self.output_prefix(file)) and len(owners[csv_name]) == 1 
+                                  and os.path.exists(os.path.join(self.write_folder, csv_name)) for csv_name in entry['outputs']))
+            if force or not up_to_date:
+                to_parse.append(file)
+        print(f'{len(to_parse)} new or changed files to parse, {len(self.files) - len(to_parse)} unchanged')
+
+        outputs = {}
+        errors = {}
+        if jobs == 1:
+            for file in to_parse:
+                try:
+                    outputs[file] = self.write_file(file)
+                except Exception as e:
+                    errors[file] = str(e)
+        else:
+            with ProcessPoolExecutor(max_workers=jobs or None) as executor:
+                futures = {executor.submit(self.write_file, file): file for file in to_parse}
+                for future in as_completed(futures):
+                    try:
+                        outputs[futures[future]] = future.result()
+                    except Exception as e:
+                        errors[futures[future]] = str(e)
+
+        for file, written in outputs.items():
+            # A changed file may produce fewer races than before
+            previous = self.manifest.get(file, {}).get('outputs', [])
+            self.manifest[file] = {'hash': hashes[file], 'outputs': written}
+            self.remove_outputs(file, [csv_name for csv_name in previous if csv_name not in written])
+        self.save_manifest()
+
+        for file, error in sorted(errors.items()):
+            print(f'Error parsing {file}: {error}')
+        return errors
 
 print('parse_files.py classes & functions: Done')
 # %%
@@ -70,9 +186,11 @@ if __name__ == '__main__':
 
     parser.add_argument('--read_folder', type=str, default='data/pdf', help='Folder to read the pdf files from')
     parser.add_argument('--write_folder', type=str, default='data/csv', help='Folder to write the csv files to')
+    parser.add_argument('--jobs', type=int, default=1, help='Number of files parsed in parallel (0 to use every core)')
+    parser.add_argument('--force', action='store_true', help='Parse every file again, even unchanged ones')
     args = parser.parse_args()
 
     print('Parsing files...', end='')
     file_parser = FileParser(args.read_folder, args.write_folder)
-    file_parser.parse_files()
+    file_parser.parse_files(jobs=args.jobs, force=args.force)
     print(' Done !')
\ No newline at end of file
@@ -0,0 +1,260 @@
+#%%
+import os
+import json
+import time
+import zlib
+import struct
+import tempfile
+
+#%%
+
+def atomic_write(path, data, encoding='utf-8'):
+    """
+    Writes data to path atomically: the content goes to a temporary file in the same folder,
+    which is then renamed over path. Readers see either the old or the new file, never a partial one.
+
+    Args:
+        path (str): destination file
+        data (str or bytes): content to write
+        encoding (str, optional): encoding used when data is a str. Defaults to 'utf-8'.
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+    os.makedirs(folder, exist_ok=True)
+    if isinstance(data, str):
+        data = data.encode(encoding)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix='.' + os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        # mkstemp creates the file readable by its owner only: use the usual permissions instead
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_path, 0o666 & ~umask)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_if_changed(path, data, encoding='utf-8'):
+    """
+    Writes data to path atomically, unless the file already holds the same content
+
+    Returns:
+        bool: whether the file was written
+    """
+    if isinstance(data, str):
+        data = data.encode(encoding)
+    if os.path.exists(path) and os.path.getsize(path) == len(data):
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                return False
+    atomic_write(path, data)
+    return True
+
+
+
+def valid_lines_size(path):
+    """
+    Size of the complete lines of a text file, i.e. up to its last newline
+    """
+    with open(path, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            step = min(4096, position)
+            f.seek(position - step)
+            chunk = f.read(step)
+            newline = chunk.rfind(b'\n')
+            if newline >= 0:
+                return position - step + newline + 1
+            position -= step
+    return 0
+
+
+def append_lines(path, lines, encoding='utf-8'):
+    """
+    Appends lines to a text file and forces them to disk. A partially written last line
+    (from an interrupted append) is removed first, so that it does not merge with the new lines.
+
+    Args:
+        path (str): file to append to, created if needed
+        lines (list of str): lines to append, without newline
+        encoding (str, optional): encoding of the file. Defaults to 'utf-8'.
+
+    Returns:
+        int: number of bytes written
+    """
+    data = ''.join(line + '\n' for line in lines).encode(encoding)
+    if os.path.exists(path):
+        size = valid_lines_size(path)
+        if size != os.path.getsize(path):
+            os.truncate(path, size)
+    with open(path, 'ab') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    return len(data)
+
+
+class SegmentLog:
+    # Header of each record: magic, length and CRC-32 of the payload
+    HEADER = struct.Struct('<4sII')
+    MAGIC = b'SEG1'
+
+    def __init__(self, path):
+        """
+        Append-only log of binary records (segments).
+
+        Each record is a header with its length and checksum, followed by its payload. A record which was not
+        completely written (interrupted append) or does not match its checksum ends the log: it is ignored
+        when reading, and removed before the next append.
+
+        Args:
+            path (str): log file
+        """
+        self.path = path
+
+
+    def read(self):
+        """
+        Reads the complete records of the log
+
+        Returns:
+            tuple: list of the payloads (bytes) in the order they were appended, and the size of the complete records
+        """
+        if not os.path.exists(self.path):
+            return [], 0
+        with open(self.path, 'rb') as f:
+            content = f.read()
+        records, position = [], 0
+        while position + self.HEADER.size <= len(content):
+            magic, length, checksum = self.HEADER.unpack_from(content, position)
+            start = position + self.HEADER.size
+            payload = content[start:start + length]
+            if magic != self.MAGIC or len(payload) != length or zlib.crc32(payload) != checksum:
+                break
+            records.append(payload)
+            position = start + length
+        return records, position
+
+
+    def append(self, payload):
+        """
+        Appends a record and forces it to disk, removing a partial record left at the end of the log first
+
+        Returns:
+            int: number of bytes written
+        """
+        if os.path.exists(self.path):
+            _, size = self.read()
+            if size != os.path.getsize(self.path):
+                os.truncate(self.path, size)
+        record = self.HEADER.pack(self.MAGIC, len(payload), zlib.crc32(payload)) + payload
+        with open(self.path, 'ab') as f:
+            f.write(record)
+            f.flush()
+            os.fsync(f.fileno())
+        return len(record)
+
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class WriteBehindCache:
+    def __init__(self, cache_dir, flush_interval=None, journal_file='journal.jsonl'):
+        """
+        Batches cache writes in memory and flushes them on demand or periodically
+
+        Cache files are registered with the function writing them. Callers only mark them dirty,
+        and the writers run at the next flush. Changes which cannot be recomputed from the race files
+        (e.g. interactive answers) are also appended to a journal, which is fsynced at once
+        and replayed on startup if the process stopped before the next flush.
+
+        Args:
+            cache_dir (str): folder of the cache files
+            flush_interval (float, optional): flush dirty caches at most every flush_interval seconds
+                                              when maybe_flush is called. Defaults to None (explicit flushes only).
+            journal_file (str, optional): name of the journal file in cache_dir. Defaults to 'journal.jsonl'.
+        """
+        self.cache_dir = cache_dir
+        self.flush_interval = flush_interval
+        self.journal_path = os.path.join(cache_dir, journal_file)
+        self.writers = {}   # cache name -> function writing it
+        self.dirty = set()
+        self.last_flush = time.monotonic()
+
+
+    def register(self, name, writer):
+        """
+        Registers the function called to write the cache name when it is dirty
+        """
+        self.writers[name] = writer
+
+
+    def mark_dirty(self, name):
+        self.dirty.add(name)
+
+
+    def journal(self, record):
+        """
+        Appends a record to the journal and forces it to disk
+
+        Args:
+            record (dict): JSON serializable record
+        """
+        with open(self.journal_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+
+    def read_journal(self):
+        """
+        Reads the records of the journal. A partially written last line is ignored.
+
+        Returns:
+            list of dict: records in the order they were written
+        """
+        records = []
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        break
+        return records
+
+
+    def clear_journal(self):
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+
+    def flush(self):
+        """
+        Writes every dirty cache, then clears the journal since its content is now in the caches.
+        A writer returning False keeps its cache dirty and the journal untouched.
+        """
+        failed = set()
+        for name in sorted(self.dirty):
+            if self.writers[name]() is False:
+                failed.add(name)
+        self.dirty = failed
+        if not failed:
+            self.clear_journal()
+        self.last_flush = time.monotonic()
+
+
+    def maybe_flush(self):
+        """
+        Flushes if dirty caches are older than flush_interval
+        """
+        if self.flush_interval is not None and self.dirty and time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
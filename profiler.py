@@ -0,0 +1,142 @@
+#%%
+import os
+import json
+import time
+import functools
+import contextlib
+
+#%%
+
+_DISABLED_STAGE = contextlib.nullcontext()
+
+
+class Profiler:
+    def __init__(self, enabled=False):
+        """
+        Wall time and counters of the stages of a ranking run.
+
+        Each stage accumulates its number of calls, its wall time and named counters
+        (rows processed, similarity comparisons, bytes written...). When disabled, stage() returns
+        a shared no-op context and count() returns at once, so the instrumentation costs next to nothing.
+
+        Args:
+            enabled (bool, optional): record the stages. Defaults to False.
+        """
+        self.enabled = enabled
+        self.stages = {}  # stage name -> {'calls': int, 'wall_s': float, counter name -> value}
+
+
+    def entry(self, name):
+        if name not in self.stages:
+            self.stages[name] = {'calls': 0, 'wall_s': 0.0}
+        return self.stages[name]
+
+
+    def stage(self, name):
+        """
+        Context manager timing one call of a stage
+        """
+        if not self.enabled:
+            return _DISABLED_STAGE
+        return self._stage(name)
+
+
+    @contextlib.contextmanager
+    def _stage(self, name):
+        entry = self.entry(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry['calls'] += 1
+            entry['wall_s'] += time.perf_counter() - start
+
+
+    def count(self, name, **counters):
+        """
+        Adds counters to a stage, e.g. count('get_data', files=1, rows=120)
+        """
+        if not self.enabled:
+            return
+        entry = self.entry(name)
+        for counter, value in counters.items():
+            entry[counter] = entry.get(counter, 0) + value
+
+
+    def count_files(self, name, *paths):
+        """
+        Adds the size of the files (or folders) written by a stage to its 'bytes' counter
+        """
+        if not self.enabled:
+            return
+        self.count(name, bytes=sum(path_size(path) for path in paths))
+
+
+    def reset(self):
+        self.stages = {}
+
+
+    def report(self):
+        """
+        Returns:
+            dict: stage name -> calls, wall time in seconds and counters, in the order the stages were first seen
+        """
+        return {name: dict(entry, wall_s=round(entry['wall_s'], 6)) for name, entry in self.stages.items()}
+
+
+    def log_lines(self):
+        """
+        Returns:
+            list of str: one line per stage, e.g. "[profile] get_data: 1 calls, 0.250 s, files=12, rows=1450"
+        """
+        lines = []
+        for name, entry in self.report().items():
+            counters = ', '.join(f'{counter}={value}' for counter, value in entry.items() if counter not in ('calls', 'wall_s'))
+            if entry['calls']:
+                line = f"[profile] {name}: {entry['calls']} calls, {entry['wall_s']:.3f} s" + (f', {counters}' if counters else '')
+            else:
+                # Stage with counters only (its time is part of the stage calling it)
+                line = f"[profile] {name}: {counters}"
+            lines.append(line)
+        return lines
+
+
+    def print_report(self):
+        for line in self.log_lines():
+            print(line)
+
+
+    def save(self, path):
+        """
+        Save the report to path as JSON
+        """
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(self.report(), f, indent=2)
+            print(f"Profile saved to: {path}")
+        except Exception as e:
+            print(f"Error saving profile: {e}")
+
+
+def path_size(path):
+    """
+    Size in bytes of a file, or of the files of a folder
+    """
+    if os.path.isdir(path):
+        return sum(path_size(os.path.join(path, file)) for file in os.listdir(path))
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def profiled(name):
+    """
+    Decorator timing a method of a class holding a Profiler in self.profiler as the stage name
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not self.profiler.enabled:
+                return method(self, *args, **kwargs)
+            with self.profiler.stage(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,181 @@
+#%%
+import os
+import io
+import json
+import gzip
+import hashlib
+from persistence import atomic_write
+
+try:
+    import brotli # Brotli variants of the published files, written when requested and installed
+except ImportError:
+    brotli = None
+
+#%%
+
+PUBLISHED_EXTENSIONS = ('.json', '.jsonl', '.csv')
+
+
+def minify(file_name, data):
+    """
+    Removes the whitespace of JSON (and JSONL) content. Other content is returned unchanged.
+
+    Args:
+        file_name (str): name of the file, whose extension gives the format of data
+        data (bytes): content of the file
+
+    Returns:
+        bytes: minified content
+    """
+    if file_name.endswith('.json'):
+        return json.dumps(json.loads(data), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    if file_name.endswith('.jsonl'):
+        lines = []
+        for line in data.decode('utf-8').splitlines():
+            try:
+                lines.append(json.dumps(json.loads(line), ensure_ascii=False, separators=(',', ':')) + '\n')
+            except json.JSONDecodeError:
+                # Partially written last line
+                break
+        return ''.join(lines).encode('utf-8')
+    return data
+
+
+def content_hash(data, length=12):
+    return hashlib.sha256(data).hexdigest()[:length]
+
+
+# Extensions of the compressed variants which can be written next to each published file, for servers which serve 
+# precompressed files (e.g. nginx gzip_static). GitHub Pages compresses on its own: none is written by default.
+VARIANTS = ('.gz', '.br')
+
+
+def compress(data, variant):
+    """
+    Compresses data with the algorithm of a variant extension ('.gz' or '.br')
+    """
+    if variant == '.br':
+        return brotli.compress(data)
+    buffer = io.BytesIO()
+    # mtime=0 so that the same content always gives the same file
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=9, mtime=0) as f:
+        f.write(data)
+    return buffer.getvalue()
+
+
+def source_files(source_dir):
+    """
+    Files of source_dir (and its sub-folders) to publish, as paths relative to source_dir with '/' separators
+    """
+    files = []
+    for folder, dirs, names in os.walk(source_dir):
+        dirs[:] = sorted(name for name in dirs if not name.startswith('.'))
+        for name in sorted(names):
+            # Temporary files of atomic writes start with a dot
+            if not name.startswith('.') and name.endswith(PUBLISHED_EXTENSIONS):
+                files.append(os.path.relpath(os.path.join(folder, name), source_dir).replace(os.sep, '/'))
+    return files
+
+
+def load_manifest(manifest_path):
+    if os.path.exists(manifest_path):
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Error loading manifest: {e}")
+    return {'version': None, 'files': {}}
+
+
+def publish(source_dir='docs/cache', site_dir='docs', data_folder='data', manifest_file='manifest.json', variants=()):
+    """
+    Publishes the files written for the web interface: each file of source_dir is minified and written to
+    site_dir/data_folder under a name holding the hash of its content, with the requested compressed variants next to it.
+    site_dir/manifest_file maps the name of each file in source_dir to its published path, and is written last,
+    so that it only refers to files which are completely written. As the content of a published file never changes,
+    browsers can keep it in their cache, and only download the files whose hash changed after an update.
+
+    Files referenced neither by the new manifest nor by the previous one are removed: pages which loaded the
+    previous manifest can still download its files.
+
+    Args:
+        source_dir (str, optional): folder of the files to publish. Defaults to 'docs/cache'.
+        site_dir (str, optional): root folder of the web interface. Defaults to 'docs'.
+        data_folder (str, optional): folder of the published files, relative to site_dir. Defaults to 'data'.
+        manifest_file (str, optional): name of the manifest, relative to site_dir. Defaults to 'manifest.json'.
+        variants (tuple of str, optional): extensions of the compressed variants to write, among VARIANTS. 
+                                           '.br' is skipped if brotli is not installed. Defaults to () (none).
+
+    Returns:
+        dict: the manifest, with the version of the published data and the 'path', 'bytes' and compressed 'variants'
+              of each file
+    """
+    unknown = set(variants) - set(VARIANTS)
+    if unknown:
+        raise ValueError(f"Unknown variants {sorted(unknown)}, expected some of {VARIANTS}")
+    skipped = '.br' in variants and brotli is None
+    if skipped:
+        variants = tuple(variant for variant in variants if variant != '.br')
+    manifest_path = os.path.join(site_dir, manifest_file)
+    previous = load_manifest(manifest_path)
+    files = {}
+    n_written = 0
+    for name in source_files(source_dir):
+        with open(os.path.join(source_dir, *name.split('/')), 'rb') as f:
+            data = minify(name, f.read())
+        stem, ext = os.path.splitext(name)
+        path = f'{data_folder}/{stem}.{content_hash(data)}{ext}'
+        output_path = os.path.join(site_dir, *path.split('/'))
+        # Same name, same content: files already published are not written (nor compressed) again
+        if not os.path.exists(output_path):
+            atomic_write(output_path, data)
+            n_written += 1
+        sizes = {}
+        for variant in variants:
+            if not os.path.exists(output_path + variant):
+                atomic_write(output_path + variant, compress(data, variant))
+            sizes[variant.lstrip('.')] = os.path.getsize(output_path + variant)
+        files[name] = {'path': path, 'bytes': len(data), 'variants': sizes}
+
+    version = content_hash(json.dumps({name: entry['path'] for name, entry in files.items()}, sort_keys=True).encode('utf-8'))
+    manifest = {'version': version, 'files': files}
+    atomic_write(manifest_path, json.dumps(manifest, indent=2, ensure_ascii=False))
+
+    # Remove the files of older versions
+    kept = set()
+    for entry in list(files.values()) + list(previous.get('files', {}).values()):
+        kept.add(entry['path'])
+        kept.update(entry['path'] + '.' + variant for variant in entry.get('variants', {}))
+    data_dir = os.path.join(site_dir, data_folder)
+    n_removed = 0
+    for folder, _, names in os.walk(data_dir):
+        for file_name in names:
+            path = os.path.relpath(os.path.join(folder, file_name), site_dir).replace(os.sep, '/')
+            if path not in kept and not file_name.startswith('.'):
+                os.remove(os.path.join(folder, file_name))
+                n_removed += 1
+
+    print(f"Published {len(files)} files to {data_dir} ({n_written} new, {n_removed} removed), version {version}")
+    if skipped:
+        print("brotli is not installed: no .br variants were written (pip install brotli)")
+    return manifest
+
+
+# %%
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser(description='Publish the files of the web interface as minified, compressed and content-hashed files')
+    parser.add_argument('--source_dir', type=str, default='docs/cache',
+                       help='Folder of the files written for the web interface')
+    parser.add_argument('--site_dir', type=str, default='docs',
+                       help='Root folder of the web interface, where the manifest is written')
+    parser.add_argument('--data_folder', type=str, default='data',
+                       help='Folder of the published files, relative to the site folder')
+    parser.add_argument('--variants', type=str, nargs='*', default=[], choices=[variant.lstrip('.') for variant in VARIANTS],
+                       help='Compressed variants to write next to each file, for servers which serve precompressed files')
+
+    args = parser.parse_args()
+    publish(args.source_dir, args.site_dir, args.data_folder, variants=tuple('.' + variant for variant in args.variants))
+# %%
@@ -0,0 +1,347 @@
+#%%
+import io
+import numpy as np
+import pandas as pd
+
+#%%
+
+ABANDON = -1 # place code of the runners who did not finish ("Ab.")
+MAX_PLACE = np.iinfo(np.int16).max # largest place of the int16 places column
+
+
+class RaceStore:
+    def __init__(self):
+        """
+        Columnar storage of the results of every race in a single table, which races are appended to.
+
+        Rows of race i are rows offsets[i] to offsets[i+1] of the table. Each row holds the place of a runner
+        (int16, ABANDON for abandons), the id of the runner and the id of its club (int32). Runner names and clubs
+        are interned in the names and clubs tables, shared by every race. Columns are NumPy arrays with spare capacity,
+        so that appending a race does not copy the table; the properties give views on the rows in use.
+
+        Runner ids are the positions of the names in the names table, not the ids of the IdentityStore: 
+        the store keeps the names as they were written in the standings, also when they are not resolved 
+        to identities (rankings per category, legacy JSON history), and rows saved to the append-only log
+        are never rewritten, while identity ids are merged by reviews (the races are replayed then).
+        """
+        self.race_names = []     # race index -> file name of the race
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._places = np.empty(0, dtype=np.int16)
+        self._name_ids = np.empty(0, dtype=np.int32)
+        self._club_ids = np.empty(0, dtype=np.int32)
+        self.n_rows = 0
+        self.names = []          # runner id -> name
+        self.name_index = {}     # name -> runner id
+        self.clubs = []          # club id -> club
+        self.club_index = {}     # club -> club id
+        # Number of races, names and clubs already in the cache files (None if the files must be written again)
+        # and number of segments appended to them since they were last compacted
+        self.saved = None
+        self.n_segments = 0
+        # Number of compactions of the cache files, written in the table and in each segment: the segments of an
+        # older generation are already in the table (the log is cleared after the table is written)
+        self.generation = 0
+
+
+    def __len__(self):
+        return len(self.race_names)
+
+
+    @property
+    def offsets(self):
+        return self._offsets[:len(self.race_names) + 1]
+
+
+    @property
+    def places(self):
+        return self._places[:self.n_rows]
+
+
+    @property
+    def name_ids(self):
+        return self._name_ids[:self.n_rows]
+
+
+    @property
+    def club_ids(self):
+        return self._club_ids[:self.n_rows]
+
+
+    @staticmethod
+    def encode_places(places):
+        """
+        Place codes of the runners of a race. Places are parsed as by Ranker.process_race (pd.to_numeric), 
+        so that ' 3' or '3.0' is place 3, and any place which is not a number is an abandon.
+
+        Raises:
+            ValueError: if a place is negative or larger than MAX_PLACE
+        """
+        numeric = pd.to_numeric(pd.Series(places, dtype=object), errors='coerce').to_numpy(dtype=float)
+        invalid = (numeric < 0) | (numeric > MAX_PLACE)
+        if invalid.any():
+            raise ValueError(f"Place {numeric[invalid][0]:g} out of the range of the race history (0 to {MAX_PLACE})")
+        return np.where(np.isnan(numeric), ABANDON, numeric)
+
+
+    @staticmethod
+    def grow(column, size):
+        """
+        Returns column, or a copy of it with at least twice its capacity if it is smaller than size
+        """
+        if size <= len(column):
+            return column
+        grown = np.empty(max(size, 2 * len(column)), dtype=column.dtype)
+        grown[:len(column)] = column
+        return grown
+
+
+    def intern_names(self, names):
+        name_index = self.name_index
+        ids = []
+        for name in names:
+            if name not in name_index:
+                name_index[name] = len(self.names)
+                self.names.append(name)
+            ids.append(name_index[name])
+        return ids
+
+
+    def intern_clubs(self, clubs):
+        club_index = self.club_index
+        ids = []
+        for club in clubs:
+            if club not in club_index:
+                club_index[club] = len(self.clubs)
+                self.clubs.append(club)
+            ids.append(club_index[club])
+        return ids
+
+
+    def prepare(self, race_name, places, names, clubs):
+        """
+        Encodes the standings of one race without appending them, names and clubs being interned. 
+        Ranker.process_race prepares a race before updating the ratings and commits it after the update, 
+        so that a race which does not fit the table is rejected before the ratings change.
+
+        Args:
+            race_name (str): file name of the race
+            places (np.ndarray): place code of each runner (see encode_places)
+            names (list of str): name of each runner
+            clubs (list of str): club of each runner
+
+        Returns:
+            tuple: race name, place codes, runner ids and club ids of the race, to pass to commit
+        """
+        return race_name, places, self.intern_names(names), self.intern_clubs(clubs)
+
+
+    def commit(self, race):
+        """
+        Appends a race returned by prepare
+
+        Returns:
+            int: index of the race
+        """
+        race_name, places, name_ids, club_ids = race
+        start, end = self.n_rows, self.n_rows + len(name_ids)
+        self._places = self.grow(self._places, end)
+        self._name_ids = self.grow(self._name_ids, end)
+        self._club_ids = self.grow(self._club_ids, end)
+        self._offsets = self.grow(self._offsets, len(self.race_names) + 2)
+        self._places[start:end] = places
+        self._name_ids[start:end] = name_ids
+        self._club_ids[start:end] = club_ids
+        self.n_rows = end
+        self.race_names.append(race_name or '')
+        self._offsets[len(self.race_names)] = end
+        return len(self.race_names) - 1
+
+
+    def append(self, race_name, places, names, clubs):
+        """
+        Appends the standings of one race
+
+        Args:
+            race_name (str): file name of the race
+            places (list): place of each runner, as int, float or str ("Ab." or any other non-numeric place for abandons)
+            names (list of str): name of each runner
+            clubs (list of str): club of each runner
+
+        Returns:
+            int: index of the race
+
+        Raises:
+            ValueError: if a place does not fit the places column (see encode_places)
+        """
+        return self.commit(self.prepare(race_name, self.encode_places(places), names, clubs))
+
+
+    def truncate(self, n_races):
+        """
+        Removes the races from index n_races onwards. Their names and clubs stay interned.
+        """
+        if self.saved is not None and n_races < self.saved[0]:
+            # Saved races cannot be removed from an append-only log
+            self.saved = None
+        del self.race_names[n_races:]
+        self.n_rows = int(self._offsets[len(self.race_names)])
+
+
+    def race(self, race_idx):
+        """
+        Rows of one race, as views on the table (no copy)
+
+        Returns:
+            tuple of np.ndarray: places, runner ids and club ids of the race
+        """
+        start, end = self._offsets[race_idx], self._offsets[race_idx + 1]
+        return self._places[start:end], self._name_ids[start:end], self._club_ids[start:end]
+
+
+    def race_data(self, race_idx):
+        """
+        Materializes the standings of one race as a DataFrame with place, name and club columns
+        """
+        places, name_ids, club_ids = self.race(race_idx)
+        return pd.DataFrame({
+            'place': ['Ab.' if place == ABANDON else str(place) for place in places.tolist()],
+            'name': [self.names[name_id] for name_id in name_ids.tolist()],
+            'club': [self.clubs[club_id] for club_id in club_ids.tolist()],
+        })
+
+
+    def participation_counts(self):
+        """
+        Number of races of each runner, a runner listed twice in a race counting once
+
+        Returns:
+            np.ndarray: number of races per runner id
+        """
+        row_races = np.repeat(np.arange(len(self.race_names), dtype=np.int64), np.diff(self.offsets))
+        keys = np.unique(row_races * max(len(self.names), 1) + self.name_ids)
+        return np.bincount(keys % max(len(self.names), 1), minlength=len(self.names))
+
+
+    def unsaved_races(self):
+        """
+        Returns:
+            range: indices of the races which are not in the cache files yet
+        """
+        return range(self.saved[0] if self.saved is not None else 0, len(self.race_names))
+
+
+    def mark_saved(self, compacted=False):
+        """
+        Records that every race is in the cache files, either appended as a new segment or compacted in a single table
+        (written by to_bytes after next_generation)
+        """
+        self.saved = (len(self.race_names), len(self.names), len(self.clubs))
+        self.n_segments = 0 if compacted else self.n_segments + 1
+
+
+    def next_generation(self):
+        """
+        Starts a new generation of the cache files, before the table is compacted
+        """
+        self.generation += 1
+
+
+    def segment_bytes(self):
+        """
+        Serializes the races, names and clubs which are not saved yet as an uncompressed npz archive,
+        to be appended to the saved ones with apply_segment
+        """
+        n_races, n_names, n_clubs = self.saved
+        start, end = self._offsets[n_races], self.n_rows
+        buffer = io.BytesIO()
+        np.savez(buffer, race_names=np.array(self.race_names[n_races:], dtype=str), 
+                 offsets=self.offsets[n_races:] - start, places=self._places[start:end],
+                 name_ids=self._name_ids[start:end], club_ids=self._club_ids[start:end],
+                 names=np.array(self.names[n_names:], dtype=str), clubs=np.array(self.clubs[n_clubs:], dtype=str), 
+                 base=np.array([n_races, n_names, n_clubs], dtype=np.int64), generation=np.int64(self.generation))
+        return buffer.getvalue()
+
+
+    def apply_segment(self, content):
+        """
+        Appends the races of a segment written by segment_bytes. A segment of an older generation than the store
+        was written before the table was compacted, and is already in the table: it is skipped.
+
+        Returns:
+            bool: whether the segment was appended
+
+        Raises:
+            ValueError: if the segment does not follow the races, names and clubs of the store
+        """
+        with np.load(io.BytesIO(content), allow_pickle=False) as data:
+            # Segments and tables written by previous versions have no generation
+            generation = int(data['generation']) if 'generation' in data.files else 0
+            if generation < self.generation:
+                return False
+            n_races, n_names, n_clubs = data['base'].tolist()
+            if (n_races, n_names, n_clubs) != (len(self.race_names), len(self.names), len(self.clubs)):
+                raise ValueError('Segment does not follow the races of the race history')
+            self.names.extend(data['names'].tolist())
+            self.clubs.extend(data['clubs'].tolist())
+            offsets = data['offsets'].astype(np.int64) + self.n_rows
+            end = int(offsets[-1])
+            self._places = self.grow(self._places, end)
+            self._name_ids = self.grow(self._name_ids, end)
+            self._club_ids = self.grow(self._club_ids, end)
+            self._offsets = self.grow(self._offsets, n_races + len(offsets))
+            self._places[self.n_rows:end] = data['places']
+            self._name_ids[self.n_rows:end] = data['name_ids']
+            self._club_ids[self.n_rows:end] = data['club_ids']
+            self._offsets[n_races:n_races + len(offsets)] = offsets
+            self.race_names.extend(data['race_names'].tolist())
+        self.n_rows = end
+        self.name_index.update((name, name_id) for name_id, name in enumerate(self.names[n_names:], n_names))
+        self.club_index.update((club, club_id) for club_id, club in enumerate(self.clubs[n_clubs:], n_clubs))
+        return True
+
+
+    def to_bytes(self):
+        """
+        Serializes the store as an uncompressed npz archive
+        """
+        buffer = io.BytesIO()
+        np.savez(buffer, race_names=np.array(self.race_names, dtype=str), offsets=self.offsets, places=self.places,
+                 name_ids=self.name_ids, club_ids=self.club_ids,
+                 names=np.array(self.names, dtype=str), clubs=np.array(self.clubs, dtype=str),
+                 generation=np.int64(self.generation))
+        return buffer.getvalue()
+
+
+    @classmethod
+    def load(cls, path, segments=()):
+        """
+        Loads a store written by to_bytes, in a single read of the file, then appends the segments written after it
+
+        Args:
+            path (str): file written with to_bytes
+            segments (list of bytes, optional): segments written by segment_bytes, in order. Defaults to ().
+        """
+        with open(path, 'rb') as f:
+            content = f.read()
+        store = cls()
+        with np.load(io.BytesIO(content), allow_pickle=False) as data:
+            store.race_names = data['race_names'].tolist()
+            store._offsets = data['offsets'].astype(np.int64)
+            # Places were stored as int32 by previous versions
+            store._places = data['places'].astype(np.int16)
+            store._name_ids = data['name_ids'].astype(np.int32)
+            store._club_ids = data['club_ids'].astype(np.int32)
+            store.names = data['names'].tolist()
+            store.clubs = data['clubs'].tolist()
+            store.generation = int(data['generation']) if 'generation' in data.files else 0
+        store.n_rows = len(store._places)
+        store.name_index = {name: name_id for name_id, name in enumerate(store.names)}
+        store.club_index = {club: club_id for club_id, club in enumerate(store.clubs)}
+        n_applied = sum(store.apply_segment(segment) for segment in segments)
+        store.n_segments = n_applied
+        if n_applied == len(segments):
+            store.saved = (len(store.race_names), len(store.names), len(store.clubs))
+        else:
+            # A compaction was interrupted before the log was cleared: it is done again at the next save
+            store.saved = None
+        return store
@@ -1,54 +1,416 @@
 #%%
-import re
 import openelo
 from difflib import SequenceMatcher
 import numpy as np
 import pandas as pd
 import os
+import re
+import sys
+import csv
+import codecs
 import datetime
 import json
+import math
+import pickle
+import copy
+import struct
+import unicodedata
+from functools import lru_cache
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from name_index import NameIndex
+from persistence import WriteBehindCache, SegmentLog, atomic_write, append_lines, write_if_changed
+from race_store import RaceStore, ABANDON
+from timeline import RatingTimeline
+from profiler import Profiler, profiled
+from review import ReviewQueue
+from identity import IdentityStore
+from publish import publish
+
+try:
+    import pyarrow # Faster csv parsing engine for pandas on large files, used when installed
+    CSV_ENGINE = 'pyarrow'
+except ImportError:
+    CSV_ENGINE = 'c'
 
 #%%
 
+CHECKPOINT_MAGIC = b'RANKCKPT'
+CHECKPOINT_VERSION = 1
+
+# Encoding of the csv files starting with a byte order mark
+CSV_BOMS = [(codecs.BOM_UTF8, 'utf-8-sig'), (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16')]
+
+# Below this size (in bytes), the default engine reads a csv file faster than pyarrow
+CSV_ENGINE_MIN_SIZE = 128 * 1024
+
+# Race files start with their date: YYYY-MM-DD or YYYY_MM_DD
+RACE_DATE_PATTERN = re.compile(r'^(\d{4})[-_](\d{1,2})[-_](\d{1,2})(?!\d)')
+
+# Ways of handling the names whose similarity with a known runner is between the two thresholds of find_similar_name
+REVIEW_MODES = ['ask', 'defer']
+# Decision applied to a deferred pair of names until it is reviewed
+PROVISIONAL_POLICIES = ['different', 'same']
+
+# Weighting schemes of the races (see race_weights)
+WEIGHTINGS = ['uniform', 'exponential']
+
+
+class _FoldTable(dict):
+    """
+    Translation table for str.translate, applied to lowercased names: replaces accented letters with their 
+    non-accented counterparts, keeps ASCII letters, digits and whitespace, and removes every other character.
+    Each code point is resolved once, on first use.
+
+    Args:
+        replacements (dict, optional): letter -> replacement, the only letters folded. 
+                                       Defaults to None (every letter whose compatibility decomposition holds 
+                                       ASCII letters or digits, and the letters of letter_replacements).
+    """
+    # Latin letters without a Unicode decomposition
+    letter_replacements = {'ß': 'ss', 'æ': 'ae', 'œ': 'oe', 'ø': 'o', 'ł': 'l', 'đ': 'd', 'ð': 'd', 'þ': 'th', 'ı': 'i'}
+    kept = set('abcdefghijklmnopqrstuvwxyz0123456789')
+
+    def __init__(self, replacements=None):
+        super().__init__()
+        self.replacements = replacements
+
+    def __missing__(self, code_point):
+        char = chr(code_point)
+        if char in self.kept or char.isspace():
+            folded = char
+        elif self.replacements is not None:
+            folded = self.replacements.get(char)
+        elif char in self.letter_replacements:
+            folded = self.letter_replacements[char]
+        else:
+            # e.g. 'á' is 'a' followed by a combining accent, which is removed
+            folded = ''.join(c for c in unicodedata.normalize('NFKD', char).lower() if c in self.kept) or None
+        self[code_point] = folded
+        return folded
+
+# Accents folded by the versions before NORMALIZATION_VERSION 1, other accented letters being removed
+LEGACY_ACCENTS = {
+    'à': 'a', 'â': 'a', 'ä': 'a',
+    'é': 'e', 'è': 'e', 'ê': 'e', 'ë': 'e',
+    'î': 'i', 'ï': 'i',
+    'ô': 'o', 'ö': 'o',
+    'ù': 'u', 'û': 'u', 'ü': 'u',
+    'ÿ': 'y',
+    'ç': 'c',
+    'ñ': 'n'
+}
+# Version of normalize_name, saved with the identities: aliases of an older version are migrated (see Ranker.migrate_identities)
+NORMALIZATION_VERSION = 1
+
+_FOLD_TABLE = _FoldTable()
+_LEGACY_FOLD_TABLE = _FoldTable(LEGACY_ACCENTS)
+_WHITESPACE = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=65536)
+def normalize_name(name):
+    """
+    Normalize a runner's name to handle typos and variations: lowercase, runs of whitespace replaced with 
+    a single space, accents folded, and only letters, numbers and spaces kept. Characters are removed 
+    after the whitespace is collapsed (e.g. 'Jean - Pierre' gives 'jean  pierre'), as in previous versions
+
+    Args:
+        name (str): raw name of the runner
+
+    Returns:
+        str: normalized name
+    """
+    return _WHITESPACE.sub(' ', name.lower().strip()).translate(_FOLD_TABLE)
+
+
+def legacy_normalize_name(name):
+    """
+    normalize_name of the versions before NORMALIZATION_VERSION 1, which only folded the accents of LEGACY_ACCENTS.
+    Gives the aliases of the identities of these versions, byte for byte.
+    """
+    return _WHITESPACE.sub(' ', name.lower().strip()).translate(_LEGACY_FOLD_TABLE)
+
+
+def shard_of(name, n_shards):
+    """
+    Shard of a runner in the web interface data: FNV-1a hash of the UTF-16 code units of its name, 
+    as computed by shardOf in docs/index.html
+
+    Args:
+        name (str): name of the runner
+        n_shards (int): number of shards
+
+    Returns:
+        int: shard index in [0, n_shards)
+    """
+    encoded = name.encode('utf-16-le')
+    h = 0x811c9dc5
+    for unit in struct.unpack(f'<{len(encoded) // 2}H', encoded):
+        h = ((h ^ unit) * 0x01000193) & 0xffffffff
+    return h % n_shards
+
+
+def pack_checkpoint(state):
+    """
+    Binary checkpoint of a state: a magic string and a version number followed by the pickled state
+    """
+    return CHECKPOINT_MAGIC + struct.pack('<H', CHECKPOINT_VERSION) + pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def unpack_checkpoint(content):
+    """
+    State of a checkpoint written by pack_checkpoint
+
+    Raises:
+        ValueError: if content is not a checkpoint of the current version
+    """
+    header_size = len(CHECKPOINT_MAGIC) + 2
+    if content[:len(CHECKPOINT_MAGIC)] != CHECKPOINT_MAGIC:
+        raise ValueError('not a checkpoint')
+    version, = struct.unpack('<H', content[len(CHECKPOINT_MAGIC):header_size])
+    if version != CHECKPOINT_VERSION:
+        raise ValueError(f'unsupported checkpoint version {version}')
+    return pickle.loads(content[header_size:])
+
+
+def race_weights(dates, weighting='uniform'):
+    """
+    Weight of each race in the rating updates
+
+    Args:
+        dates (list of datetime.date): date of each race (None if unknown: the date of the first race)
+        weighting (str, optional): 'uniform' (every race weighs 1) or 'exponential', which gives more weight to 
+                                   recent races (exp(-days before the last race / days between the first and last races):
+                                   1 for the last race, 1/e for the first one). Defaults to 'uniform'.
+
+    Raises:
+        ValueError: if the weighting scheme is unknown
+
+    Returns:
+        list of float: weight of each race
+    """
+    if weighting not in WEIGHTINGS:
+        raise ValueError(f"Unknown weighting '{weighting}', expected one of {WEIGHTINGS}")
+    known_dates = [date for date in dates if date is not None]
+    first_date = min(known_dates, default=None)
+    span = (max(known_dates) - first_date).days if known_dates else 0
+    if weighting == 'uniform' or not span:
+        return [1.0] * len(dates)
+    last_date = max(known_dates)
+    return [math.exp(-(last_date - (date or first_date)).days / span) for date in dates]
+
+
+def standing_places(places):
+    """
+    Standings of one race in the format of openelo: finishers keep their place, 
+    abandons tie between the place after the last finisher above them and the last place
+
+    Args:
+        places (np.ndarray): float place of each runner, NaN for abandons
+
+    Returns:
+        np.ndarray: first and last (0-based) place of the tie of each runner
+    """
+    finished = ~np.isnan(places)
+    n_finished = np.cumsum(finished)
+    place_1 = np.where(finished, np.nan_to_num(places) - 1, n_finished).astype(int)
+    place_2 = np.where(finished, place_1, len(places) - 1)
+    return place_1, place_2
+
+
+def detect_encoding(head):
+    """
+    Encoding of a csv file from its first bytes: the encoding of its byte order mark, utf-8 if it has none
+    """
+    for bom, encoding in CSV_BOMS:
+        if head.startswith(bom):
+            return encoding
+    return 'utf-8'
+
+
+def read_race_csv(path, engine=None, with_category=False):
+    """
+    Reads the place, name and club columns (the first 3 columns) of a race csv file
+
+    Args:
+        path (str): Path to the csv file
+        engine (str, optional): pandas parsing engine. Defaults to None (pyarrow if installed and the file is large, else c).
+        with_category (bool, optional): Also read the age category of the runners (4th column, empty if missing). Defaults to False.
+
+    Raises:
+        KeyError: Raises Error if the file cannot be decoded with the encoding of its byte order mark (utf-8 if none)
+
+    Returns:
+        pd.Dataframe: place, name and club (and category) columns as strings, without incomplete rows.
+                      Files with less than 3 columns are returned as they are.
+    """
+    with open(path, 'rb') as f:
+        head = f.read(4096)
+        size = os.fstat(f.fileno()).st_size
+    encoding = detect_encoding(head)
+    lines = head.decode(encoding, errors='ignore').splitlines()
+    header = next(csv.reader(lines[:1]), [])
+
+    try:
+        if len(header) < 3:
+            return pd.read_csv(path, encoding=encoding)
+        out = None
+        names = ['place', 'name', 'club', 'category'] if with_category and len(header) >= 4 else ['place', 'name', 'club']
+        engine = engine or (CSV_ENGINE if size >= CSV_ENGINE_MIN_SIZE else 'c')
+        if engine != 'c':
+            try:
+                # pyarrow only selects columns by name
+                out = pd.read_csv(path, encoding=encoding, usecols=header[:len(names)], dtype=str, engine=engine)
+                out.columns = names
+            except UnicodeDecodeError:
+                raise
+            except Exception:
+                out = None # Files the faster engine does not handle are read by the default one
+        if out is None:
+            out = pd.read_csv(path, encoding=encoding, header=0, usecols=list(range(len(names))), names=names, dtype=str)
+    except UnicodeDecodeError:
+        raise KeyError('encoding type provided to "read_csv" is not the right one')
+
+    if with_category:
+        # A missing category does not make a result incomplete
+        out['category'] = out['category'].fillna('').str.replace(' ', '') if 'category' in out else ''
+    # Clean data
+    if out.isna().values.any():
+        out = out.dropna()
+        out = out.reset_index(drop=True)
+    return out
+
+
+def read_race_csvs(paths, jobs=4, with_category=False):
+    """
+    Reads race csv files with a pool of threads, a few files ahead of the one being consumed
+
+    Args:
+        paths (list of str): Paths to the csv files
+        jobs (int, optional): Number of files read at once. Defaults to 4.
+        with_category (bool, optional): Also read the age category of the runners. Defaults to False.
+
+    Yields:
+        pd.DataFrame: content of each file (see read_race_csv), in the order of paths
+    """
+    if jobs <= 1:
+        for path in paths:
+            yield read_race_csv(path, with_category=with_category)
+        return
+    paths = iter(paths)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = deque(executor.submit(read_race_csv, path, None, with_category) for _, path in zip(range(jobs), paths))
+        while pending:
+            df = pending.popleft().result()
+            for path in paths:
+                pending.append(executor.submit(read_race_csv, path, None, with_category))
+                break
+            yield df
+
+
 class Ranker:
-    def __init__(self, method = 'elommr', previous_rank = None, cache_dir = './cache'):
+    def __init__(self, method = 'elommr', previous_rank = None, cache_dir = './cache', flush_interval = None, profile = False,
+                 docs_dir = 'docs/cache', resolve_names = True, review = 'ask', provisional = 'different', method_params = None, 
+                 contest_params = None, weighting = 'uniform'):
         """
         Initialize the class
 
         Args:
             method (str, optional): type of rating algorithm to use. Defaults to 'elommr'.
             previous_rank (str, optional): Path to a previous rating file in csv format. Defaults to None.
+            cache_dir (str, optional): Folder of the cache files. Defaults to './cache'.
+            flush_interval (float, optional): Minimum number of seconds between two writes of the name caches during a run.
+                                              Defaults to None (written at the end of rank() or on checkpoint()).
+            profile (bool, optional): Record the wall time and counters of each stage in self.profiler. Defaults to False.
+            docs_dir (str, optional): Folder of the files read by the web interface. Defaults to 'docs/cache'.
+            resolve_names (bool, optional): Match new names to known runners (fuzzy matching and questions). 
+                                            False when the names of the races are already resolved. Defaults to True.
+            review (str, optional): 'ask' to ask at once whether two similar names are the same runner, 
+                                    'defer' to add them to the review queue and go on with the provisional decision. 
+                                    Defaults to 'ask'.
+            provisional (str, optional): decision applied to deferred pairs until they are reviewed: 
+                                         'different' (separate runners) or 'same' (merged runners). Defaults to 'different'.
+            method_params (dict, optional): parameters of openelo.EloMMR. Defaults to None (default parameters).
+            contest_params (dict, optional): parameters of openelo.ContestRatingParams other than the weight of the race. 
+                                             Defaults to None (default parameters).
+            weighting (str, optional): weighting scheme of the races of a ranking (see race_weights). Defaults to 'uniform'.
 
         Raises:
-            ValueError: _description_
+            ValueError: if the method, review mode, provisional policy or weighting is unknown
         """
+        if review not in REVIEW_MODES:
+            raise ValueError(f"Unknown review mode '{review}', expected one of {REVIEW_MODES}")
+        if provisional not in PROVISIONAL_POLICIES:
+            raise ValueError(f"Unknown provisional policy '{provisional}', expected one of {PROVISIONAL_POLICIES}")
+        if weighting not in WEIGHTINGS:
+            raise ValueError(f"Unknown weighting '{weighting}', expected one of {WEIGHTINGS}")
+        self.method_params = method_params or {}
+        self.contest_params = contest_params or {}
+        self.weighting = weighting
+        self.profiler = Profiler(enabled=profile)
+        self.docs_dir = docs_dir
+        self.resolve_names = resolve_names
+        self.review = review
+        self.provisional = provisional
 
         self.cache_dir = cache_dir
         if not os.path.exists(self.cache_dir):
             os.makedirs(self.cache_dir)
 
+        # Name caches are written behind: changes are batched and flushed at checkpoints
+        self.cache = WriteBehindCache(self.cache_dir, flush_interval=flush_interval)
+        self.cache.register('identities', self.save_identities)
+        # Ambiguous pairs of names waiting for a decision
+        self.review_queue = ReviewQueue(self.cache_dir).load()
+        self.cache.register('review_queue', self.review_queue.save)
+
         if method == 'elommr':
-            self.method = openelo.EloMMR()
+            self.method = openelo.EloMMR(**self.method_params)
             self.method_name = 'elommr'
         else:
             raise ValueError("Only 'elommr' as a method is handled yet")
         
-        self.name_mapping = self.load_name_mappings()  # Load from cache
-        self.players = {} # name -> Player object
-        if len(self.name_mapping) > 0:
-            self.players = {name: openelo.Player() for name in self.name_mapping.values()}
-        self.race_history = []
-        
-        # Load confirmed different names cache
-        self.different_names = self.load_different_names()
+        # Runner ids, names, aliases and names of different people, loaded from cache
+        self.identities = self.load_identities()
+
+        # Apply the answers journaled since the last flush, if the previous run stopped before it
+        self.replay_journal()
+        # Aliases normalized by previous versions
+        self.migrate_identities()
+
+        self.players = {name: openelo.Player() for name in self.identities.runner_names()} # name -> Player object
+        self.build_name_index()
 
         # Load processed races cache only when using previous ranking
         self.processed_races = {}
-        self.race_history = []
+        self.race_history = RaceStore() # standings of each race
+        self.participations = {} # name -> list of (race index, place, field size)
+        self.timeline = RatingTimeline() # rating of each runner after each race
+        self.current_race = None # name of the race being processed
+        # (race index, pickled state of the ratings before that race) for the first race with a deferred pair, 
+        # from where the ratings are replayed when a decision contradicts the provisional one
+        self.review_state = None
+        rating_state = None
         if previous_rank:
             self.processed_races = self.load_processed_races()
             # Load race history cache for cyclist details
             self.race_history = self.load_race_history()
+            for race_idx in range(len(self.race_history)):
+                self.index_race(race_idx)
+            self.timeline = self.load_rating_timeline()
+            if self.timeline.n_races > len(self.race_history):
+                print("Rating timeline does not match the race history, ignoring it")
+                self.timeline = RatingTimeline()
+            # Load the exact state of the ratings, if it matches the processed races
+            rating_state = self.load_rating_state()
+            if rating_state is not None and (rating_state['method_name'] != self.method_name
+                                             or rating_state.get('weighting', 'uniform') != self.weighting
+                                             or set(rating_state['processed_races']) != set(self.processed_races)):
+                print("Rating state does not match the processed races, ignoring it")
+                rating_state = None
+            if rating_state is not None:
+                self.review_state = self.load_review_state()
 
         if previous_rank:
             try:
@@ -68,13 +430,35 @@ class Ranker:
             self.previous_rank = None
             self.previous_sigma = None
 
+        if rating_state is not None:
+            # Restore the players in the order they were created, so that name matching behaves as in a full run
+            self.method = rating_state['method']
+            players = dict(rating_state['players'])
+            for name, player in self.players.items():
+                players.setdefault(name, player)
+            self.players = players
+            self.build_name_index()
         #Update a priori rank based on potential previous knowledge:
-        if self.previous_rank:
+        elif self.previous_rank:
             for name, rating in (self.previous_rank).items():
                 name = self.get_or_create_player(name)
                 sigma = self.previous_sigma.get(name, 500.0) if self.previous_sigma else 500.0
                 self.players[name] = openelo.Player.with_rating(rating, sigma, update_time=0)
 
+        self.checkpoint()
+
+
+    def build_name_index(self):
+        """
+        Compute the normalized name of each player and index them for fuzzy name matching
+        """
+        # Normalized form of each player's name, computed once
+        self.normalized_names = {name: self.normalize_name(name) for name in self.players} # name -> normalized name
+        # Candidate index for fuzzy name matching, kept in the insertion order of self.players
+        self.name_index = NameIndex()
+        for name, normalized_name in self.normalized_names.items():
+            self.name_index.add(name, normalized_name)
+
 
     def get_csv(self, path):
         """
@@ -84,34 +468,18 @@ class Ranker:
             path (str): Path to the csv file
 
         Raises:
-            KeyError: Raises Error if encoding is neither utf-8 nor utf-16
+            KeyError: Raises Error if the file cannot be decoded with the encoding of its byte order mark
 
         Returns:
-            pd.Dataframe: content of the csv file
+            pd.Dataframe: place, name and club columns of the csv file
         """
-        try:
-            out = pd.read_csv(path)
-        except:
-            try: 
-                out = pd.read_csv(path, encoding='utf_16')
-            except: 
-                raise KeyError('encoding type provided to "read_csv" is not the right one')
-
-        # Keep only the first 3 columns: place, name, club
-        if len(out.columns) >= 3:
-            out = out.iloc[:, [0, 1, 2]]
-            out.columns = ['place', 'name', 'club']
-            
-            # Clean data
-            out = out.dropna()
-            out = out.reset_index(drop=True)
-
-        return out
+        return read_race_csv(path)
 
 
-    def get_data(self, folder_path = './data/csv', ext = '.csv'):
+    @profiled('get_catalogue')
+    def get_catalogue(self, folder_path = './data/csv', ext = '.csv'):
         """
-        Reads csv files in folder_path and returns pandas DataFrames
+        Lists the race files of folder_path in chronological order, without reading them
 
         Args:
             folder_path (str, optional): Path where to search for data files. 
@@ -121,14 +489,11 @@ class Ranker:
                                 Defaults to 'csv'.
 
         Returns:
-            list of pd.DataFrame: content of each file in a list
-            list of datetimes: dates of the corresponding races (in format YYYY-MM-DD)
-            list of str: file names of the processed races
+            list of dict: file name, path, date and race index (position in chronological order) of each race.
+                          Races without a date in their file name get the date of the first race 
+                          (already processed races included).
         """
-        df_list = []
-        tmp_dates = []
-        processed_files = []
-        
+        catalogue = []
         for file in sorted(os.listdir(folder_path)):
             if file in ['ranking.csv', 'rankings.csv']:
                 continue
@@ -138,26 +503,114 @@ class Ranker:
                 if self.previous_rank and file in self.processed_races:
                     print(f"Skipping already processed file: {file}")
                     continue
-                
-                df_list.append(self.get_csv(file_path))
+                catalogue.append({'file': file, 'path': file_path, 'date': self.parse_race_date(file)})
 
-                processed_files.append(file)
+        dates = [entry['date'] for entry in catalogue] + self.processed_dates()
+        first_date = min((date for date in dates if date is not None), default=None)
+        for entry in catalogue:
+            if entry['date'] is None:
+                entry['date'] = first_date
+        catalogue.sort(key=lambda entry: (entry['date'] or datetime.date.min, entry['file']))
+        for race_idx, entry in enumerate(catalogue):
+            entry['race_idx'] = race_idx
+        return catalogue
 
-                date_str = file.split('_')[0]
-                try:
-                    date = datetime.datetime.strptime(date_str, '%Y-%m-%d').date()
-                    tmp_dates.append(date)
-                except: 
-                    tmp_dates.append(None)
-                
-        date_list = []
-        for i, date in enumerate(tmp_dates):
-            if date is None:
-                date_list.append(min(tmp_dates))
-            else:
-                date_list.append(date)
 
-        return df_list, date_list, processed_files
+    def processed_dates(self):
+        """
+        Returns:
+            list of datetime.date: date of each race already processed, skipped by get_catalogue (None if unknown)
+        """
+        if not self.previous_rank:
+            return []
+        return [self.parse_race_date(file) for file in self.processed_races]
+
+
+    def races_before_processed(self, catalogue):
+        """
+        New races which come before an already processed race in chronological order (by date, then file name).
+        The ratings of a race depend on the races before it: such races can only be processed in a full run.
+
+        Args:
+            catalogue (list of dict): new races, as returned by get_catalogue
+
+        Returns:
+            list of str: file names of these races
+        """
+        processed_dates = self.processed_dates()
+        if not processed_dates:
+            return []
+        dates = [entry['date'] for entry in catalogue] + processed_dates
+        first_date = min((date for date in dates if date is not None), default=None) or datetime.date.min
+        last_processed = max((date or first_date, file) for file, date in zip(self.processed_races, processed_dates))
+        return [entry['file'] for entry in catalogue if (entry['date'] or first_date, entry['file']) < last_processed]
+
+
+    def restart_reason(self, catalogue):
+        """
+        Checks whether the new races of catalogue can be processed after the races already processed, 
+        with the same result as a ranking of every race
+
+        Args:
+            catalogue (list of dict): new races, as returned by get_catalogue
+
+        Returns:
+            str: why every race must be computed again, None if the new races can be processed
+        """
+        late_races = self.races_before_processed(catalogue)
+        if late_races:
+            # Processed after the later races, they would be rated with a time going backwards
+            return (f"{len(late_races)} new races ({', '.join(late_races[:3])}{', ...' if len(late_races) > 3 else ''}) "
+                    f"come before races already processed")
+        processed_dates = self.processed_dates()
+        if processed_dates and catalogue:
+            # The weights of a ranking depend on the dates of all its races (e.g. exponential weighting)
+            weights = race_weights(processed_dates + [entry['date'] for entry in catalogue], self.weighting)
+            if weights[:len(processed_dates)] != race_weights(processed_dates, self.weighting):
+                return f"the new races change the weights of the races already processed ({self.weighting} weighting)"
+        return None
+
+
+    def restart(self):
+        """
+        Forgets the ratings and the processed races, keeping the identities, so that the next ranking
+        computes every race again as a ranking without previous rank would
+        """
+        self.previous_rank = None
+        self.previous_sigma = None
+        self.processed_races = {}
+        self.method = openelo.EloMMR(**self.method_params)
+        self.players = {name: openelo.Player() for name in self.identities.runner_names()}
+        self.build_name_index()
+        self.race_history.truncate(0)
+        self.participations = {}
+        self.timeline.truncate(0)
+        self.review_state = None
+
+
+    def get_data(self, folder_path = './data/csv', ext = '.csv', catalogue = None, jobs = 4, with_category = False):
+        """
+        Reads the race files of folder_path in chronological order, a few files ahead of the race being processed
+
+        Args:
+            folder_path (str, optional): Path where to search for data files. Defaults to './data/csv'.
+            ext (str, optional): Extension of the file to read (only csv handled yet). Defaults to 'csv'.
+            catalogue (list of dict, optional): Races to read, as returned by get_catalogue. Defaults to None (every race of folder_path).
+            jobs (int, optional): Number of files read at once by a pool of threads. Defaults to 4.
+            with_category (bool, optional): Also read the age category of the runners. Defaults to False.
+
+        Yields:
+            tuple: (catalogue entry, pd.DataFrame content of the file)
+        """
+        if catalogue is None:
+            catalogue = self.get_catalogue(folder_path, ext)
+        reader = read_race_csvs([entry['path'] for entry in catalogue], jobs, with_category)
+        for entry in catalogue:
+            # Time spent waiting for the file to be read
+            with self.profiler.stage('get_data'):
+                df = next(reader)
+            self.profiler.count('get_data', rows=len(df))
+            yield entry, df
 
 
     def ask(self, n1,n2):
@@ -188,27 +641,7 @@ class Ranker:
         """
         Normalize a runner's name to handle typos and variations
         """
-        # Convert to lowercase and remove extra spaces
-        normalized = re.sub(r'\s+', ' ', name.lower().strip())
-        
-        # Replace accented letters with their non-accented counterparts
-        accent_replacements = {
-            'à': 'a', 'â': 'a', 'ä': 'a',
-            'é': 'e', 'è': 'e', 'ê': 'e', 'ë': 'e',
-            'î': 'i', 'ï': 'i',
-            'ô': 'o', 'ö': 'o',
-            'ù': 'u', 'û': 'u', 'ü': 'u',
-            'ÿ': 'y',
-            'ç': 'c',
-            'ñ': 'n'
-        }
-        
-        for accented, replacement in accent_replacements.items():
-            normalized = normalized.replace(accented, replacement)
-        
-        # Remove special characters but keep letters, numbers, and spaces
-        normalized = re.sub(r'[^a-z0-9\s]', '', normalized)
-        return normalized
+        return normalize_name(name)
     
 
     def find_similar_name(self, name, threshold=0.85, threshold_2=0.93):
@@ -218,32 +651,38 @@ class Ranker:
         normalized_name = self.normalize_name(name)
         
         # First check exact match
-        if normalized_name in self.name_mapping:
-            return self.name_mapping[normalized_name]
+        runner_id = self.identities.lookup(normalized_name)
+        if runner_id is not None:
+            self.profiler.count('find_similar_name', lookups=1, exact_matches=1)
+            return self.identities.name_of(runner_id)
         
-        # Check for similar names using sequence matching
+        # Check for similar names using sequence matching, only on the candidates which can reach threshold
         best_match = None
         best_score = 0
         
-        for existing_name in self.players.keys():
-            existing_normalized = self.normalize_name(existing_name)
+        candidates = self.name_index.candidates(normalized_name, threshold)
+        self.profiler.count('find_similar_name', lookups=1, comparisons=len(candidates))
+        for existing_name, existing_normalized in candidates:
             score = SequenceMatcher(None, normalized_name, existing_normalized).ratio()
             
             if score > best_score and score >= threshold:
                 # Check if these names were previously confirmed as different
-                name_pair = tuple(sorted([normalized_name, existing_normalized]))
-                if name_pair in self.different_names:
+                if self.identities.cannot_link(normalized_name, existing_normalized):
                     continue  # Skip this pair as they were confirmed as different
                 
                 if score < threshold_2:
-                    if self.ask(name, existing_name):
+                    if self.review == 'defer':
+                        # Go on with the provisional decision, the pair is reviewed later
+                        if self.defer_review(name, normalized_name, existing_name, existing_normalized, score):
+                            best_score = score
+                            best_match = existing_name
+                        continue
+                    self.profiler.count('find_similar_name', questions=1)
+                    same = self.ask(name, existing_name)
+                    if same:
                         best_score = score
                         best_match = existing_name
-                        self.name_mapping[normalized_name] = existing_name
-                    else:
-                        # Store that these names are different
-                        self.different_names[name_pair] = True
-                        self.save_different_names(self.different_names)
+                    self.record_answer(normalized_name, existing_name, existing_normalized, same)
                 else:
                     best_score = score
                     best_match = existing_name
@@ -251,10 +690,233 @@ class Ranker:
         return best_match
     
 
+    def record_answer(self, normalized_name, existing_name, existing_normalized, same):
+        """
+        Stores whether a name and a known runner are the same person
+
+        Args:
+            normalized_name (str): normalized form of the name
+            existing_name (str): name of the known runner
+            existing_normalized (str): normalized form of existing_name
+            same (bool): True if they are the same person
+        """
+        if same:
+            self.identities.add_alias(normalized_name, self.identities.id_of(existing_name))
+            self.cache.journal({'same': [normalized_name, existing_name]})
+        else:
+            # Store that these names are different
+            name_pair = sorted([normalized_name, existing_normalized])
+            self.identities.add_cannot_link(*name_pair)
+            self.cache.journal({'different': name_pair})
+        self.cache.mark_dirty('identities')
+
+
+    def merge_runners(self, name, other_name):
+        """
+        Merges two known runners in the identity store, the merged runner keeping the name of the first one.
+        Their aliases then resolve to the merged runner: the ratings must be computed again (see replay_reviews).
+
+        Raises:
+            ValueError: if names of the two runners were confirmed as different
+        """
+        self.identities.union(self.identities.id_of(name), self.identities.id_of(other_name))
+        self.cache.journal({'merge': [name, other_name]})
+        self.cache.mark_dirty('identities')
+
+
+    def defer_review(self, name, normalized_name, existing_name, existing_normalized, score):
+        """
+        Adds a pair of similar names to the review queue instead of asking about it
+
+        Returns:
+            bool: True if the names are provisionally the same runner
+        """
+        name_pair = tuple(sorted([normalized_name, existing_normalized]))
+        self.profiler.count('find_similar_name', deferred=1)
+        if self.review_state is None:
+            # Ratings before the current race, from where they are replayed if a decision contradicts the provisional one
+            self.review_state = (len(self.race_history), pickle.dumps({'method': self.method, 'players': self.players}, 
+                                                                      protocol=pickle.HIGHEST_PROTOCOL))
+        entry = self.review_queue.add(name_pair, name, normalized_name, existing_name, existing_normalized, score, 
+                                      self.provisional, self.current_race)
+        self.cache.mark_dirty('review_queue')
+        return entry['provisional'] == 'same'
+
+
+    def pending_reviews(self):
+        """
+        Returns:
+            list of dict: pairs of names waiting for a decision, with the name found in the races (name), 
+                          the known runner (candidate), their similarity (score), the provisional decision 
+                          and the races where the pair was found
+        """
+        return self.review_queue.pending()
+
+
+    def check_reviews(self, decisions, folder = './data/csv'):
+        """
+        Checks that a batch of decisions can be applied as a whole, on a copy of the identities, 
+        so that apply_reviews changes nothing when one of them cannot be applied
+
+        Args:
+            decisions (dict): pair of normalized names (as in the 'pair' field of pending_reviews) -> True if same runner
+            folder (str, optional): Path to where are stored the csv files of the races. Defaults to './data/csv'.
+
+        Returns:
+            list of tuple: (pair, entry of the review queue, name of the known runner, same, True if the runner created 
+                           provisionally for the name is merged into the known runner) for each decision, 
+                           and True if the ratings must be replayed
+
+        Raises:
+            KeyError: if a pair is not in the review queue
+            ValueError: if a decision merges runners known to be different people
+            FileNotFoundError: if the ratings must be replayed and race files are missing
+        """
+        identities = copy.deepcopy(self.identities)
+        batch = []
+        replay = False
+        for name_pair, same in decisions.items():
+            name_pair = tuple(name_pair)
+            entry = self.review_queue.get(name_pair)
+            if entry is None:
+                raise KeyError(f"{name_pair} is not in the review queue")
+            # The known runner may have been merged into another one since the pair was deferred
+            candidate_id = identities.lookup(entry['candidate_normalized'])
+            candidate = identities.names[candidate_id]
+            separate_id = identities.lookup(entry['normalized_name'])
+            merge = bool(same) and separate_id is not None and identities.names[separate_id] == entry['name']
+            if merge:
+                identities.union(candidate_id, separate_id)
+            elif same:
+                identities.add_alias(entry['normalized_name'], candidate_id)
+            else:
+                identities.add_cannot_link(*sorted([entry['normalized_name'], entry['candidate_normalized']]))
+            batch.append((name_pair, entry, candidate, same, merge))
+            replay = replay or entry['provisional'] != ('same' if same else 'different')
+        if replay:
+            self.replay_paths(folder)
+        return batch, replay
+
+
+    def apply_reviews(self, decisions, folder = './data/csv', jobs = 4):
+        """
+        Applies decisions on pairs of the review queue in one batch. 
+        Decisions matching the provisional one only update the identities. If any decision contradicts it, 
+        the ratings are replayed from the first race with a deferred pair, reading the races from folder again.
+        The batch is checked first (see check_reviews): if a decision cannot be applied, none is.
+
+        Args:
+            decisions (dict): pair of normalized names (as in the 'pair' field of pending_reviews) -> True if same runner
+            folder (str, optional): Path to where are stored the csv files of the races. Defaults to './data/csv'.
+            jobs (int, optional): Number of race files read at once. Defaults to 4.
+
+        Returns:
+            int: number of races replayed
+
+        Raises:
+            KeyError, ValueError, FileNotFoundError: if the batch cannot be applied (see check_reviews)
+        """
+        batch, replay = self.check_reviews(decisions, folder)
+        for name_pair, entry, candidate, same, merge in batch:
+            if merge:
+                # The runner created provisionally for the name is merged into the known runner
+                self.merge_runners(candidate, entry['name'])
+            else:
+                self.record_answer(entry['normalized_name'], candidate, entry['candidate_normalized'], same)
+            self.review_queue.remove(name_pair)
+            self.cache.mark_dirty('review_queue')
+
+        n_replayed = self.replay_reviews(folder, jobs) if replay else 0
+        if not len(self.review_queue):
+            self.review_state = None
+        if replay:
+            self.save_caches([])
+        else:
+            self.checkpoint()
+            self.save_review_state()
+        return n_replayed
+
+
+    def replay_start(self):
+        """
+        Returns:
+            int: index of the race from where replay_reviews computes the ratings again
+        """
+        return self.review_state[0] if self.review_state is not None else 0
+
+
+    def replay_paths(self, folder = './data/csv'):
+        """
+        Paths of the race files read by replay_reviews
+
+        Raises:
+            FileNotFoundError: if some of them are missing
+        """
+        paths = [os.path.join(folder, race_name) for race_name in self.race_history.race_names[self.replay_start():]]
+        missing = [path for path in paths if not os.path.isfile(path)]
+        if missing:
+            raise FileNotFoundError(f"Race files needed to replay the ratings not found: {', '.join(missing)}")
+        return paths
+
+
+    @profiled('replay_reviews')
+    def replay_reviews(self, folder = './data/csv', jobs = 4):
+        """
+        Computes the ratings again from the first race with a deferred pair, with the current identities.
+        The state of the ratings before that race is kept for the pairs still pending.
+
+        Only that state is kept, not one per deferred pair: every race from the first race with a deferred pair 
+        is computed again, also when the contradicted pairs were only found in later races (the races before 
+        them then give the same ratings as before).
+
+        Returns:
+            int: number of races replayed
+        """
+        paths = self.replay_paths(folder)
+        race_idx = self.replay_start()
+        if self.review_state is not None:
+            state = pickle.loads(self.review_state[1])
+        else:
+            state = {'method': openelo.EloMMR(**self.method_params), 'players': {}}
+        race_names = self.race_history.race_names[race_idx:]
+        print(f"Replaying {len(race_names)} races from {race_names[0] if race_names else 'the end'}")
+
+        # Dates as in get_catalogue: races without a date get the first date
+        dates = [self.parse_race_date(race_name) for race_name in self.race_history.race_names]
+        first_date = min([date for date in dates if date is not None], default=None)
+        dates = [date or first_date for date in dates]
+        weights = race_weights(dates, self.weighting)[race_idx:]
+        dates = dates[race_idx:]
+        # Back to the state before the first race with a deferred pair
+        self.method = state['method']
+        players = dict(state['players'])
+        for name in self.identities.runner_names():
+            players.setdefault(name, openelo.Player())
+        self.players = players
+        self.build_name_index()
+        self.race_history.truncate(race_idx)
+        self.participations = {}
+        for idx in range(race_idx):
+            self.index_race(idx)
+        self.timeline.truncate(race_idx)
+
+        for race_name, date, weight, df in zip(race_names, dates, weights, read_race_csvs(paths, jobs)):
+            self.process_race(df, weight=weight, date=self.date_to_int(date) if date else None, race_name=race_name)
+        # The category rankings of the same races resolved the names with the previous identities
+        self.identities.revision += 1
+        self.cache.mark_dirty('identities')
+        return len(race_names)
+
+
     def get_or_create_player(self, name):
         """
         Get existing runner or create new one, handling typos
         """
+        if not self.resolve_names:
+            if name not in self.players:
+                self.players[name] = openelo.Player()
+            return name
+
         # Try to find similar name first
         similar_name = self.find_similar_name(name)
         
@@ -263,16 +925,37 @@ class Ranker:
         
         # Create new runner
         normalized_name = self.normalize_name(name)
-        self.name_mapping[normalized_name] = name
+        self.identities.add_runner(name, normalized_name)
         
-        # Save updated name mappings to cache
-        self.save_name_mappings(self.name_mapping)
+        # Identities are saved at the next flush
+        self.cache.mark_dirty('identities')
+        self.cache.maybe_flush()
         
         # Create a new Player
         self.players[name] = openelo.Player()
+        self.normalized_names[name] = normalized_name
+        self.name_index.add(name, normalized_name)
         return name
 
 
+    def get_or_create_players(self, names):
+        """
+        Get existing runners or create new ones for a list of names, each distinct name being resolved once
+
+        Args:
+            names (list of str): names of the runners, possibly repeated
+
+        Returns:
+            dict: raw name -> name of the corresponding runner in self.players
+        """
+        resolved = {}
+        for name in names:
+            if name not in resolved:
+                resolved[name] = self.get_or_create_player(name)
+        return resolved
+
+
+    @profiled('process_race')
     def process_race(self, df, weight = 1.0, date = None, race_name = None):
         """Converts the DataFrame of one race into the standing format for openelo method
 
@@ -283,76 +966,153 @@ class Ranker:
             race_name (str, optional): Name of the race file. Defaults to None.
 
         Returns:
-            list: returns a list of [openelo.Player, int, int] where first and secondd ints are the place in standings. For ties, these are different.
+            dict: raw name -> name of the corresponding runner, for each runner of the race
         """
 
-        df['name'] = df['name'].apply(self.get_or_create_player)
+        self.profiler.count('process_race', rows=len(df))
+        self.current_race = race_name
+        # Places are encoded first: a race which does not fit the race history is rejected before any runner is created
+        places = self.race_history.encode_places(df['place'].tolist())
+        with self.profiler.stage('resolve_names'):
+            resolved = self.get_or_create_players(df['name'].tolist())
+            df = df.assign(name=df['name'].map(resolved))
 
-        standings = []
-        last_place = 0
-        for idx, row in df.iterrows(): 
-            try: 
-                place_1 = int(row['place']) - 1
-                place_2 = place_1 
-                last_place += 1
-            except: 
-                place_1 = last_place
-                place_2 = len(df) - 1
-            
-            name = row['name']
+        # Finishers keep their place. Abandons ("Ab.") tie between the place after the last finisher above them and the last place
+        place_1, place_2 = standing_places(np.where(places == ABANDON, np.nan, places))
 
-            standings.append([self.players[name], place_1, place_2])
+        players = [self.players[name] for name in df['name'].tolist()]
+        standings = [list(standing) for standing in zip(players, place_1.tolist(), place_2.tolist())]
+
+        # The race is committed to the history after the ratings are updated
+        race = self.race_history.prepare(race_name, places, df['name'].tolist(), df['club'].astype(str).tolist())
 
         # Update ratings using elommr
-        crp = openelo.ContestRatingParams(weight=weight)
-        if date:
-            (self.method).round_update(crp, standings, contest_time=date)
-        else:
-            (self.method).round_update(crp, standings)
+        crp = openelo.ContestRatingParams(weight=weight, **self.contest_params)
+        with self.profiler.stage('rating_update'):
+            if date:
+                (self.method).round_update(crp, standings, contest_time=date)
+            else:
+                (self.method).round_update(crp, standings)
         
-        # Store race history
-        self.race_history.append({
-            'race_data': df.copy(),
-            'standings': standings,
-            'race_name': race_name
-        })
+        with self.profiler.stage('record_history'):
+            # Store race history
+            race_idx = self.race_history.commit(race)
+            self.index_race(race_idx)
+
+            # Record the rating of each participant after the race
+            for name in dict.fromkeys(df['name'].tolist()):
+                _, place, _ = self.participations[name][-1]
+                rating = self.players[name].approx_posterior
+                self.timeline.append(race_idx, name, place, rating.mu, rating.sig)
+
+        return resolved
+
+
+    def index_race(self, race_idx):
+        """
+        Adds the results of one race of self.race_history to the participations of its runners, 
+        abandons ("Ab.") being ranked last
+
+        Args:
+            race_idx (int): index of the race in self.race_history
+        """
+        places, name_ids, _ = self.race_history.race(race_idx)
+        field_size = len(places)
+        places = np.where(places == ABANDON, field_size, places).tolist()
+        names = self.race_history.names
+        seen = set()
+        for name_id, place in zip(name_ids.tolist(), places):
+            if name_id in seen:
+                continue
+            seen.add(name_id)
+            self.participations.setdefault(names[name_id], []).append((race_idx, place, field_size))
 
 
     def date_to_int(self,dt_time):
         return 10000*dt_time.year + 100*dt_time.month + dt_time.day
 
 
-    def rank(self, folder, ext = 'csv'):
+    @staticmethod
+    def parse_race_date(file):
+        """
+        Date of a race from its file name (YYYY-MM-DD_... or YYYY_MM_DD_...)
+
+        Returns:
+            datetime.date: date of the race, None if the file name does not start with a valid date
+        """
+        match = RACE_DATE_PATTERN.match(file)
+        if match is None:
+            return None
+        try:
+            return datetime.date(*(int(group) for group in match.groups()))
+        except ValueError:
+            return None
+
+
+    @profiled('rank')
+    def rank(self, folder, ext = 'csv', jobs = 4, on_race = None):
         """Computes the ranking based on the files contained in folder
 
         Args:
             folder (str): Path to where are stored the csv files with standings for each race
             ext (str, optional): extension file to read. Defaults to 'csv'.
+            jobs (int, optional): Number of race files read at once. Defaults to 4.
+            on_race (callable, optional): Called after each processed race with its catalogue entry, its standings 
+                                          (place, name, club and category columns) with resolved runner names 
+                                          and its weight. Defaults to None.
         """
-        df_list, date_list, processed_files = self.get_data(folder, ext)
+        # Races are listed first, then read and processed one at a time in chronological order
+        catalogue = self.get_catalogue(folder, ext)
+        reason = self.restart_reason(catalogue)
+        if reason is not None:
+            print(f"Warning: {reason}, computing every race again")
+            self.restart()
+            catalogue = self.get_catalogue(folder, ext)
+        processed_files = [entry['file'] for entry in catalogue]
         
-        #For exponential weighting based on date
-        differences = [d-min(date_list) for d in date_list]
-        weights = [np.exp(-d/np.max(differences)) for d in differences]
+        # Weight of each race, from the dates of every race of the ranking (processed ones included), as in a full run
+        processed_dates = self.processed_dates()
+        weights = race_weights(processed_dates + [entry['date'] for entry in catalogue], self.weighting)[len(processed_dates):]
 
-        for idx,df in enumerate(df_list):
+        for entry, df in self.get_data(folder, ext, catalogue, jobs, with_category=on_race is not None):
             if len(df) > 1:
-                self.process_race(df, date=self.date_to_int(date_list[idx]), race_name=processed_files[idx]) #, weight=weights[idx]
+                date = self.date_to_int(entry['date']) if entry['date'] else None
+                weight = weights[entry['race_idx']]
+                resolved = self.process_race(df[['place', 'name', 'club']], weight=weight, date=date, race_name=entry['file'])
+                if on_race is not None:
+                    on_race(entry, df.assign(name=df['name'].map(resolved)), weight)
             else:
                 print(f"Skipping {df.to_string()}: not enough runners")
         
-        # Save final name mappings to cache
-        self.save_name_mappings(self.name_mapping)
-        # Save final different names to cache
-        self.save_different_names(self.different_names)
+        self.save_caches(processed_files)
+
+
+    def save_caches(self, processed_files):
+        """
+        Saves every cache at the end of a ranking
+
+        Args:
+            processed_files (list of str): race files processed by the ranking
+        """
+        # Save final name mappings and different names to cache
+        self.checkpoint()
         # Save processed races cache
         # Update processed races cache with new files
         self.processed_races.update({file: 1 for file in processed_files})
         self.save_processed_races(self.processed_races)
         # Save race history cache
         self.save_race_history(self.race_history)
+        # Save per-runner history shards for the web interface
+        self.save_runner_shards()
+        # Save the rating of each runner after each race
+        self.save_rating_timeline(self.timeline)
+        # Save the exact state of the ratings for the next incremental run
+        self.save_rating_state()
+        # Save the ratings from where deferred pairs are replayed
+        self.save_review_state()
 
 
+    @profiled('save_rankings')
     def save_rankings(self, folder='./data/csv', fname='ranking', ext = 'csv'):
         """
         Save current ranking to CSV file
@@ -372,10 +1132,12 @@ class Ranker:
         if ext == 'csv':
             fpath = os.path.join(folder,fname + '.csv')
             df.to_csv(fpath, index=False)
+            self.profiler.count_files('save_rankings', fpath)
             print(f"Ranking saved to {fpath}")
         elif ext == 'html':
             fpath = os.path.join(folder,fname + '.html')
             df.to_html(fpath, index=False)
+            self.profiler.count_files('save_rankings', fpath)
             print(f"Ranking saved to {fpath}")
         else:
             raise ValueError('File type other than "csv" or "html" are not handled')
@@ -383,6 +1145,21 @@ class Ranker:
         return df
 
     
+    def publish_web_files(self, fname='ranking', ext='csv'):
+        """
+        Saves the ranking to the folder of the web interface files, then publishes them (see publish.publish), 
+        the site folder being the parent of that folder (docs/manifest.json for docs/cache). 
+        Every ranking read by the web interface must be followed by this call, else the page keeps showing the 
+        previously published files.
+        """
+        self.save_rankings(folder=self.docs_dir, fname=fname, ext=ext)
+        # Minified, compressed and content-hashed copies of the web files, listed in the manifest
+        try:
+            publish(source_dir=self.docs_dir, site_dir=os.path.dirname(os.path.normpath(self.docs_dir)))
+        except Exception as e:
+            print(f"Error publishing web files: {e}")
+
+
     def get_rankings(self, top_n=None, min_races=3):
         """
         Get current Elo rankings sorted by rating, filtering out players with less than min_races
@@ -391,15 +1168,16 @@ class Ranker:
             top_n (int, optional): Number of top players to return. Defaults to None.
             min_races (int, optional): Minimum number of races required. Defaults to 3.
         """
+        # Number of races of each runner id of the race history, counted on the whole table at once
+        race_counts = self.race_history.participation_counts().tolist()
+        name_index = self.race_history.name_index
+        
         # Get current ratings from players
         rankings = []
         for name, player in self.players.items():
             # Count races participated for this player
-            races_participated = 0
-            for race in self.race_history:
-                race_data = race['race_data']
-                if name in race_data['name'].values:
-                    races_participated += 1
+            name_id = name_index.get(name)
+            races_participated = race_counts[name_id] if name_id is not None else 0
             
             # Only include players with at least min_races
             if races_participated >= min_races:
@@ -432,14 +1210,9 @@ class Ranker:
             'total_races': 0
         }
         
-        for race in self.race_history:
-            race_data = race['race_data']
-            if player_name in race_data['name'].values:
-                stats['races_participated'] += 1
-                player_place = race_data[race_data['name'] == player_name]['place'].iloc[0]
-                if isinstance(player_place, str) and (not player_place.isdigit()):
-                    player_place = len(race_data)
-                stats['best_finish'] = min(stats['best_finish'], int(player_place))
+        for race_idx, place, field_size in self.participations.get(player_name, ()):
+            stats['races_participated'] += 1
+            stats['best_finish'] = min(stats['best_finish'], place)
         
         if stats['best_finish'] == float('inf'):
             stats['best_finish'] = None
@@ -447,6 +1220,29 @@ class Ranker:
         return stats
 
 
+    def get_player_history(self, player_name):
+        """
+        Get the results of a specific runner, in race order
+
+        Returns:
+            list of dict: race index, race name, place, number of runners of each race, 
+                          and rating and sigma after the race (None if they were not recorded)
+        """
+        ratings = {race_idx: (mu, sigma) for race_idx, _, mu, sigma in self.timeline.runner(player_name)}
+        history = []
+        for race_idx, place, field_size in self.participations.get(player_name, ()):
+            rating, sigma = ratings.get(race_idx, (None, None))
+            history.append({
+                'race': race_idx,
+                'race_name': self.race_history.race_names[race_idx] or f'Race {race_idx + 1}',
+                'place': place,
+                'total_runners': field_size,
+                'rating': rating,
+                'sigma': sigma
+            })
+        return history
+
+
     def print_top_rankings(self, top_n=20):
         """
         Print top N rankings
@@ -458,28 +1254,50 @@ class Ranker:
         print(f"{'Rank':<4} {'Name':<30} {'Elo Rating':<10} {'Races':<6}")
         print("-" * 70)
         
-        for i, (name, rating, races) in enumerate(rankings, 1):
+        for i, (name, rating, sigma, races) in enumerate(rankings, 1):
             print(f"{i:<4} {name:<30} {rating:<10.1f} {races:<6}")
 
 
-    def save_name_mappings(self, name_mapping, cache_file='name_mappings.json'):
+    @profiled('save_identities')
+    def save_identities(self, cache_file='identities.npz'):
         """
-        Save name mappings to cache file as JSON with alphabetically ordered keys
+        Save the identity store (runner ids, names, aliases and names of different people) to cache file in binary format
         """
         cache_path = os.path.join(self.cache_dir, cache_file)
         try:
-            # Sort the dictionary by keys alphabetically
-            sorted_mapping = dict(sorted(name_mapping.items()))
-            with open(cache_path, 'w', encoding='utf-8') as f:
-                json.dump(sorted_mapping, f, indent=2, ensure_ascii=False)
-            print(f"Name mappings saved to cache: {cache_path}")
+            atomic_write(cache_path, self.identities.to_bytes())
+            self.profiler.count_files('save_identities', cache_path)
+            print(f"Identities saved to cache: {cache_path}")
+            return True
         except Exception as e:
-            print(f"Error saving name mappings to cache: {e}")
+            print(f"Error saving identities to cache: {e}")
+            return False
+
+
+    def load_identities(self, cache_file='identities.npz'):
+        """
+        Load the identity store from cache file, 
+        or build it from the name mappings and different names caches of previous versions if there is none
+        """
+        cache_path = os.path.join(self.cache_dir, cache_file)
+        if os.path.exists(cache_path):
+            try:
+                identities = IdentityStore.load(cache_path)
+                print(f"Identities loaded from cache: {cache_path}")
+                return identities
+            except Exception as e:
+                print(f"Error loading identities from cache: {e}")
+            return IdentityStore()
+        identities = IdentityStore.from_mappings(self.load_name_mappings(), self.load_different_names())
+        if len(identities):
+            # Written in the current format at the next flush
+            self.cache.mark_dirty('identities')
+        return identities
 
 
     def load_name_mappings(self, cache_file='name_mappings.json'):
         """
-        Load name mappings from cache file as JSON
+        Load name mappings from cache file as JSON (previous versions)
         """
         cache_path = os.path.join(self.cache_dir, cache_file)
         if os.path.exists(cache_path):
@@ -493,37 +1311,9 @@ class Ranker:
         return {}
 
 
-    def save_different_names(self, different_names, cache_file='different_names.json'):
-        """
-        Save confirmed different names to cache file as JSON with first name as key and list of different names as value
-        """
-        cache_path = os.path.join(self.cache_dir, cache_file)
-        try:
-            # Convert tuple keys to single name key with list of different names
-            converted_dict = {}
-            for name_pair, _ in different_names.items():
-                if isinstance(name_pair, tuple) and len(name_pair) == 2:
-                    # Sort the names and use the first as key
-                    sorted_names = sorted(name_pair)
-                    key_name = sorted_names[0]
-                    different_name = sorted_names[1]
-                    
-                    if key_name not in converted_dict:
-                        converted_dict[key_name] = []
-                    converted_dict[key_name].append(different_name)
-            
-            # Sort the dictionary by keys alphabetically
-            sorted_different = dict(sorted(converted_dict.items()))
-            with open(cache_path, 'w', encoding='utf-8') as f:
-                json.dump(sorted_different, f)
-            print(f"Different names saved to cache: {cache_path}")
-        except Exception as e:
-            print(f"Error saving different names to cache: {e}")
-
-
     def load_different_names(self, cache_file='different_names.json'):
         """
-        Load confirmed different names from cache file as JSON and convert to internal tuple format
+        Load confirmed different names from cache file as JSON (previous versions) and convert to internal tuple format
         """
         cache_path = os.path.join(self.cache_dir, cache_file)
         if os.path.exists(cache_path):
@@ -546,6 +1336,63 @@ class Ranker:
         return {}
 
 
+    def replay_journal(self):
+        """
+        Apply the interactive answers journaled after the last flush of the name caches
+        """
+        records = self.cache.read_journal()
+        for record in records:
+            if 'same' in record:
+                normalized_name, existing_name = record['same']
+                runner_id = self.identities.id_of(existing_name)
+                if runner_id is None:
+                    # Runner created after the last flush
+                    runner_id = self.identities.add_runner(existing_name, self.normalize_name(existing_name))
+                self.identities.add_alias(normalized_name, runner_id)
+            elif 'different' in record:
+                self.identities.add_cannot_link(*record['different'])
+            elif 'merge' in record:
+                name, other_name = record['merge']
+                if self.identities.id_of(name) is not None and self.identities.id_of(other_name) is not None:
+                    self.identities.union(self.identities.id_of(name), self.identities.id_of(other_name))
+            self.cache.mark_dirty('identities')
+        if records:
+            print(f"{len(records)} answers recovered from journal: {self.cache.journal_path}")
+
+
+    def migrate_identities(self):
+        """
+        One-time migration of the identities and of the review queue written by the versions before NORMALIZATION_VERSION,
+        whose normalize_name only folded some accents (see legacy_normalize_name): the normalized form of the name 
+        of each runner is added to its aliases, next to its previous form. The other aliases, whose raw names are not
+        known, keep their previous form only. Saved at the next flush.
+        """
+        if self.identities.normalization >= NORMALIZATION_VERSION:
+            return
+        aliases = {}
+        for name in self.identities.runner_names():
+            legacy_name, normalized_name = legacy_normalize_name(name), normalize_name(name)
+            if legacy_name != normalized_name and self.identities.lookup(legacy_name) == self.identities.id_of(name):
+                aliases[legacy_name] = normalized_name
+        n_added = self.identities.add_folded_aliases(aliases)
+        self.review_queue.renormalize(normalize_name)
+        self.identities.normalization = NORMALIZATION_VERSION
+        if len(self.identities) or len(self.review_queue):
+            self.cache.mark_dirty('identities')
+            self.cache.mark_dirty('review_queue')
+        if n_added:
+            print(f"{n_added} runner names normalized again with accents folded")
+
+
+    @profiled('checkpoint')
+    def checkpoint(self):
+        """
+        Write the name mappings and different names caches if they changed since the last checkpoint
+        """
+        self.cache.flush()
+
+
+    @profiled('save_processed_races')
     def save_processed_races(self, processed_races, cache_file='processed_races.json'):
         """
         Save processed race data to cache file as JSON
@@ -554,9 +1401,11 @@ class Ranker:
         try:
             with open(cache_path, 'w', encoding='utf-8') as f:
                 json.dump(processed_races, f)
-            os.makedirs('docs/cache', exist_ok=True)
-            with open('docs/cache/processed_races.json', 'w', encoding='utf-8') as f:
+            os.makedirs(self.docs_dir, exist_ok=True)
+            docs_path = os.path.join(self.docs_dir, 'processed_races.json')
+            with open(docs_path, 'w', encoding='utf-8') as f:
                     json.dump(processed_races, f)
+            self.profiler.count_files('save_processed_races', cache_path, docs_path)
             print(f"Processed races saved to cache: {cache_path}")
         except Exception as e:
             print(f"Error saving processed races to cache: {e}")
@@ -578,69 +1427,327 @@ class Ranker:
         return {}
 
 
-    def save_race_history(self, race_history, cache_file='race_history.json'):
+    @staticmethod
+    def race_history_line(race_history, race_idx):
         """
-        Save race history to cache file as JSON
+        One race of the race history as a line of the JSONL file of the web interface
+        """
+        return json.dumps({
+            'race_idx': race_idx,
+            'race_name': race_history.race_names[race_idx],
+            'race_data': race_history.race_data(race_idx).to_dict('records'),
+        }, ensure_ascii=False, separators=(',', ':'))
+
+
+    @profiled('save_race_history')
+    def save_race_history(self, race_history, cache_file='race_history.npz', compact_segments=16):
+        """
+        Save race history to cache file in columnar binary format, and to self.docs_dir as JSONL for the web interface.
+
+        Only the races which are not saved yet are written: they are appended as a new segment to the log next to 
+        the cache file (race_history.log), and as new lines to the JSONL file. The cache file and its log are compacted
+        into a single table when the log holds compact_segments segments, or when saved races were removed.
+
+        Args:
+            race_history (RaceStore): race history to save
+            cache_file (str, optional): name of the cache file. Defaults to 'race_history.npz'.
+            compact_segments (int, optional): number of segments from which the log is compacted. Defaults to 16.
         """
         cache_path = os.path.join(self.cache_dir, cache_file)
+        log = SegmentLog(os.path.splitext(cache_path)[0] + '.log')
+        docs_path = os.path.join(self.docs_dir, 'race_history.jsonl')
         try:
-            # Convert race history to serializable format
-            serializable_history = []
-            for race in race_history:
-                serializable_race = {
-                    'race_data': race['race_data'].to_dict('records'),
-                    'race_name': race.get('race_name', ''),
-                    'standings': []  # We don't need to save standings as they're not used for display
-                }
-                serializable_history.append(serializable_race)
-            
-            with open(cache_path, 'w', encoding='utf-8') as f:
-                json.dump(serializable_history, f, indent=2, ensure_ascii=False)
-            os.makedirs('docs/cache', exist_ok=True)
-            with open('docs/cache/race_history.json', 'w', encoding='utf-8') as f:
-                json.dump(serializable_history, f, indent=2, ensure_ascii=False)
+            unsaved_races = race_history.unsaved_races()
+            if race_history.saved is None or not os.path.exists(cache_path) or race_history.n_segments >= compact_segments:
+                self.compact_race_history(race_history, cache_file)
+                return
+            if not os.path.exists(docs_path):
+                self.save_race_history_docs(race_history)
+            elif unsaved_races:
+                written = append_lines(docs_path, [self.race_history_line(race_history, race_idx) for race_idx in unsaved_races])
+                self.profiler.count('save_race_history', bytes=written)
+            if unsaved_races:
+                written = log.append(race_history.segment_bytes())
+                race_history.mark_saved()
+                self.profiler.count('save_race_history', bytes=written)
+                print(f"{len(unsaved_races)} races appended to race history cache: {log.path}")
+        except Exception as e:
+            # The files are written again from scratch next time
+            race_history.saved = None
+            print(f"Error saving race history to cache: {e}")
+
+
+    def compact_race_history(self, race_history=None, cache_file='race_history.npz'):
+        """
+        Writes the whole race history as a single table in the cache file, and removes the segments of its log.
+        The JSONL file of the web interface is written again as well.
+
+        Args:
+            race_history (RaceStore, optional): race history to save. Defaults to None (self.race_history).
+            cache_file (str, optional): name of the cache file. Defaults to 'race_history.npz'.
+        """
+        race_history = self.race_history if race_history is None else race_history
+        cache_path = os.path.join(self.cache_dir, cache_file)
+        try:
+            # The segments of the log belong to the previous generation: they are skipped if the log is not cleared
+            race_history.next_generation()
+            atomic_write(cache_path, race_history.to_bytes())
+            SegmentLog(os.path.splitext(cache_path)[0] + '.log').clear()
+            self.save_race_history_docs(race_history)
+            race_history.mark_saved(compacted=True)
+            self.profiler.count_files('save_race_history', cache_path)
             print(f"Race history saved to cache: {cache_path}")
         except Exception as e:
+            race_history.saved = None
             print(f"Error saving race history to cache: {e}")
 
 
-    def load_race_history(self, cache_file='race_history.json'):
+    def save_race_history_docs(self, race_history):
+        """
+        Writes every race of the race history to the JSONL file of the web interface, one race per line
+        """
+        docs_path = os.path.join(self.docs_dir, 'race_history.jsonl')
+        atomic_write(docs_path, ''.join(self.race_history_line(race_history, race_idx) + '\n' 
+                                        for race_idx in range(len(race_history))))
+        # JSON file of previous versions, replaced by the JSONL file
+        legacy_path = os.path.join(self.docs_dir, 'race_history.json')
+        if os.path.exists(legacy_path):
+            os.remove(legacy_path)
+        self.profiler.count_files('save_race_history', docs_path)
+
+
+    def load_race_history(self, cache_file='race_history.npz'):
         """
-        Load race history from cache file as JSON
+        Load race history from cache file in columnar binary format and the segments appended to its log, 
+        or from the JSON cache file of previous versions if there is none.
+        A segment which was not completely written is ignored.
         """
         cache_path = os.path.join(self.cache_dir, cache_file)
         if os.path.exists(cache_path):
             try:
-                with open(cache_path, 'r', encoding='utf-8') as f:
+                segments, _ = SegmentLog(os.path.splitext(cache_path)[0] + '.log').read()
+                race_history = RaceStore.load(cache_path, segments)
+                print(f"Race history loaded from cache: {cache_path} ({len(segments)} segments)")
+                return race_history
+            except Exception as e:
+                print(f"Error loading race history from cache: {e}")
+            return RaceStore()
+        
+        legacy_path = os.path.join(self.cache_dir, 'race_history.json')
+        if os.path.exists(legacy_path):
+            try:
+                with open(legacy_path, 'r', encoding='utf-8') as f:
                     serializable_history = json.load(f)
                 
-                # Convert back to original format
-                race_history = []
+                # Convert to the columnar format
+                race_history = RaceStore()
                 for race in serializable_history:
-                    race_data = pd.DataFrame(race['race_data'])
-                    race_history.append({
-                        'race_data': race_data,
-                        'race_name': race.get('race_name', ''),
-                        'standings': []  # Empty standings as they're not needed for display
-                    })
+                    race_data = race['race_data']
+                    race_history.append(race.get('race_name', ''), [row['place'] for row in race_data], 
+                                        [row['name'] for row in race_data], [str(row['club']) for row in race_data])
                 
-                print(f"Race history loaded from cache: {cache_path}")
+                print(f"Race history loaded from cache: {legacy_path}")
                 return race_history
             except Exception as e:
                 print(f"Error loading race history from cache: {e}")
-        return []
+        return RaceStore()
+
+
+    @profiled('save_rating_timeline')
+    def save_rating_timeline(self, timeline, cache_file='rating_timeline.npz'):
+        """
+        Save the rating of each runner after each race to cache file in binary format
+        """
+        cache_path = os.path.join(self.cache_dir, cache_file)
+        try:
+            atomic_write(cache_path, timeline.to_bytes())
+            self.profiler.count_files('save_rating_timeline', cache_path)
+            print(f"Rating timeline saved to cache: {cache_path}")
+        except Exception as e:
+            print(f"Error saving rating timeline to cache: {e}")
+
+
+    def load_rating_timeline(self, cache_file='rating_timeline.npz'):
+        """
+        Load the rating of each runner after each race from cache file
+        """
+        cache_path = os.path.join(self.cache_dir, cache_file)
+        if os.path.exists(cache_path):
+            try:
+                timeline = RatingTimeline.load(cache_path)
+                print(f"Rating timeline loaded from cache: {cache_path}")
+                return timeline
+            except Exception as e:
+                print(f"Error loading rating timeline from cache: {e}")
+        return RatingTimeline()
+
+
+    @profiled('save_rating_state')
+    def save_rating_state(self, cache_file='rating_state.ckpt'):
+        """
+        Save the exact state of the rating method and of every player (including their history and last update time)
+        as a binary checkpoint: a magic string and a version number followed by the pickled state
+        """
+        cache_path = os.path.join(self.cache_dir, cache_file)
+        try:
+            state = {
+                'method_name': self.method_name,
+                'weighting': self.weighting,
+                'method': self.method,
+                'players': self.players,
+                'processed_races': sorted(self.processed_races)
+            }
+            atomic_write(cache_path, pack_checkpoint(state))
+            self.profiler.count_files('save_rating_state', cache_path)
+            print(f"Rating state saved to cache: {cache_path}")
+        except Exception as e:
+            print(f"Error saving rating state to cache: {e}")
+
+
+    def load_rating_state(self, cache_file='rating_state.ckpt'):
+        """
+        Load the state of the rating method and of every player saved by save_rating_state
+
+        Returns:
+            dict: method_name, method, players (name -> Player) and processed_races. None if there is no valid checkpoint.
+        """
+        cache_path = os.path.join(self.cache_dir, cache_file)
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'rb') as f:
+                    state = unpack_checkpoint(f.read())
+                print(f"Rating state loaded from cache: {cache_path}")
+                return state
+            except Exception as e:
+                print(f"Error loading rating state from cache: {e}")
+        return None
+
+
+    @profiled('save_review_state')
+    def save_review_state(self, cache_file='review_state.ckpt'):
+        """
+        Save the ratings before the first race with a deferred pair as a binary checkpoint, 
+        or remove the checkpoint if no pair is deferred
+        """
+        cache_path = os.path.join(self.cache_dir, cache_file)
+        try:
+            if self.review_state is None:
+                if os.path.exists(cache_path):
+                    os.remove(cache_path)
+                return
+            race_idx, state = self.review_state
+            atomic_write(cache_path, pack_checkpoint({'race_idx': race_idx, 'state': state}))
+            self.profiler.count_files('save_review_state', cache_path)
+            print(f"Review state saved to cache: {cache_path}")
+        except Exception as e:
+            print(f"Error saving review state to cache: {e}")
+
+
+    def load_review_state(self, cache_file='review_state.ckpt'):
+        """
+        Load the checkpoint saved by save_review_state
+
+        Returns:
+            tuple: race index and pickled state of the ratings before that race. None if there is no valid checkpoint.
+        """
+        cache_path = os.path.join(self.cache_dir, cache_file)
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'rb') as f:
+                    checkpoint = unpack_checkpoint(f.read())
+                if checkpoint['race_idx'] > len(self.race_history):
+                    raise ValueError('the checkpoint does not match the race history')
+                print(f"Review state loaded from cache: {cache_path}")
+                return checkpoint['race_idx'], checkpoint['state']
+            except Exception as e:
+                print(f"Error loading review state from cache: {e}")
+        return None
+
+
+    @profiled('save_runner_shards')
+    def save_runner_shards(self, folder=None, runners_per_shard=64):
+        """
+        Save the race history of each runner for the web interface, split in small shards 
+        so that the page only downloads the shard of the selected runner.
+
+        folder/index.json holds the number of shards and the race names, folder/<shard>.json maps
+        each runner of the shard to its [race index, place, number of runners, rating, sigma] results
+        (rating and sigma after the race are omitted when they were not recorded).
+
+        The number of shards is a power of two, kept from the previous run while it is large enough: the shard
+        of a runner only changes when the number of runners doubles. Shards whose content did not change 
+        (no new race of their runners) are not written again, so that they keep their published path.
+
+        Args:
+            folder (str, optional): output folder. Defaults to None (runners folder of self.docs_dir).
+            runners_per_shard (int, optional): average number of runners per shard. Defaults to 64.
+        """
+        if folder is None:
+            folder = os.path.join(self.docs_dir, 'runners')
+        try:
+            n_shards = 1 << (max(1, math.ceil(len(self.participations) / runners_per_shard)) - 1).bit_length()
+            index_path = os.path.join(folder, 'index.json')
+            if os.path.exists(index_path):
+                try:
+                    with open(index_path, 'r', encoding='utf-8') as f:
+                        previous_shards = json.load(f).get('shards', 0)
+                    if previous_shards >= n_shards and previous_shards & (previous_shards - 1) == 0:
+                        n_shards = previous_shards
+                except Exception as e:
+                    print(f"Error loading runner shards index: {e}")
+            shards = [{} for _ in range(n_shards)]
+            for name in self.participations:
+                results = []
+                for race in self.get_player_history(name):
+                    result = [race['race'], race['place'], race['total_runners']]
+                    if race['rating'] is not None:
+                        result += [round(race['rating'], 1), round(race['sigma'], 1)]
+                    results.append(result)
+                shards[shard_of(name, n_shards)][name] = results
+
+            os.makedirs(folder, exist_ok=True)
+            n_written = 0
+            for shard_idx, shard in enumerate(shards):
+                content = json.dumps(shard, ensure_ascii=False, separators=(',', ':'))
+                if write_if_changed(os.path.join(folder, f'{shard_idx}.json'), content):
+                    n_written += 1
+                    self.profiler.count('save_runner_shards', bytes=len(content.encode('utf-8')))
+            index = {
+                'shards': n_shards,
+                'races': [(race_name or f'Race {race_idx + 1}') for race_idx, race_name in enumerate(self.race_history.race_names)]
+            }
+            atomic_write(index_path, json.dumps(index, ensure_ascii=False, separators=(',', ':')))
+
+            # Remove the shards of a previous run with more shards
+            for file in os.listdir(folder):
+                shard_name = file[:-len('.json')]
+                if file.endswith('.json') and shard_name.isdigit() and int(shard_name) >= n_shards:
+                    os.remove(os.path.join(folder, file))
+            self.profiler.count_files('save_runner_shards', index_path)
+            print(f"Runner shards saved to: {folder} ({n_written} of {n_shards} shards written)")
+        except Exception as e:
+            print(f"Error saving runner shards: {e}")
 
 
     def clear_cache(self):
         """
-        Clear the name mappings cache, different names cache, processed races cache, and race history cache
+        Clear the identities cache, processed races cache, and race history cache
         """
-        # Clear name mappings cache
-        cache_path = os.path.join(self.cache_dir, 'name_mappings.json')
+        # Clear identities cache
+        cache_path = os.path.join(self.cache_dir, 'identities.npz')
         if os.path.exists(cache_path):
             try:
                 os.remove(cache_path)
-                print(f"Name mappings cache cleared: {cache_path}")
+                print(f"Identities cache cleared: {cache_path}")
+            except Exception as e:
+                print(f"Error clearing identities cache: {e}")
+        
+        # Clear name mappings cache of previous versions
+        mapping_cache_path = os.path.join(self.cache_dir, 'name_mappings.json')
+        if os.path.exists(mapping_cache_path):
+            try:
+                os.remove(mapping_cache_path)
+                print(f"Name mappings cache cleared: {mapping_cache_path}")
             except Exception as e:
                 print(f"Error clearing name mappings cache: {e}")
         
@@ -662,19 +1769,55 @@ class Ranker:
             except Exception as e:
                 print(f"Error clearing processed races cache: {e}")
         
-        # Clear race history cache
-        history_cache_path = os.path.join(self.cache_dir, 'race_history.json')
-        if os.path.exists(history_cache_path):
+        # Clear rating state checkpoint
+        state_cache_path = os.path.join(self.cache_dir, 'rating_state.ckpt')
+        if os.path.exists(state_cache_path):
             try:
-                os.remove(history_cache_path)
-                print(f"Race history cache cleared: {history_cache_path}")
+                os.remove(state_cache_path)
+                print(f"Rating state cache cleared: {state_cache_path}")
             except Exception as e:
-                print(f"Error clearing race history cache: {e}")
+                print(f"Error clearing rating state cache: {e}")
         
-        self.name_mapping = {}
-        self.different_names = {}
+        # Clear review queue and review state
+        for review_file in ['review_queue.json', 'review_state.ckpt']:
+            review_cache_path = os.path.join(self.cache_dir, review_file)
+            if os.path.exists(review_cache_path):
+                try:
+                    os.remove(review_cache_path)
+                    print(f"Review cache cleared: {review_cache_path}")
+                except Exception as e:
+                    print(f"Error clearing review cache: {e}")
+        
+        # Clear rating timeline cache
+        timeline_cache_path = os.path.join(self.cache_dir, 'rating_timeline.npz')
+        if os.path.exists(timeline_cache_path):
+            try:
+                os.remove(timeline_cache_path)
+                print(f"Rating timeline cache cleared: {timeline_cache_path}")
+            except Exception as e:
+                print(f"Error clearing rating timeline cache: {e}")
+        
+        # Clear race history cache, its log (and its JSON version from previous versions)
+        for history_file in ['race_history.npz', 'race_history.log', 'race_history.json']:
+            history_cache_path = os.path.join(self.cache_dir, history_file)
+            if os.path.exists(history_cache_path):
+                try:
+                    os.remove(history_cache_path)
+                    print(f"Race history cache cleared: {history_cache_path}")
+                except Exception as e:
+                    print(f"Error clearing race history cache: {e}")
+        
+        # Clear pending answers
+        self.cache.clear_journal()
+        self.cache.dirty.clear()
+        
+        self.identities = IdentityStore()
         self.processed_races = {}
-        self.race_history = []
+        self.race_history = RaceStore()
+        self.participations = {}
+        self.timeline = RatingTimeline()
+        self.review_queue.entries = {}
+        self.review_state = None
 
 
 
@@ -682,29 +1825,88 @@ class Ranker:
 
 
 
-def main(csv_folder, output, top_n):
+def main(csv_folder, output, top_n, profile=None, by_category=False, groups=None, category=None, review=None, 
+         provisional='different', resolve_reviews=False):
     """
     Main function to run the Elo ranking system
+
+    Args:
+        profile (str, optional): Path of the JSON file where to save the timings and counters of each stage. 
+                                 Defaults to None (no profiling).
+        by_category (bool, optional): Also compute one ranking per category, in parallel. Defaults to False.
+        groups (list of str, optional): Groups of categories ranked together, as 'name=CAT1,CAT2'. 
+                                        Defaults to None (one ranking per category).
+        category (str, optional): Category (or group) whose top rankings are displayed. Defaults to None (overall ranking).
+        review (str, optional): 'ask' or 'defer' the questions on similar names. 
+                                Defaults to None ('ask' in a terminal, 'defer' otherwise, e.g. in scheduled runs).
+        provisional (str, optional): decision applied to deferred pairs until they are reviewed. Defaults to 'different'.
+        resolve_reviews (bool, optional): ask about the deferred pairs of the previous ranking and apply the answers, 
+                                          instead of computing the ranking. Defaults to False.
     """    
     
-    # Initialize ranker
-    ranker = Ranker()
-    
-    # Process all races
-    ranker.rank(folder=csv_folder)
+    if review is None:
+        review = 'ask' if sys.stdin.isatty() else 'defer'
+
+    if resolve_reviews:
+        ranker = Ranker(previous_rank=os.path.join(csv_folder, output), review=review, provisional=provisional, 
+                        profile=profile is not None)
+        pending = ranker.pending_reviews()
+        print(f"{len(pending)} pairs of names to review")
+        decisions = {}
+        for entry in pending:
+            print(f"Found in {', '.join(entry['races'])} (similarity {entry['score']:.2f})")
+            decisions[tuple(entry['pair'])] = ranker.ask(entry['name'], entry['candidate'])
+        try:
+            n_replayed = ranker.apply_reviews(decisions, folder=csv_folder)
+        except (KeyError, ValueError, FileNotFoundError) as e:
+            # No decision of the batch was applied
+            print(f"Decisions not applied: {e}")
+            return
+        print(f"{n_replayed} races replayed")
+    elif by_category or groups or category:
+        from categories import CategoryRankings, parse_groups
+        category_rankings = CategoryRankings(parse_groups(groups) if groups else None, ranking_folder=os.path.join(csv_folder, 'categories'))
+        # Overall ranking, and the ranking of each category in worker processes
+        ranker, summary = category_rankings.rank(csv_folder, profile=profile is not None, review=review, provisional=provisional)
+        for group, (n_runners, n_races, error) in summary.items():
+            if error is None:
+                print(f"Category {group}: {n_runners} runners, {n_races} races")
+    else:
+        # Initialize ranker
+        ranker = Ranker(profile=profile is not None, review=review, provisional=provisional)
+        
+        # Process all races
+        ranker.rank(folder=csv_folder)
     
     # Display top rankings
     if top_n:
-        ranker.print_top_rankings(top_n)
+        if category:
+            # categories imports this module: imported here, when needed
+            from categories import load_group_ranker
+            _, category_ranker = load_group_ranker(category.replace('/', '-'), ranking_folder=os.path.join(csv_folder, 'categories'))
+            if category_ranker is None:
+                print(f"No ranking for category {category}")
+            else:
+                category_ranker.print_top_rankings(top_n)
+        else:
+            ranker.print_top_rankings(top_n)
     
     # Save rankings to file
     filename, file_extension = os.path.splitext(output)
+    file_extension = file_extension.lstrip('.')
     ranker.save_rankings(folder=csv_folder, fname=filename, ext=file_extension) #For sabing and caching
-    ranker.save_rankings(folder="docs/cache", fname=filename, ext=file_extension) #For plotting on the web
+    ranker.publish_web_files(fname=filename, ext=file_extension) #For plotting on the web
     
     print(f"\nElo ranking system completed !")
     print(f"Total runners: {len(ranker.players)}")
     print(f"Total races processed: {len(ranker.race_history)}")
+    if ranker.pending_reviews():
+        print(f"Pairs of names to review: {len(ranker.pending_reviews())} (python rank.py --resolve_reviews)")
+
+    if profile:
+        print()
+        ranker.profiler.print_report()
+        ranker.profiler.save(profile)
 
 
 def find_outlier(element, folder_path = './data/csv'):
@@ -715,12 +1917,11 @@ def find_outlier(element, folder_path = './data/csv'):
         element (str): string to search for in the files
         folder_path (str, optional): Folder where to scan the different files. Defaults to './CX'.
     """
-    for file in sorted(os.listdir(folder_path)):
-        file_path = os.path.join(folder_path,file)
-        if os.path.isfile(file_path):
-            csv = get_csv(file_path)
-            if any([element in el for el in csv['name'].to_list()]):
-                print(file_path)
+    paths = [os.path.join(folder_path, file) for file in sorted(os.listdir(folder_path))]
+    paths = [path for path in paths if os.path.isfile(path) and path.endswith('.csv')]
+    for file_path, csv in zip(paths, read_race_csvs(paths)):
+        if any([element in el for el in csv['name'].to_list()]):
+            print(file_path)
 
 
 # %%
@@ -735,8 +1936,24 @@ if __name__ == '__main__':
                        help='Output CSV file for rankings')
     parser.add_argument('--top_n', type=int, default=None,
                        help='Number of top rankings to display')
+    parser.add_argument('--profile', type=str, nargs='?', const='profile.json', default=None,
+                       help='Print the wall time and counters of each stage and save them to the given JSON file (default: profile.json)')
+    parser.add_argument('--by_category', action='store_true',
+                       help='Also compute one ranking per category, in parallel (saved to <csv_folder>/categories)')
+    parser.add_argument('--groups', type=str, nargs='+', default=None,
+                       help='Groups of categories ranked together instead of one ranking per category, e.g. men=E,S,V women=F/E,F/S,F/V')
+    parser.add_argument('--category', type=str, default=None,
+                       help='Category (or group) whose top rankings are displayed with --top_n')
+    
+    parser.add_argument('--review', type=str, choices=REVIEW_MODES, default=None,
+                       help='Ask about similar names at once, or defer them to the review queue (default: ask in a terminal, defer otherwise)')
+    parser.add_argument('--provisional', type=str, choices=PROVISIONAL_POLICIES, default='different',
+                       help='Decision applied to deferred pairs of names until they are reviewed (default: different)')
+    parser.add_argument('--resolve_reviews', action='store_true',
+                       help='Ask about the deferred pairs of names of the previous ranking and apply the answers')
     
     args = parser.parse_args()
     
-    main(args.csv_folder, args.output, args.top_n)
+    main(args.csv_folder, args.output, args.top_n, args.profile, args.by_category, args.groups, args.category,
+         args.review, args.provisional, args.resolve_reviews)
 # %%
@@ -0,0 +1,129 @@
+#%%
+import os
+import json
+from persistence import atomic_write
+
+#%%
+
+class ReviewQueue:
+    def __init__(self, cache_dir, cache_file='review_queue.json'):
+        """
+        Ambiguous name matches waiting for a decision.
+
+        When questions are deferred, each pair of names whose similarity is between the two thresholds of
+        Ranker.find_similar_name is recorded here instead of being asked, with the decision applied
+        provisionally in the meantime. Pairs are identified by their sorted normalized names.
+
+        Args:
+            cache_dir (str): folder of the cache file
+            cache_file (str, optional): name of the cache file. Defaults to 'review_queue.json'.
+        """
+        self.cache_path = os.path.join(cache_dir, cache_file)
+        self.entries = {} # (normalized name, normalized name) -> entry
+
+
+    def __len__(self):
+        return len(self.entries)
+
+
+    def __contains__(self, pair):
+        return pair in self.entries
+
+
+    def get(self, pair):
+        return self.entries.get(pair)
+
+
+    def add(self, pair, name, normalized_name, candidate, candidate_normalized, score, provisional, race_name=None):
+        """
+        Records an ambiguous pair, or the race of another occurrence of a recorded pair
+
+        Args:
+            pair (tuple): sorted normalized names of the pair
+            name (str): name found in the race
+            normalized_name (str): normalized form of name
+            candidate (str): name of the known runner it may be
+            candidate_normalized (str): normalized form of candidate
+            score (float): similarity of the two names
+            provisional (str): 'same' or 'different', decision applied until the pair is reviewed
+            race_name (str, optional): race where the pair was found. Defaults to None.
+
+        Returns:
+            dict: entry of the pair
+        """
+        entry = self.entries.get(pair)
+        if entry is None:
+            entry = {'pair': list(pair), 'name': name, 'normalized_name': normalized_name, 'candidate': candidate,
+                     'candidate_normalized': candidate_normalized, 'score': round(score, 4), 'provisional': provisional, 'races': []}
+            self.entries[pair] = entry
+        if race_name and race_name not in entry['races']:
+            entry['races'].append(race_name)
+        return entry
+
+
+    def remove(self, pair):
+        self.entries.pop(pair, None)
+
+
+    def renormalize(self, normalize):
+        """
+        Computes the normalized names of the entries again from their names, e.g. when the normalization 
+        of the names changes. Entries which then have the same pair are merged.
+
+        Args:
+            normalize (callable): raw name -> normalized name
+        """
+        entries = {}
+        for entry in self.entries.values():
+            entry['normalized_name'] = normalize(entry['name'])
+            entry['candidate_normalized'] = normalize(entry['candidate'])
+            pair = tuple(sorted([entry['normalized_name'], entry['candidate_normalized']]))
+            entry['pair'] = list(pair)
+            if pair in entries:
+                entries[pair]['races'].extend(race for race in entry['races'] if race not in entries[pair]['races'])
+            else:
+                entries[pair] = entry
+        self.entries = entries
+
+
+    def pending(self):
+        """
+        Returns:
+            list of dict: entries waiting for a decision, in the order they were found
+        """
+        return list(self.entries.values())
+
+
+    def save(self):
+        """
+        Save the queue to its cache file as JSON
+        """
+        try:
+            atomic_write(self.cache_path, json.dumps(self.pending(), indent=2, ensure_ascii=False))
+            print(f"Review queue saved to cache: {self.cache_path}")
+            return True
+        except Exception as e:
+            print(f"Error saving review queue to cache: {e}")
+            return False
+
+
+    def load(self):
+        """
+        Load the queue from its cache file
+        """
+        self.entries = {}
+        if os.path.exists(self.cache_path):
+            try:
+                with open(self.cache_path, 'r', encoding='utf-8') as f:
+                    for entry in json.load(f):
+                        self.entries[tuple(entry['pair'])] = entry
+                print(f"Review queue loaded from cache: {self.cache_path}")
+            except Exception as e:
+                print(f"Error loading review queue from cache: {e}")
+        return self
+
+
+    def clear(self):
+        self.entries = {}
+        if os.path.exists(self.cache_path):
+            os.remove(self.cache_path)
@@ -0,0 +1,291 @@
+#%%
+import os
+import json
+import time
+import itertools
+import multiprocessing
+import numpy as np
+import openelo
+from rank import Ranker, race_weights, standing_places
+from race_store import RaceStore, ABANDON
+from persistence import SegmentLog
+
+#%%
+
+class ReplayArchive:
+    def __init__(self, race_names, dates, standings, n_runners):
+        """
+        Races of a ranking, parsed once and kept in memory to be rated again under other settings.
+
+        Args:
+            race_names (list of str): file name of each race, in the order they were rated
+            dates (list of datetime.date): date of each race (None if unknown)
+            standings (list of tuple): (first place, last place, runner id) int32 arrays of each race,
+                                       in the format of Ranker.process_race
+            n_runners (int): number of runner ids
+        """
+        self.race_names = race_names
+        self.dates = dates
+        self.standings = standings
+        self.n_runners = n_runners
+
+
+    def __len__(self):
+        return len(self.race_names)
+
+
+    @classmethod
+    def from_race_store(cls, race_history):
+        """
+        Builds the archive from the race history of a ranker (names already resolved)
+        """
+        dates = [Ranker.parse_race_date(race_name) for race_name in race_history.race_names]
+        # Races without a date get the first date, as in Ranker.get_catalogue
+        first_date = min([date for date in dates if date is not None], default=None)
+        standings = []
+        for race_idx in range(len(race_history)):
+            places, name_ids, _ = race_history.race(race_idx)
+            place_1, place_2 = standing_places(np.where(places == ABANDON, np.nan, places.astype(float)))
+            standings.append((place_1.astype(np.int32), place_2.astype(np.int32), name_ids.astype(np.int32)))
+        return cls(list(race_history.race_names), [date or first_date for date in dates], standings, len(race_history.names))
+
+
+    @classmethod
+    def load(cls, cache_dir='./cache', csv_folder=None):
+        """
+        Loads the archive from the race history cache of cache_dir (and the segments of its log). If there is none and csv_folder is given,
+        the races of csv_folder are ranked first (similar names being deferred to the review queue).
+        """
+        cache_path = os.path.join(cache_dir, 'race_history.npz')
+        if not os.path.exists(cache_path):
+            if csv_folder is None:
+                raise FileNotFoundError(f"No race history in {cache_dir}: rank the races first")
+            ranker = Ranker(cache_dir=cache_dir, review='defer')
+            ranker.rank(csv_folder)
+            return cls.from_race_store(ranker.race_history)
+        segments, _ = SegmentLog(os.path.join(cache_dir, 'race_history.log')).read()
+        return cls.from_race_store(RaceStore.load(cache_path, segments))
+
+
+def pairwise_order(ratings, place_1, place_2, runner_ids, known):
+    """
+    Pairs of runners of one race whose order is predicted by their ratings before the race.
+    A runner is ahead of another when its last place is before the first place of the other
+    (abandons are not ordered among themselves). Equal ratings count as half a correct prediction.
+
+    Args:
+        ratings (np.ndarray): rating of each runner before the race
+        place_1, place_2 (np.ndarray): first and last place of the tie of each runner
+        runner_ids (np.ndarray): runner id of each runner
+        known (np.ndarray): True for the runners who already raced
+
+    Returns:
+        tuple: correct predictions and pairs, over all pairs and over the pairs of runners who already raced
+    """
+    ordered = (place_2[:, None] < place_1[None, :]) & (runner_ids[:, None] != runner_ids[None, :])
+    difference = ratings[:, None] - ratings[None, :]
+    score = np.where(difference > 0, 1.0, np.where(difference == 0, 0.5, 0.0))
+    known_ordered = ordered & known[:, None] & known[None, :]
+    return score[ordered].sum(), int(ordered.sum()), score[known_ordered].sum(), int(known_ordered.sum())
+
+
+def replay(archive, config, players=None):
+    """
+    Rates every race of the archive with one configuration, predicting the order of each race
+    from the ratings before it
+
+    Args:
+        archive (ReplayArchive): races to rate
+        config (dict): 'method_params' (parameters of openelo.EloMMR), 'contest_params' (parameters of
+                       openelo.ContestRatingParams other than the weight) and 'weighting' (see rank.race_weights)
+        players (list, optional): receives the openelo.Player of each runner id (None for the runners of no race).
+                                  Defaults to None (the ratings are not kept).
+
+    Returns:
+        dict: the configuration, its pairwise accuracy over every pair and over the pairs of runners who already raced,
+              the number of pairs of each and the wall time of the replay
+    """
+    start = time.perf_counter()
+    method = openelo.EloMMR(**config.get('method_params', {}))
+    contest_params = config.get('contest_params', {})
+    weights = race_weights(archive.dates, config.get('weighting', 'uniform'))
+    if players is None:
+        players = []
+    players[:] = [None] * archive.n_runners
+    raced = np.zeros(archive.n_runners, dtype=bool)
+    correct = pairs = known_correct = known_pairs = 0
+
+    for (place_1, place_2, runner_ids), date, weight in zip(archive.standings, archive.dates, weights):
+        race_players = []
+        for runner_id in runner_ids.tolist():
+            if players[runner_id] is None:
+                players[runner_id] = openelo.Player()
+            race_players.append(players[runner_id])
+
+        # Prediction of the race from the ratings before it
+        ratings = np.array([player.approx_posterior.mu for player in race_players])
+        race_correct, race_pairs, race_known_correct, race_known_pairs = pairwise_order(ratings, place_1, place_2, runner_ids,
+                                                                                      raced[runner_ids])
+        correct += race_correct
+        pairs += race_pairs
+        known_correct += race_known_correct
+        known_pairs += race_known_pairs
+
+        # Rating update, as in Ranker.process_race
+        standings = [list(standing) for standing in zip(race_players, place_1.tolist(), place_2.tolist())]
+        crp = openelo.ContestRatingParams(weight=weight, **contest_params)
+        if date:
+            method.round_update(crp, standings, contest_time=10000*date.year + 100*date.month + date.day)
+        else:
+            method.round_update(crp, standings)
+        raced[runner_ids] = True
+
+    return {
+        'config': config,
+        'accuracy': correct / pairs if pairs else None,
+        'known_accuracy': known_correct / known_pairs if known_pairs else None,
+        'pairs': pairs,
+        'known_pairs': known_pairs,
+        'runtime_s': round(time.perf_counter() - start, 6),
+    }
+
+
+# Archive of the worker processes, received once when they start
+_archive = None
+
+
+def init_worker(archive):
+    global _archive
+    _archive = archive
+
+
+def replay_config(config):
+    return replay(_archive, config)
+
+
+def parameter_grid(method_grid=None, contest_grid=None, weightings=('uniform',)):
+    """
+    Every combination of the given parameter values
+
+    Args:
+        method_grid (dict, optional): openelo.EloMMR parameter -> list of values. Defaults to None (default parameters).
+        contest_grid (dict, optional): openelo.ContestRatingParams parameter -> list of values. Defaults to None.
+        weightings (list of str, optional): weighting schemes of the races. Defaults to ('uniform',).
+
+    Returns:
+        list of dict: configurations for replay
+    """
+    method_grid = method_grid or {}
+    contest_grid = contest_grid or {}
+    configs = []
+    for weighting in weightings:
+        for method_values in itertools.product(*method_grid.values()):
+            for contest_values in itertools.product(*contest_grid.values()):
+                configs.append({'method_params': dict(zip(method_grid, method_values)),
+                                'contest_params': dict(zip(contest_grid, contest_values)),
+                                'weighting': weighting})
+    return configs
+
+
+def config_name(config):
+    params = {**config.get('method_params', {}), **config.get('contest_params', {})}
+    return ' '.join([f"weighting={config.get('weighting', 'uniform')}"] + [f'{key}={value}' for key, value in params.items()])
+
+
+def sweep(archive, configs, processes=None):
+    """
+    Replays the archive with each configuration, in a pool of worker processes.
+    The archive is sent once to each worker, not once per configuration.
+
+    Args:
+        archive (ReplayArchive): races to rate
+        configs (list of dict): configurations (see replay)
+        processes (int, optional): number of worker processes. Defaults to None (one per core). 1 replays in this process.
+
+    Returns:
+        list of dict: result of each configuration (see replay), best accuracy first
+    """
+    processes = processes or os.cpu_count() or 1
+    if processes == 1 or len(configs) == 1:
+        results = [replay(archive, config) for config in configs]
+    else:
+        with multiprocessing.Pool(min(processes, len(configs)), initializer=init_worker, initargs=(archive,)) as pool:
+            results = pool.map(replay_config, configs)
+    return sorted(results, key=lambda result: -(result['accuracy'] or 0))
+
+
+def print_results(results):
+    print(f"{'Accuracy':<10} {'Known':<10} {'Time (s)':<10} Configuration")
+    print("-" * 70)
+    for result in results:
+        accuracy = f"{result['accuracy']:.4f}" if result['accuracy'] is not None else 'N/A'
+        known_accuracy = f"{result['known_accuracy']:.4f}" if result['known_accuracy'] is not None else 'N/A'
+        print(f"{accuracy:<10} {known_accuracy:<10} {result['runtime_s']:<10.3f} {config_name(result['config'])}")
+
+
+def parse_values(specs):
+    """
+    Parses parameter values given as 'name=value1,value2' strings, values being read as JSON when possible
+
+    Raises:
+        ValueError: if a spec has no '=' or no value
+
+    Returns:
+        dict: parameter name -> list of values
+    """
+    grid = {}
+    for spec in specs or []:
+        name, _, values = spec.partition('=')
+        if not name.strip() or not values.strip():
+            raise ValueError(f'Invalid parameter values: "{spec}" (expected name=value1,value2)')
+        grid[name.strip()] = []
+        for value in values.split(','):
+            try:
+                grid[name.strip()].append(json.loads(value))
+            except json.JSONDecodeError:
+                grid[name.strip()].append(value.strip())
+    return grid
+
+
+# %%
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser(description='Replay the race history under several rating settings and compare their predictions')
+    parser.add_argument('--cache_dir', type=str, default='./cache',
+                       help='Cache folder holding the race history of a previous ranking')
+    parser.add_argument('--csv_folder', type=str, default='data/csv',
+                       help='Folder containing CSV race files, ranked first if there is no race history')
+    parser.add_argument('--method', type=str, nargs='+', default=None,
+                       help='Values of openelo.EloMMR parameters, e.g. sig_limit=60,80,100 weight_limit=0.1,0.2')
+    parser.add_argument('--contest', type=str, nargs='+', default=None,
+                       help='Values of openelo.ContestRatingParams parameters other than the weight')
+    parser.add_argument('--weighting', type=str, nargs='+', default=['uniform'], choices=['uniform', 'exponential'],
+                       help='Weighting schemes of the races')
+    parser.add_argument('--configs', type=str, default=None,
+                       help='JSON file with a list of configurations, instead of a grid of parameter values')
+    parser.add_argument('--processes', type=int, default=None,
+                       help='Number of worker processes (default: one per core)')
+    parser.add_argument('--output', type=str, default='sweep.json',
+                       help='Output JSON file for the results')
+
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    archive = ReplayArchive.load(args.cache_dir, args.csv_folder)
+    print(f"{len(archive)} races loaded in {time.perf_counter() - start:.3f} s")
+    if args.configs:
+        with open(args.configs, 'r', encoding='utf-8') as f:
+            configs = json.load(f)
+    else:
+        configs = parameter_grid(parse_values(args.method), parse_values(args.contest), args.weighting)
+
+    start = time.perf_counter()
+    results = sweep(archive, configs, args.processes)
+    print(f"{len(configs)} configurations replayed in {time.perf_counter() - start:.3f} s\n")
+    print_results(results)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved to: {args.output}")
+# %%
@@ -0,0 +1,52 @@
+import os
+import json
+import pytest
+
+pytest.importorskip('openelo')
+
+from categories import CategoryRankings
+
+
+def test_reviewed_identities_make_categories_stale(tmp_path):
+    rankings = CategoryRankings({'E': ['E'], 'S': ['S']}, cache_dir=str(tmp_path / 'cache'), docs_dir=str(tmp_path / 'docs'),
+                                ranking_folder=str(tmp_path / 'rankings'))
+    for group in rankings.groups:
+        cache_dir, _, ranking_file = rankings.group_paths(group)
+        os.makedirs(cache_dir)
+        os.makedirs(os.path.dirname(ranking_file), exist_ok=True)
+        with open(os.path.join(cache_dir, 'processed_races.json'), 'w') as f:
+            json.dump({'race.csv': 1}, f)
+        with open(ranking_file, 'w') as f:
+            f.write('rank,name,rating,sigma,races_participated\n')
+    # Caches of previous versions have no revision
+    assert not rankings.is_up_to_date({'race.csv': 1})
+
+    rankings.save_revisions({'E': (1, 1, None), 'S': (1, 1, None)}, 0)
+    assert rankings.is_up_to_date({'race.csv': 1}, 0)
+    assert not rankings.is_up_to_date({'race.csv': 1, 'other.csv': 1}, 0)
+    # Reviewed pairs were replayed in the overall ranking
+    assert not rankings.is_up_to_date({'race.csv': 1}, 1)
+
+    # A failed group is computed again
+    rankings.save_revisions({'E': (1, 1, None), 'S': (None, None, 'error')}, 1)
+    assert not rankings.is_up_to_date({'race.csv': 1}, 1)
+
+
+def test_groups_use_the_settings_and_weights_of_the_overall_ranking(tmp_path, monkeypatch):
+    from benchmark import generate_season, write_season
+    from categories import load_group_ranker
+
+    monkeypatch.chdir(tmp_path)
+    season = generate_season(n_runners=40, n_races=9, field_size=15, typo_rate=0, abandon_rate=0, seed=2)
+    # Every runner is in the group: its ratings are those of the overall ranking
+    write_season([(file_name, df.assign(category=['E', 'S'] * (len(df) // 2) + ['E'] * (len(df) % 2))) for file_name, df in season], 'csv')
+    options = dict(method_params={'sig_limit': 60}, contest_params={}, weighting='exponential')
+    rankings = CategoryRankings({'all': ['E', 'S']}, cache_dir='cache', docs_dir='docs', ranking_folder='rankings', workers=1)
+    ranker, summary = rankings.rank('csv', review='defer', **options)
+    assert summary['all'][2] is None
+
+    _, group_ranker = load_group_ranker('all', cache_dir='cache', docs_dir='docs', ranking_folder='rankings', **options)
+    assert sorted(group_ranker.players) == sorted(ranker.players)
+    for name, player in ranker.players.items():
+        assert group_ranker.players[name].approx_posterior.mu == pytest.approx(player.approx_posterior.mu), name
+        assert group_ranker.players[name].approx_posterior.sig == pytest.approx(player.approx_posterior.sig), name
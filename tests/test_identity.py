@@ -0,0 +1,99 @@
+import os
+import json
+import pytest
+
+from identity import IdentityStore
+
+
+@pytest.fixture
+def store():
+    store = IdentityStore()
+    for name in ['Alice Smith', 'Alice Smyth', 'Bob Jones', 'Carol White']:
+        store.add_runner(name, name.lower())
+    return store
+
+
+def test_union_resolves_every_alias_to_the_merged_runner(store):
+    alice, smyth = store.id_of('Alice Smith'), store.id_of('Alice Smyth')
+    store.add_alias('a smith', alice)
+    root = store.union(alice, smyth)
+
+    assert len(store) == 3
+    assert store.runner_names() == ['Alice Smith', 'Bob Jones', 'Carol White']
+    for alias in ['alice smith', 'alice smyth', 'a smith']:
+        assert store.lookup(alias) == root
+        assert store.name_of(store.alias_ids[alias]) == 'Alice Smith'
+    assert store.id_of('Alice Smyth') is None
+    assert sorted(store.aliases[root]) == ['a smith', 'alice smith', 'alice smyth']
+    # Merging again, or from the other side, changes nothing
+    assert store.union(smyth, alice) == root
+    assert len(store) == 3
+
+
+def test_merged_runner_keeps_the_name_of_the_first_one(store):
+    # Bob's tree is larger: Carol's id goes under it, the merged runner is still named after Carol
+    store.union(store.id_of('Bob Jones'), store.id_of('Alice Smith'))
+    root = store.union(store.id_of('Carol White'), store.id_of('Bob Jones'))
+    assert store.names[root] == 'Carol White'
+    assert store.find(store.ids['Carol White']) == root
+    assert store.lookup('bob jones') == store.lookup('carol white') == store.lookup('alice smith')
+
+
+def test_cannot_link_refuses_the_union(store):
+    store.add_cannot_link('alice smyth', 'alice smith')
+    assert store.cannot_link('alice smith', 'alice smyth')
+    assert store.cannot_link_pairs() == [('alice smith', 'alice smyth')]
+    with pytest.raises(ValueError):
+        store.union(store.id_of('Alice Smith'), store.id_of('Alice Smyth'))
+    # Also through the runners merged with them
+    store.union(store.id_of('Bob Jones'), store.id_of('Alice Smyth'))
+    with pytest.raises(ValueError):
+        store.union(store.id_of('Alice Smith'), store.id_of('Bob Jones'))
+    assert len(store) == 3
+
+
+def test_alias_moves_to_another_runner(store):
+    store.add_alias('a smith', store.id_of('Alice Smith'))
+    store.add_alias('a smith', store.id_of('Alice Smyth'))
+    assert store.name_of(store.lookup('a smith')) == 'Alice Smyth'
+    assert 'a smith' not in store.aliases[store.id_of('Alice Smith')]
+
+
+def test_round_trip(store, tmp_path):
+    store.union(store.id_of('Alice Smith'), store.id_of('Alice Smyth'))
+    store.add_cannot_link('bob jones', 'carol white')
+    store.revision = 2
+    store.normalization = 1
+    path = str(tmp_path / 'identities.npz')
+    with open(path, 'wb') as f:
+        f.write(store.to_bytes())
+
+    loaded = IdentityStore.load(path)
+    assert loaded.runner_names() == store.runner_names()
+    assert {alias: loaded.lookup(alias) for alias in loaded.alias_ids} == {alias: store.lookup(alias) for alias in store.alias_ids}
+    assert loaded.cannot_link_pairs() == store.cannot_link_pairs()
+    assert (loaded.revision, loaded.normalization) == (2, 1)
+    # Merges still work after a load
+    assert loaded.union(loaded.id_of('Alice Smith'), loaded.id_of('Carol White')) == loaded.lookup('alice smyth')
+
+
+def test_legacy_name_caches_are_converted(tmp_path):
+    pytest.importorskip('openelo')
+    from rank import Ranker
+
+    cache_dir = tmp_path / 'cache'
+    cache_dir.mkdir()
+    with open(cache_dir / 'name_mappings.json', 'w', encoding='utf-8') as f:
+        json.dump({'alice smith': 'Alice Smith', 'alice smyth': 'Alice Smith', 'bob jones': 'Bob Jones'}, f)
+    with open(cache_dir / 'different_names.json', 'w', encoding='utf-8') as f:
+        json.dump({'alice smith': ['alice smithson'], 'alice smithson': ['alice smith']}, f)
+
+    ranker = Ranker(cache_dir=str(cache_dir), docs_dir=str(cache_dir / 'docs'))
+    identities = ranker.identities
+    assert identities.runner_names() == ['Alice Smith', 'Bob Jones']
+    assert identities.lookup('alice smyth') == identities.lookup('alice smith')
+    assert identities.cannot_link_pairs() == [('alice smith', 'alice smithson')]
+    assert sorted(ranker.players) == ['Alice Smith', 'Bob Jones']
+    # Written in the current format when the ranker starts
+    assert os.path.exists(cache_dir / 'identities.npz')
+    assert IdentityStore.load(str(cache_dir / 'identities.npz')).cannot_link_pairs() == [('alice smith', 'alice smithson')]
@@ -0,0 +1,86 @@
+import os
+import pytest
+
+openelo = pytest.importorskip('openelo')
+
+from benchmark import generate_season, write_season
+from rank import Ranker, pack_checkpoint, unpack_checkpoint
+
+
+def event_fields(event):
+    return vars(event) if hasattr(event, '__dict__') else event
+
+
+def player_state(player):
+    """Values of a player which must be the same after an incremental run and a full run"""
+    posterior = player.approx_posterior
+    return (posterior.mu, posterior.sig, player.update_time, [event_fields(event) for event in player.event_history])
+
+
+def assert_same_players(players, expected):
+    assert list(players) == list(expected)
+    for name, player in expected.items():
+        assert player_state(players[name]) == player_state(player), name
+
+
+@pytest.fixture
+def season(tmp_path, monkeypatch):
+    # The rankings also write to docs/cache relatively to the working directory
+    monkeypatch.chdir(tmp_path)
+    return generate_season(n_runners=80, n_races=12, field_size=25, typo_rate=0, seed=1)
+
+
+def new_ranker(cache_dir, **kwargs):
+    return Ranker(cache_dir=cache_dir, docs_dir=os.path.join(cache_dir, 'docs'), review='defer', **kwargs)
+
+
+@pytest.mark.parametrize('weighting', ['uniform', 'exponential'])
+def test_incremental_run_matches_full_run(season, weighting):
+    full = new_ranker('full_cache', weighting=weighting)
+    write_season(season, 'full_csv')
+    full.rank('full_csv')
+
+    first = new_ranker('cache', weighting=weighting)
+    write_season(season[:7], 'csv')
+    first.rank('csv')
+    first.save_rankings(folder='csv', fname='ranking')
+    assert os.path.exists(os.path.join('cache', 'rating_state.ckpt'))
+
+    write_season(season[7:], 'csv')
+    incremental = new_ranker('cache', previous_rank=os.path.join('csv', 'ranking.csv'), weighting=weighting)
+    incremental.rank('csv')
+
+    assert incremental.processed_races == full.processed_races
+    assert_same_players(incremental.players, full.players)
+
+
+def test_checkpoint_round_trip(season):
+    ranker = new_ranker('cache')
+    write_season(season, 'csv')
+    ranker.rank('csv')
+
+    state = unpack_checkpoint(pack_checkpoint({'method': ranker.method, 'players': ranker.players}))
+    assert isinstance(state['method'], openelo.EloMMR)
+    assert all(isinstance(player, openelo.Player) for player in state['players'].values())
+    assert_same_players(state['players'], ranker.players)
+
+
+def test_older_race_computes_every_race_again(season, capsys):
+    full = new_ranker('full_cache')
+    write_season(season, 'full_csv')
+    full.rank('full_csv')
+
+    first = new_ranker('cache')
+    write_season(season[:5] + season[7:], 'csv')
+    first.rank('csv')
+    first.save_rankings(folder='csv', fname='ranking')
+
+    write_season(season[5:7], 'csv')
+    incremental = new_ranker('cache', previous_rank=os.path.join('csv', 'ranking.csv'))
+    incremental.rank('csv')
+
+    assert 'computing every race again' in capsys.readouterr().out
+    assert incremental.race_history.race_names == full.race_history.race_names
+    assert sorted(incremental.players) == sorted(full.players)
+    for name, player in full.players.items():
+        assert player_state(incremental.players[name]) == player_state(player), name
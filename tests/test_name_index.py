@@ -0,0 +1,44 @@
+import random
+from difflib import SequenceMatcher
+import pytest
+
+from name_index import NameIndex
+
+
+def random_names(rng, n, letters):
+    return sorted({''.join(rng.choice(letters) for _ in range(rng.randint(1, 9))) + ' ' +
+                   ''.join(rng.choice(letters) for _ in range(rng.randint(1, 7))) for _ in range(n)})
+
+
+def edit(rng, name, letters):
+    """Substitution, insertion, deletion or swap of characters, as in typos"""
+    for _ in range(rng.randint(0, 3)):
+        i = rng.randrange(len(name))
+        kind = rng.randrange(4)
+        if kind == 0:
+            name = name[:i] + rng.choice(letters) + name[i + 1:]
+        elif kind == 1:
+            name = name[:i] + rng.choice(letters) + name[i:]
+        elif kind == 2 and len(name) > 1:
+            name = name[:i] + name[i + 1:]
+        elif i + 1 < len(name):
+            name = name[:i] + name[i + 1] + name[i] + name[i + 2:]
+    return name
+
+
+@pytest.mark.parametrize('threshold', [0.5, 0.7, 0.85, 0.93])
+@pytest.mark.parametrize('letters', ['abc', 'abcdefghijklmnopqrstuvwxyz'])
+def test_candidates_contain_every_match_of_a_full_scan(threshold, letters):
+    rng = random.Random(f'{threshold}{letters}')
+    names = random_names(rng, 200, letters)
+    index = NameIndex()
+    for name in names:
+        index.add(name.upper(), name)
+
+    queries = [edit(rng, rng.choice(names), letters) for _ in range(100)] + ['', 'a', ' ']
+    for query in queries:
+        candidates = index.candidates(query, threshold)
+        matches = [(name.upper(), name) for name in names if SequenceMatcher(None, query, name).ratio() >= threshold]
+        assert set(matches) <= set(candidates), query
+        # In insertion order, without duplicates
+        assert candidates == sorted(set(candidates), key=lambda candidate: index.ordinals[candidate[0]])
@@ -0,0 +1,86 @@
+import os
+import pandas as pd
+import pytest
+
+pytest.importorskip('camelot')
+
+from parse_files import FileParser
+
+
+class TextParser(FileParser):
+    """Reads text files instead of pdf files: one race per line, given as its number of runners"""
+
+    def parse_file(self, file_path):
+        with open(file_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        if content.startswith('broken'):
+            raise ValueError('not a pdf')
+        return [pd.DataFrame({'place': [str(place) for place in range(1, int(size) + 1)],
+                              'name': [f'Runner {place}' for place in range(1, int(size) + 1)],
+                              'club': 'Club', 'category': 'S'}) for size in content.split()]
+
+
+def write_pdfs(folder, files):
+    os.makedirs(folder, exist_ok=True)
+    for file, content in files.items():
+        with open(os.path.join(folder, file), 'w', encoding='utf-8') as f:
+            f.write(content)
+
+
+def read_lengths(folder):
+    return {file: len(pd.read_csv(os.path.join(folder, file))) for file in os.listdir(folder) if file.endswith('.csv')}
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_files_are_parsed_to_distinct_csv_files(tmp_path, jobs):
+    # Only the extension is removed from the name of a file: these two files do not write the same csv files
+    write_pdfs(tmp_path / 'pdf', {'2023.pdf': '3 4', '2023.01.05_race.pdf': '5', 'race.pdf': '6'})
+    errors = TextParser(str(tmp_path / 'pdf'), str(tmp_path / 'csv')).parse_files(jobs=jobs)
+
+    assert errors == {}
+    assert read_lengths(tmp_path / 'csv') == {'2023_0.csv': 3, '2023_1.csv': 4, '2023.01.05_race_0.csv': 5, 'race_0.csv': 6}
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_errors_are_collected_per_file(tmp_path, jobs):
+    write_pdfs(tmp_path / 'pdf', {'a.pdf': '3', 'broken.pdf': 'broken', 'c.pdf': '4'})
+    parser = TextParser(str(tmp_path / 'pdf'), str(tmp_path / 'csv'))
+    errors = parser.parse_files(jobs=jobs)
+
+    assert errors == {'broken.pdf': 'not a pdf'}
+    assert read_lengths(tmp_path / 'csv') == {'a_0.csv': 3, 'c_0.csv': 4}
+    # The failed file is parsed again next time
+    assert sorted(parser.manifest) == ['a.pdf', 'c.pdf']
+
+
+def test_only_new_and_changed_files_are_parsed(tmp_path):
+    pdf, csv = str(tmp_path / 'pdf'), str(tmp_path / 'csv')
+    write_pdfs(pdf, {'a.pdf': '3', 'b.pdf': '4 5', 'c.pdf': '6', 'c.1.pdf': '7'})
+    TextParser(pdf, csv).parse_files()
+    # Files which are written again get a new mtime
+    os.utime(os.path.join(csv, 'a_0.csv'), (0, 0))
+
+    write_pdfs(pdf, {'b.pdf': '8', 'd.pdf': '9'})
+    os.remove(os.path.join(pdf, 'c.pdf'))
+    parser = TextParser(pdf, csv)
+    assert parser.parse_files() == {}
+
+    assert read_lengths(csv) == {'a_0.csv': 3, 'b_0.csv': 8, 'c.1_0.csv': 7, 'd_0.csv': 9}
+    assert os.path.getmtime(os.path.join(csv, 'a_0.csv')) == 0
+    assert parser.manifest['b.pdf']['outputs'] == ['b_0.csv']
+    assert sorted(parser.manifest) == ['a.pdf', 'b.pdf', 'c.1.pdf', 'd.pdf']
+
+
+def test_csv_names_of_previous_versions_are_replaced(tmp_path):
+    pdf, csv = str(tmp_path / 'pdf'), str(tmp_path / 'csv')
+    write_pdfs(pdf, {'2023.pdf': '3', '2023.01.05_race.pdf': '4'})
+    parser = TextParser(pdf, csv)
+    # Previous versions wrote both files to 2023_0.csv
+    write_pdfs(csv, {'2023_0.csv': 'place,name,club,category\n1,Runner 1,Club,S\n'})
+    parser.manifest = {file: {'hash': parser.file_hash(file), 'outputs': ['2023_0.csv']} for file in parser.files}
+    parser.save_manifest()
+
+    parser = TextParser(pdf, csv)
+    assert parser.parse_files() == {}
+    assert read_lengths(csv) == {'2023_0.csv': 3, '2023.01.05_race_0.csv': 4}
+    assert parser.manifest['2023.01.05_race.pdf']['outputs'] == ['2023.01.05_race_0.csv']
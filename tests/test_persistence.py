@@ -0,0 +1,112 @@
+import os
+import json
+import pytest
+
+from persistence import WriteBehindCache, atomic_write, write_if_changed
+
+
+class Writer:
+    """Cache writer saving content as JSON, failing while failing is True"""
+
+    def __init__(self, path):
+        self.path = path
+        self.content = None
+        self.failing = False
+
+    def __call__(self):
+        if self.failing:
+            return False
+        atomic_write(self.path, json.dumps(self.content))
+        return True
+
+
+@pytest.fixture
+def writer(tmp_path):
+    return Writer(str(tmp_path / 'names.json'))
+
+
+@pytest.fixture
+def cache(tmp_path, writer):
+    cache = WriteBehindCache(str(tmp_path))
+    cache.register('names', writer)
+    return cache
+
+
+def test_journal_is_replayed_until_a_flush(cache, writer, tmp_path):
+    writer.content = {'a': 1}
+    cache.mark_dirty('names')
+    cache.journal({'same': ['a', 'A']})
+    cache.journal({'different': ['a', 'b']})
+    # The process stops before the flush: the cache file is not written, the journal is kept
+    assert not os.path.exists(writer.path)
+    assert WriteBehindCache(str(tmp_path)).read_journal() == [{'same': ['a', 'A']}, {'different': ['a', 'b']}]
+
+    cache.flush()
+    assert json.load(open(writer.path)) == {'a': 1}
+    assert not os.path.exists(cache.journal_path)
+    assert WriteBehindCache(str(tmp_path)).read_journal() == []
+
+
+def test_partial_last_record_is_ignored(cache):
+    cache.journal({'same': ['a', 'A']})
+    with open(cache.journal_path, 'a', encoding='utf-8') as f:
+        f.write('{"different": ["a", ')
+    assert cache.read_journal() == [{'same': ['a', 'A']}]
+
+
+def test_failed_writer_keeps_the_journal(cache, writer):
+    writer.failing = True
+    cache.mark_dirty('names')
+    cache.journal({'same': ['a', 'A']})
+    cache.flush()
+    assert cache.dirty == {'names'}
+    assert cache.read_journal() == [{'same': ['a', 'A']}]
+
+    writer.failing = False
+    cache.flush()
+    assert cache.dirty == set()
+    assert cache.read_journal() == []
+
+
+def test_maybe_flush_waits_for_the_interval(cache, writer, tmp_path):
+    cache.mark_dirty('names')
+    cache.maybe_flush()
+    assert not os.path.exists(writer.path)
+
+    periodic = WriteBehindCache(str(tmp_path), flush_interval=0)
+    periodic.register('names', writer)
+    periodic.mark_dirty('names')
+    periodic.maybe_flush()
+    assert os.path.exists(writer.path)
+
+
+def test_atomic_writes_leave_no_temporary_file(tmp_path):
+    path = str(tmp_path / 'file.json')
+    atomic_write(path, '{}')
+    assert not write_if_changed(path, '{}')
+    assert write_if_changed(path, '[]')
+    assert open(path).read() == '[]'
+    assert os.listdir(tmp_path) == ['file.json']
+
+
+def test_answers_are_recovered_after_an_unflushed_exit(tmp_path):
+    pytest.importorskip('openelo')
+    from rank import Ranker
+
+    cache_dir = str(tmp_path / 'cache')
+    ranker = Ranker(cache_dir=cache_dir, docs_dir=os.path.join(cache_dir, 'docs'))
+    ranker.get_or_create_player('Jean Dupont')
+    ranker.checkpoint()
+    ranker.record_answer('jean dupond', 'Jean Dupont', 'jean dupont', True)
+    ranker.record_answer('jean dupons', 'Jean Dupont', 'jean dupont', False)
+    # The process stops without a flush
+    assert os.path.exists(ranker.cache.journal_path)
+    del ranker
+
+    ranker = Ranker(cache_dir=cache_dir, docs_dir=os.path.join(cache_dir, 'docs'))
+    assert ranker.identities.name_of(ranker.identities.lookup('jean dupond')) == 'Jean Dupont'
+    assert ranker.identities.cannot_link('jean dupons', 'jean dupont')
+    # Written to the identities when the ranker starts, the journal is then cleared
+    assert not os.path.exists(ranker.cache.journal_path)
+    identities = Ranker(cache_dir=cache_dir, docs_dir=os.path.join(cache_dir, 'docs')).identities
+    assert identities.name_of(identities.lookup('jean dupond')) == 'Jean Dupont'
@@ -0,0 +1,96 @@
+import os
+import gzip
+import json
+import pytest
+
+import publish as publish_module
+from publish import content_hash, publish
+
+
+def write_sources(folder, files):
+    for name, content in files.items():
+        path = os.path.join(folder, *name.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+
+
+@pytest.fixture
+def site(tmp_path):
+    source, site = str(tmp_path / 'docs' / 'cache'), str(tmp_path / 'docs')
+    write_sources(source, {'ranking.csv': 'rank,name\n1,Anne\n', 'categories/index.json': '{\n  "E": ["E"]\n}',
+                           'race_history.jsonl': '{"race_idx": 0}\n{"race_idx": 1', '.ranking.csv.tmp': 'partial'})
+    return source, site
+
+
+def test_files_are_published_under_the_hash_of_their_minified_content(site):
+    source, site = site
+    manifest = publish(source, site)
+
+    assert sorted(manifest['files']) == ['categories/index.json', 'race_history.jsonl', 'ranking.csv']
+    for name, entry in manifest['files'].items():
+        with open(os.path.join(site, *entry['path'].split('/')), 'rb') as f:
+            data = f.read()
+        stem, ext = os.path.splitext(name)
+        assert entry['path'] == f'data/{stem}.{content_hash(data)}{ext}'
+        assert entry['bytes'] == len(data)
+        assert entry['variants'] == {}
+    with open(os.path.join(site, manifest['files']['categories/index.json']['path']), 'rb') as f:
+        assert f.read() == b'{"E":["E"]}'
+    # The partially written last line is not published
+    with open(os.path.join(site, manifest['files']['race_history.jsonl']['path']), 'rb') as f:
+        assert f.read() == b'{"race_idx":0}\n'
+    with open(os.path.join(site, 'manifest.json'), 'r', encoding='utf-8') as f:
+        assert json.load(f) == manifest
+    # Same files, same version
+    assert publish(source, site)['version'] == manifest['version']
+
+
+def test_manifest_is_written_last(site, monkeypatch):
+    source, site = site
+    written = []
+    atomic_write = publish_module.atomic_write
+    monkeypatch.setattr(publish_module, 'atomic_write', lambda path, data: written.append(path) or atomic_write(path, data))
+    publish(source, site)
+    assert written[-1] == os.path.join(site, 'manifest.json')
+    assert len(written) == 4
+
+
+def test_files_of_older_versions_are_removed(site):
+    source, site = site
+    first = publish(source, site)
+    write_sources(source, {'ranking.csv': 'rank,name\n1,Bruno\n'})
+    second = publish(source, site)
+    write_sources(source, {'ranking.csv': 'rank,name\n1,Claire\n'})
+    third = publish(source, site)
+
+    published = {os.path.relpath(os.path.join(folder, name), site).replace(os.sep, '/')
+                 for folder, _, names in os.walk(os.path.join(site, 'data')) for name in names}
+    # The files of the previous manifest are kept for the pages which loaded it
+    assert published == {entry['path'] for manifest in (second, third) for entry in manifest['files'].values()}
+    assert first['files']['ranking.csv']['path'] not in published
+
+
+def test_compressed_variants_are_opt_in(site, capsys):
+    source, site = site
+    manifest = publish(source, site, variants=('.gz',))
+    entry = manifest['files']['ranking.csv']
+    path = os.path.join(site, *entry['path'].split('/'))
+    with gzip.open(path + '.gz', 'rb') as f, open(path, 'rb') as original:
+        assert f.read() == original.read()
+    assert entry['variants'] == {'gz': os.path.getsize(path + '.gz')}
+
+    # Variants which are no longer written are removed with the files of older versions
+    publish(source, site)
+    publish(source, site)
+    assert not os.path.exists(path + '.gz')
+
+    manifest = publish(source, site, variants=('.br',))
+    if publish_module.brotli is None:
+        assert 'brotli is not installed' in capsys.readouterr().out
+        assert manifest['files']['ranking.csv']['variants'] == {}
+    else:
+        assert os.path.exists(path + '.br')
+
+    with pytest.raises(ValueError):
+        publish(source, site, variants=('.zip',))
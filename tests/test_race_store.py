@@ -0,0 +1,165 @@
+import os
+import numpy as np
+import pytest
+
+from persistence import SegmentLog, atomic_write
+from race_store import RaceStore, ABANDON
+
+
+def add_race(store, i):
+    names = [f'Runner {i}', f'Runner {i + 1}', 'Common Runner']
+    return store.append(f'race_{i}.csv', ['1', '2', 'Ab.'], names, [f'Club {i}', 'Club', 'Club'])
+
+
+def assert_same_races(store, expected):
+    assert store.race_names == expected.race_names
+    for race_idx in range(len(expected)):
+        assert store.race_data(race_idx).equals(expected.race_data(race_idx))
+
+
+def save(store, path, log):
+    """Same steps as Ranker.save_race_history, without the web interface files"""
+    if store.saved is None:
+        store.next_generation()
+        atomic_write(path, store.to_bytes())
+        log.clear()
+        store.mark_saved(compacted=True)
+    elif store.unsaved_races():
+        log.append(store.segment_bytes())
+        store.mark_saved()
+
+
+def load(path, log):
+    segments, _ = log.read()
+    return RaceStore.load(path, segments)
+
+
+@pytest.fixture
+def files(tmp_path):
+    return str(tmp_path / 'race_history.npz'), SegmentLog(str(tmp_path / 'race_history.log'))
+
+
+def test_segments_are_appended_to_the_table(files):
+    path, log = files
+    store = RaceStore()
+    add_race(store, 0)
+    save(store, path, log)
+    for i in range(1, 4):
+        add_race(store, i)
+        save(store, path, log)
+
+    loaded = load(path, log)
+    assert loaded.n_segments == 3
+    assert_same_races(loaded, store)
+
+
+def test_interrupted_compaction(files):
+    # The table is written but the log is not cleared: its segments are already in the table
+    path, log = files
+    store = RaceStore()
+    add_race(store, 0)
+    save(store, path, log)
+    for i in range(1, 3):
+        add_race(store, i)
+        save(store, path, log)
+    store.next_generation()
+    atomic_write(path, store.to_bytes())
+
+    loaded = load(path, log)
+    assert_same_races(loaded, store)
+    # The compaction is done again at the next save, then new races are appended
+    assert loaded.saved is None
+    save(loaded, path, log)
+    assert log.read()[0] == []
+    add_race(loaded, 3)
+    save(loaded, path, log)
+    add_race(store, 3)
+    assert_same_races(load(path, log), store)
+
+
+def test_interrupted_compaction_after_truncate(files):
+    # Stale segments may hold races which were removed, and follow the compacted table
+    path, log = files
+    store = RaceStore()
+    add_race(store, 0)
+    save(store, path, log)
+    add_race(store, 1)
+    save(store, path, log)
+    store.truncate(1)
+    add_race(store, 5)
+    store.next_generation()
+    atomic_write(path, store.to_bytes())
+
+    assert_same_races(load(path, log), store)
+
+
+def test_torn_tail(files):
+    # The last segment was not completely written: the races before it are loaded, and the next segment replaces it
+    path, log = files
+    store = RaceStore()
+    add_race(store, 0)
+    save(store, path, log)
+    add_race(store, 1)
+    save(store, path, log)
+    expected = load(path, log)
+    add_race(store, 2)
+    save(store, path, log)
+    os.truncate(log.path, os.path.getsize(log.path) - 10)
+
+    loaded = load(path, log)
+    assert_same_races(loaded, expected)
+    add_race(loaded, 3)
+    save(loaded, path, log)
+    add_race(expected, 3)
+    assert_same_races(load(path, log), expected)
+
+
+def test_segment_must_follow_the_table(files):
+    path, log = files
+    store = RaceStore()
+    add_race(store, 0)
+    save(store, path, log)
+    add_race(store, 1)
+    save(store, path, log)
+    segment = log.read()[0][0]
+
+    other = RaceStore()
+    with pytest.raises(ValueError):
+        other.apply_segment(segment)
+    assert np.array_equal(other.offsets, [0])
+
+
+def test_ranker_interrupted_compaction(tmp_path, monkeypatch):
+    rank = pytest.importorskip('rank')
+    ranker = rank.Ranker(cache_dir=str(tmp_path / 'cache'), docs_dir=str(tmp_path / 'docs'))
+    store = RaceStore()
+    add_race(store, 0)
+    ranker.save_race_history(store)
+    add_race(store, 1)
+    ranker.save_race_history(store)
+
+    def crash(log):
+        raise OSError('interrupted')
+    monkeypatch.setattr(SegmentLog, 'clear', crash)
+    ranker.compact_race_history(store)
+    monkeypatch.undo()
+
+    loaded = ranker.load_race_history()
+    assert_same_races(loaded, store)
+    ranker.save_race_history(loaded)
+    assert ranker.load_race_history().n_segments == 0
+
+
+def test_places_are_parsed_as_numbers():
+    # Same parsing as Ranker.process_race: any place which is not a number is an abandon
+    store = RaceStore()
+    store.append('race.csv', ['1', ' 2', '3.0', 4, 'Ab.', '', None], list('abcdefg'), ['club'] * 7)
+    assert store.race(0)[0].tolist() == [1, 2, 3, 4, ABANDON, ABANDON, ABANDON]
+
+
+def test_places_must_fit_int16():
+    store = RaceStore()
+    store.append('race.csv', ['1', '32767'], ['a', 'b'], ['club', 'club'])
+    with pytest.raises(ValueError):
+        store.append('other.csv', ['1', '32768'], ['a', 'b'], ['club', 'club'])
+    assert len(store) == 1 and store.n_rows == 2
@@ -0,0 +1,136 @@
+import os
+import re
+import random
+import pandas as pd
+import pytest
+
+openelo = pytest.importorskip('openelo')
+
+from identity import IdentityStore
+from race_store import MAX_PLACE
+from rank import LEGACY_ACCENTS, NORMALIZATION_VERSION, Ranker, legacy_normalize_name, normalize_name
+from review import ReviewQueue
+
+
+def player_state(player):
+    posterior = player.approx_posterior
+    return posterior.mu, posterior.sig, player.update_time, len(player.event_history)
+
+
+@pytest.fixture
+def ranker(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    return Ranker(cache_dir=cache_dir, docs_dir=os.path.join(cache_dir, 'docs'), resolve_names=False)
+
+
+def race(places, names):
+    return pd.DataFrame({'place': places, 'name': names, 'club': ['Club'] * len(names)})
+
+
+def test_out_of_range_place_leaves_the_ratings_unchanged(ranker):
+    ranker.process_race(race(['1', '2', 'Ab.'], ['Anne', 'Bruno', 'Claire']), race_name='race_1.csv')
+    players = {name: player_state(player) for name, player in ranker.players.items()}
+
+    with pytest.raises(ValueError):
+        ranker.process_race(race(['1', str(MAX_PLACE + 1)], ['Anne', 'Denis']), race_name='race_2.csv')
+
+    assert {name: player_state(player) for name, player in ranker.players.items()} == players
+    assert ranker.race_history.race_names == ['race_1.csv']
+    assert ranker.timeline.n_races == 1
+    assert sorted(ranker.participations) == ['Anne', 'Bruno', 'Claire']
+
+
+@pytest.fixture
+def deferred(tmp_path, monkeypatch):
+    # Jean Dupont, Jean Dupond and Jean Dupons are similar enough for their pairs to be deferred
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('csv')
+    for day, name in enumerate(['Jean Dupont', 'Jean Dupond', 'Jean Dupons'], start=1):
+        race([1, 2, 3], [name, 'Anne Martin', 'Bruno Leroy']).to_csv(os.path.join('csv', f'2024-01-0{day}_race.csv'), index=False)
+    ranker = Ranker(cache_dir='cache', docs_dir=os.path.join('cache', 'docs'), review='defer')
+    ranker.rank('csv')
+    return ranker
+
+
+def review_state(ranker):
+    return (ranker.identities.to_bytes(), [entry['pair'] for entry in ranker.pending_reviews()],
+            {name: player_state(player) for name, player in ranker.players.items()}, list(ranker.race_history.race_names))
+
+
+def test_reviews_are_applied_all_or_nothing(deferred):
+    pairs = {tuple(entry['pair']): entry for entry in deferred.pending_reviews()}
+    assert sorted(pairs) == [('jean dupond', 'jean dupons'), ('jean dupond', 'jean dupont'), ('jean dupons', 'jean dupont')]
+    before = review_state(deferred)
+
+    with pytest.raises(KeyError):
+        deferred.apply_reviews({('jean dupond', 'jean dupont'): False, ('anne martin', 'jean dupont'): True}, folder='csv')
+    assert review_state(deferred) == before
+
+    # The last decision merges runners the first one records as different people
+    decisions = {('jean dupons', 'jean dupont'): False, ('jean dupond', 'jean dupont'): True, ('jean dupond', 'jean dupons'): True}
+    with pytest.raises(ValueError):
+        deferred.apply_reviews(decisions, folder='csv')
+    assert review_state(deferred) == before
+
+    os.remove(os.path.join('csv', '2024-01-03_race.csv'))
+    with pytest.raises(FileNotFoundError):
+        deferred.apply_reviews({('jean dupond', 'jean dupont'): False, ('jean dupons', 'jean dupont'): True}, folder='csv')
+    assert review_state(deferred) == before
+
+    # Decisions matching the provisional one do not read the races again
+    assert deferred.apply_reviews({('jean dupond', 'jean dupont'): False}, folder='csv') == 0
+    assert len(deferred.pending_reviews()) == 2
+
+
+def baseline_normalize_name(name):
+    """normalize_name of the first versions, whose outputs are the aliases of their identities"""
+    normalized = re.sub(r'\s+', ' ', name.lower().strip())
+    for accented, replacement in LEGACY_ACCENTS.items():
+        normalized = normalized.replace(accented, replacement)
+    return re.sub(r'[^a-z0-9\s]', '', normalized)
+
+
+def test_legacy_normalize_name_matches_the_first_versions():
+    rng = random.Random(0)
+    alphabet = 'abcXYZ019 -\'.\t ' + ''.join(LEGACY_ACCENTS) + 'ÁÉÀÇÑÖáåøßœłżİﬁＪ́_'
+    names = [''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 20))) for _ in range(5000)]
+    names += ['  Jean  -  Pierre ', 'Hélène Gauß', 'FRANÇOIS Müller', 'Ángel Núñez', 'Łukasz Żółć']
+    for name in names:
+        assert legacy_normalize_name(name) == baseline_normalize_name(name), repr(name)
+
+
+@pytest.mark.parametrize('name, normalized', [
+    ('Jean-Pierre DUPONT', 'jeanpierre dupont'),
+    ('  Jean  -  Pierre ', 'jean  pierre'),
+    ('Hélène Gauß', 'helene gauss'),
+    ('Ángel Núñez', 'angel nunez'),
+    ('Øyvind Ødegård', 'oyvind odegard'),
+    ('Łukasz Żółć', 'lukasz zolc'),
+    ('ﬁlip O\'Brien', 'filip obrien'),
+    ('Ｊean', 'jean'),
+])
+def test_normalize_name_folds_every_accent(name, normalized):
+    assert normalize_name(name) == normalized
+
+
+def test_identities_of_previous_versions_are_migrated(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    os.makedirs(cache_dir)
+    # Identities and review queue written with legacy_normalize_name
+    identities = IdentityStore()
+    identities.add_runner('Ángel Núñez', 'ngel nnez')
+    identities.add_runner('Angela Nunes', 'angela nunes')
+    identities.add_cannot_link('angela nunes', 'ngel nnez')
+    with open(os.path.join(cache_dir, 'identities.npz'), 'wb') as f:
+        f.write(identities.to_bytes())
+    queue = ReviewQueue(cache_dir)
+    queue.add(('ngel nnes', 'ngel nnez'), 'Ángel Nuñes', 'ngel nnes', 'Ángel Núñez', 'ngel nnez', 0.9, 'different', 'race.csv')
+    queue.save()
+
+    ranker = Ranker(cache_dir=cache_dir, docs_dir=os.path.join(cache_dir, 'docs'))
+    for store in (ranker.identities, IdentityStore.load(os.path.join(cache_dir, 'identities.npz'))):
+        assert store.normalization == NORMALIZATION_VERSION
+        assert store.name_of(store.lookup('angel nunez')) == 'Ángel Núñez'
+        assert store.name_of(store.lookup('ngel nnez')) == 'Ángel Núñez'
+        assert store.cannot_link('angel nunez', 'angela nunes')
+    assert [entry['pair'] for entry in ReviewQueue(cache_dir).load().pending()] == [['angel nunes', 'angel nunez']]
@@ -0,0 +1,69 @@
+import os
+import numpy as np
+import pytest
+
+pytest.importorskip('openelo')
+
+from benchmark import generate_season, write_season
+from rank import Ranker
+from sweep import ReplayArchive, pairwise_order, replay
+
+
+def brute_force_order(ratings, place_1, place_2, runner_ids, known):
+    correct = pairs = known_correct = known_pairs = 0
+    for i in range(len(ratings)):
+        for j in range(len(ratings)):
+            if place_2[i] < place_1[j] and runner_ids[i] != runner_ids[j]:
+                score = 1.0 if ratings[i] > ratings[j] else 0.5 if ratings[i] == ratings[j] else 0.0
+                correct += score
+                pairs += 1
+                if known[i] and known[j]:
+                    known_correct += score
+                    known_pairs += 1
+    return correct, pairs, known_correct, known_pairs
+
+
+def test_pairwise_order():
+    # Runner 3 is listed twice, the last two runners abandoned (tied from the 5th to the last place)
+    ratings = np.array([1500.0, 1600.0, 1600.0, 1400.0, 1450.0, 1700.0])
+    place_1 = np.array([0, 1, 2, 3, 4, 4])
+    place_2 = np.array([0, 1, 2, 3, 5, 5])
+    runner_ids = np.array([0, 1, 2, 3, 3, 5])
+    known = np.array([True, True, False, True, True, True])
+    assert pairwise_order(ratings, place_1, place_2, runner_ids, known) == brute_force_order(ratings, place_1, place_2, runner_ids, known)
+    # 13 ordered pairs: runner 3 is not compared with itself, abandons are not ordered among themselves. 
+    # Runners 1 and 2 have the same rating (half a correct prediction)
+    assert pairwise_order(ratings, place_1, place_2, runner_ids, known)[:2] == (6.5, 13)
+
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        n = int(rng.integers(2, 12))
+        ratings = rng.integers(1400, 1410, n).astype(float)
+        n_finished = int(rng.integers(0, n + 1))
+        place_1 = np.concatenate([np.arange(n_finished), np.full(n - n_finished, n_finished)])
+        place_2 = np.concatenate([np.arange(n_finished), np.full(n - n_finished, n - 1)])
+        runner_ids = rng.integers(0, n, n)
+        known = rng.random(n) < 0.7
+        assert pairwise_order(ratings, place_1, place_2, runner_ids, known) == brute_force_order(ratings, place_1, place_2, runner_ids, known)
+
+
+@pytest.mark.parametrize('weighting', ['uniform', 'exponential'])
+def test_replay_matches_the_ranking(tmp_path, monkeypatch, weighting):
+    monkeypatch.chdir(tmp_path)
+    season = generate_season(n_runners=60, n_races=10, field_size=20, typo_rate=0, seed=3)
+    write_season(season, 'csv')
+    ranker = Ranker(cache_dir='cache', docs_dir=os.path.join('cache', 'docs'), review='defer', weighting=weighting)
+    ranker.rank('csv')
+
+    archive = ReplayArchive.load('cache')
+    assert archive.race_names == ranker.race_history.race_names
+    players = []
+    result = replay(archive, {'weighting': weighting}, players)
+    assert result['pairs'] > 0
+
+    names = ranker.race_history.names
+    ratings = {names[runner_id]: player for runner_id, player in enumerate(players) if player is not None}
+    assert sorted(ratings) == sorted(ranker.players)
+    for name, player in ranker.players.items():
+        assert ratings[name].approx_posterior.mu == player.approx_posterior.mu, name
+        assert ratings[name].approx_posterior.sig == player.approx_posterior.sig, name
@@ -0,0 +1,111 @@
+#%%
+import io
+from array import array
+import numpy as np
+
+#%%
+
+class RatingTimeline:
+    def __init__(self):
+        """
+        Append-only table of the rating of each participant after each race.
+
+        Each row holds a race index (in Ranker.race_history), a runner id (in self.names),
+        the place of the runner and its rating (mu) and uncertainty (sigma) after the race.
+        The rows of each runner are indexed, so that its rating curve is a single lookup.
+        """
+        self.race_idx = array('i')
+        self.runner_ids = array('i')
+        self.places = array('i')
+        self.mus = array('d')
+        self.sigmas = array('d')
+        self.names = []      # runner id -> name
+        self.ids = {}        # name -> runner id
+        self.rows = {}       # runner id -> list of row indices
+
+
+    def __len__(self):
+        return len(self.race_idx)
+
+
+    def runner_id(self, name):
+        if name not in self.ids:
+            self.ids[name] = len(self.names)
+            self.names.append(name)
+        return self.ids[name]
+
+
+    def append(self, race_idx, name, place, mu, sigma):
+        """
+        Appends the result and rating of one runner after one race
+        """
+        runner_id = self.runner_id(name)
+        self.rows.setdefault(runner_id, []).append(len(self.race_idx))
+        self.race_idx.append(race_idx)
+        self.runner_ids.append(runner_id)
+        self.places.append(place)
+        self.mus.append(mu)
+        self.sigmas.append(sigma)
+
+
+    def runner(self, name):
+        """
+        Rating curve of one runner
+
+        Returns:
+            list of tuple: (race index, place, mu, sigma) after each race of the runner, in race order
+        """
+        if name not in self.ids:
+            return []
+        return [(self.race_idx[row], self.places[row], self.mus[row], self.sigmas[row]) for row in self.rows[self.ids[name]]]
+
+
+    def truncate(self, n_races):
+        """
+        Removes the rows of the races from index n_races onwards (rows are appended in race order)
+        """
+        n_rows = len(self.race_idx)
+        while n_rows and self.race_idx[n_rows - 1] >= n_races:
+            n_rows -= 1
+        for column in (self.race_idx, self.runner_ids, self.places, self.mus, self.sigmas):
+            del column[n_rows:]
+        self.rows = {}
+        for row, runner_id in enumerate(self.runner_ids):
+            self.rows.setdefault(runner_id, []).append(row)
+
+
+    @property
+    def n_races(self):
+        return max(self.race_idx) + 1 if len(self.race_idx) else 0
+
+
+    def to_bytes(self):
+        """
+        Serializes the timeline as an uncompressed npz archive
+        """
+        buffer = io.BytesIO()
+        np.savez(buffer, race_idx=np.frombuffer(self.race_idx, dtype=np.int32), runner_ids=np.frombuffer(self.runner_ids, dtype=np.int32),
+                 places=np.frombuffer(self.places, dtype=np.int32), mus=np.frombuffer(self.mus, dtype=np.float64),
+                 sigmas=np.frombuffer(self.sigmas, dtype=np.float64), names=np.array(self.names, dtype=str))
+        return buffer.getvalue()
+
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a timeline written by to_bytes, in a single read of the file
+        """
+        with open(path, 'rb') as f:
+            content = f.read()
+        timeline = cls()
+        with np.load(io.BytesIO(content), allow_pickle=False) as data:
+            timeline.race_idx = array('i', data['race_idx'].astype(np.int32).tobytes())
+            timeline.runner_ids = array('i', data['runner_ids'].astype(np.int32).tobytes())
+            timeline.places = array('i', data['places'].astype(np.int32).tobytes())
+            timeline.mus = array('d', data['mus'].astype(np.float64).tobytes())
+            timeline.sigmas = array('d', data['sigmas'].astype(np.float64).tobytes())
+            timeline.names = data['names'].tolist()
+        timeline.ids = {name: runner_id for runner_id, name in enumerate(timeline.names)}
+        for row, runner_id in enumerate(timeline.runner_ids):
+            timeline.rows.setdefault(runner_id, []).append(row)
+        return timeline